@@ -0,0 +1,301 @@
+"""
+Batch processing of the Chandrayaan-2 archive.
+
+Every acquisition of Chandrayaan2.get_dirs()['DATE_MAP'] goes through the
+same pipeline of steps in a pool of worker processes and the result is saved
+to OUTPUT/<date>. A scene is written to OUTPUT/<date>.partial and renamed
+once complete, with a batch.json marker listing the pipeline and the size of
+every file: scenes whose marker matches the pipeline and the files on disk
+are skipped, so an interrupted run is resumed by running it again.
+
+Steps are NAME[:ARG[:ARG]], the scene is loaded first and saved last:
+
+    calibrate[:CONSTANT]
+    computeT / computeC / computeTC
+    multilook:AZxRG[:METHOD]
+    filter[:METHOD[:WIN]]
+
+    python batch.py --steps calibrate computeT multilook:4x4 filter:refined_lee:7
+    python batch.py --dates 20210312 --workers 2 --memory-budget 8G --report timings.json
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import traceback
+import multiprocessing
+
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dir import BASE_PATH
+from sar.sar import SAR
+from sar.store import FORMATS
+
+
+DONE = "batch.json"
+PARTIAL = ".partial"
+
+
+def _calibrate(sar_img: SAR, constant: str = "10000") -> SAR:
+    sar_img.calibrate(constant=float(constant))
+    return sar_img
+
+
+def _compute(matrix: str) -> Callable[[SAR], SAR]:
+    def step(sar_img: SAR) -> SAR:
+        getattr(sar_img, f"compute{matrix}")()
+        return sar_img
+    return step
+
+
+def _multilook(sar_img: SAR, looks: str, method: str = "mean") -> SAR:
+    az, _, rg = looks.lower().partition("x")
+    return sar_img.multilook((int(az), int(rg or 1)), method=method)
+
+
+def _filter(sar_img: SAR, method: str = "refined_lee", win: str = "7") -> SAR:
+    return sar_img.speckle_filter(method, win=int(win))
+
+
+STEPS: Dict[str, Callable[..., SAR]] = {
+        "calibrate": _calibrate,
+        "computeT": _compute("T"),
+        "computeC": _compute("C"),
+        "computeTC": _compute("TC"),
+        "multilook": _multilook,
+        "filter": _filter
+        }
+
+
+class Job(NamedTuple):
+    date        : str
+    path        : Path
+    local_path  : Path
+    output      : Path
+    steps       : Tuple[str, ...]
+    format      : str
+    options     : Dict[str, Any]
+
+
+class Result(NamedTuple):
+    date        : str
+    # 'done', 'skipped' or 'failed'
+    status      : str
+    # seconds per step (load and save included)
+    timings     : Dict[str, float]
+    # peak resident set size of the worker so far
+    peak_rss_mb : float
+    error       : str | None
+
+
+def parse_steps(steps: Sequence[str]) -> List[Tuple[str, List[str]]]:
+    parsed = list()
+    for step in steps:
+        name, *args = step.split(":")
+        if name not in STEPS:
+            raise ValueError(f"un-supported step: {name}. Available steps: {tuple(STEPS)}")
+        parsed.append((name, args))
+    return parsed
+
+
+def _files(path: Path) -> Dict[str, int]:
+    return {
+            file.relative_to(path).as_posix(): file.stat().st_size
+            for file in sorted(path.rglob("*")) if file.is_file() and file.name != DONE
+            }
+
+
+def is_complete(job: Job) -> bool:
+    """
+    True if job.output holds the result of the same pipeline, with every file
+    written by it still there and of the same size.
+    """
+    marker = job.output / DONE
+    if not marker.is_file():
+        return False
+    try:
+        done = json.loads(marker.read_text())
+    except json.JSONDecodeError:
+        return False
+    if done.get('steps') != list(job.steps) or done.get('format') != job.format or done.get('options') != job.options:
+        return False
+    return done.get('files') == _files(job.output)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process(job: Job) -> Result:
+    """
+    Runs the pipeline of job on one scene (in a worker process).
+    """
+    if is_complete(job):
+        return Result(job.date, "skipped", {}, _peak_rss_mb(), None)
+    from sar.models import SARChandrayaan2
+
+    timings: Dict[str, float] = dict()
+    partial = job.output.with_name(job.output.name + PARTIAL)
+    try:
+        start = time.perf_counter()
+        sar_img = SARChandrayaan2(job.path, job.local_path)
+        timings['load'] = time.perf_counter() - start
+        for k, (name, args) in enumerate(parse_steps(job.steps)):
+            start = time.perf_counter()
+            sar_img = STEPS[name](sar_img, *args)
+            timings[f"{k}:{name}"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        shutil.rmtree(partial, ignore_errors=True)
+        SAR.save(sar_img, partial, format=job.format, **job.options)
+        done = {
+                'date': job.date,
+                'source': str(job.path),
+                'steps': list(job.steps),
+                'format': job.format,
+                'options': job.options,
+                'files': _files(partial)
+                }
+        (partial / DONE).write_text(json.dumps(done, indent=4))
+        shutil.rmtree(job.output, ignore_errors=True)
+        partial.rename(job.output)
+        timings['save'] = time.perf_counter() - start
+    except Exception as error:
+        shutil.rmtree(partial, ignore_errors=True)
+        message = "".join(traceback.format_exception_only(type(error), error)).strip()
+        return Result(job.date, "failed", timings, _peak_rss_mb(), message)
+    return Result(job.date, "done", timings, _peak_rss_mb(), None)
+
+
+def _init_worker(memory_budget: int | None, threads: int, warmup: bool) -> None:
+    # the numba threads are started (and the kernels compiled) before the
+    # limit is set, they map more address space than they use
+    import numba
+    numba.set_num_threads(threads)
+    if warmup:
+        from sar.precompile import warmup as precompile
+        precompile()
+    if memory_budget is not None:
+        # a scene that does not fit raises MemoryError and fails alone
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_budget, hard))
+
+
+def parse_size(size: str) -> int:
+    """
+    '512M', '8G', '1.5g' or a number of bytes -> bytes.
+    """
+    units = {"k": 2 ** 10, "m": 2 ** 20, "g": 2 ** 30, "t": 2 ** 40}
+    size = size.strip().lower().rstrip("b")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def run(
+        jobs: List[Job],
+        workers: int = 1,
+        memory_budget: int | None = None,
+        warmup: bool = False,
+        callback: Callable[[Result], None] | None = None
+        ) -> List[Result]:
+    """
+    Processes jobs in a pool of workers processes, each limited to
+    memory_budget bytes of address space and cpu_count // workers numba
+    threads. callback is called with every result as it completes.
+    """
+    if workers < 1:
+        raise ValueError(f"workers should be at least 1 [given -> {workers}]")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    results = list()
+    # spawn: forked workers can deadlock on locks held by threads of the
+    # parent (numba threading layer, GDAL)
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(memory_budget, threads, warmup)
+            ) as executor:
+        futures = [executor.submit(process, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if callback is not None:
+                callback(result)
+    return sorted(results, key=lambda result: result.date)
+
+
+def _print_result(result: Result) -> None:
+    from sar.logging import console
+    style = {"done": "success", "skipped": "info", "failed": "danger"}[result.status]
+    total = sum(result.timings.values())
+    steps = " ".join(f"{name}={seconds:.2f}s" for name, seconds in result.timings.items())
+    console.print(f"[{style}]{result.date} {result.status:8s}[/{style}] {total:8.2f} s {result.peak_rss_mb:9.1f} MB  {steps}")
+    if result.error is not None:
+        console.print(f"[danger]    {result.error}[/danger]")
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a processing pipeline over every Chandrayaan-2 acquisition")
+    parser.add_argument("--steps", nargs="+", default=["calibrate", "computeT"], help="NAME[:ARG[:ARG]] steps")
+    parser.add_argument("--dates", nargs="+", default=None, help="only these dates (all of them by default)")
+    parser.add_argument("--output", type=Path, default=BASE_PATH / ".local" / "batch")
+    parser.add_argument("--format", choices=FORMATS, default="npy")
+    parser.add_argument("--compressor", default=None, help="compressor of the 'chunked' format")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory-budget", type=parse_size, default=None,
+                        help="address space limit per worker, e.g. 8G")
+    parser.add_argument("--warmup", action="store_true", help="compile the numba kernels when a worker starts")
+    parser.add_argument("--force", action="store_true", help="process complete scenes again")
+    parser.add_argument("--report", type=Path, default=None, help="JSON report of the per scene timings")
+    args = parser.parse_args(argv)
+    parse_steps(args.steps)
+
+    from manage import get_chandrayaan2Obj
+    chandrayaan2 = get_chandrayaan2Obj()
+    date_map = chandrayaan2.get_dirs()['DATE_MAP']
+    dates = sorted(date_map) if args.dates is None else args.dates
+    for date in dates:
+        if date not in date_map:
+            raise KeyError(f"no acquisition for date: {date}")
+    options = {'compressor': args.compressor} if args.compressor is not None else {}
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    jobs = [
+            Job(date, date_map[date], chandrayaan2.local_path / date, args.output / date,
+                tuple(args.steps), args.format, options)
+            for date in dates
+            ]
+    if args.force:
+        for job in jobs:
+            (job.output / DONE).unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    results = run(jobs, workers=args.workers, memory_budget=args.memory_budget,
+                  warmup=args.warmup, callback=_print_result)
+    elapsed = time.perf_counter() - start
+    counts = {status: sum(result.status == status for result in results) for status in ("done", "skipped", "failed")}
+    from sar.logging import console
+    console.print(f"[info]{len(results)} scenes in {elapsed:.2f} s:[/info] " + ", ".join(f"{n} {status}" for status, n in counts.items()))
+
+    if args.report is not None:
+        args.report.write_text(json.dumps({
+                'steps': args.steps,
+                'workers': args.workers,
+                'memory_budget': args.memory_budget,
+                'elapsed_s': elapsed,
+                'results': [result._asdict() for result in results]
+                }, indent=4))
+    return int(counts["failed"] > 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
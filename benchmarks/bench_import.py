@@ -0,0 +1,157 @@
+"""
+Import time of the package entry points.
+
+Every module is imported in a fresh interpreter with `python -X importtime`
+(median of --repeat runs), the report keeps the cumulative import time of
+the module, the modules with the largest self time and which of the heavy
+dependencies (numba, rasterio, scipy, rich) got imported with it. Modules
+of --light must not import any of them (exit status 1 otherwise).
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --modules sar manage batch --repeat 9 --output imports.json
+    python -m benchmarks.bench_import --compare base.json imports.json
+"""
+from __future__ import annotations
+
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+from typing import Any, Dict, List, NamedTuple, Tuple
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+MODULES = ("sar", "sar.sar", "sar.models", "manage", "batch")
+LIGHT = ("sar", "manage")
+HEAVY = ("numba", "numba.cuda", "rasterio", "scipy", "rich")
+
+
+class ImportTime(NamedTuple):
+    module      : str
+    # cumulative import time of the module, in microseconds
+    median_us   : float
+    runs_us     : List[float]
+    # (module, self time in microseconds) of the slowest imports of a run
+    top         : List[Tuple[str, int]]
+    heavy       : List[str]
+
+
+def _parse(stderr: str, module: str) -> List[Tuple[str, int, int]]:
+    # (name, self, cumulative) of the 'import time: self [us] | cumulative |
+    # imported package' lines of module and of what it imported (the lines
+    # since the previous top level import, the imports are listed children
+    # first, nested ones indented)
+    entries: List[Tuple[str, int, int]] = list()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() == module and name[1:] == name.strip():
+            return entries + [(module, int(own), int(cumulative))]
+        if name[1:] == name.strip():
+            entries = list()
+        else:
+            entries.append((name.strip(), int(own), int(cumulative)))
+    raise ValueError(f"no import of {module} found")
+
+
+def measure(module: str, repeat: int = 5, top: int = 10) -> ImportTime:
+    script = f"import sys, json, {module}; print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))"
+    runs = list()
+    for _ in range(repeat):
+        process = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", script],
+                cwd=ROOT, capture_output=True, text=True, check=True
+                )
+        entries = _parse(process.stderr, module)
+        runs.append(entries[-1][2])
+    slowest = sorted(((name, own) for name, own, _ in entries), key=lambda entry: -entry[1])[:top]
+    heavy = json.loads(process.stdout.strip().splitlines()[-1])
+    return ImportTime(module, statistics.median(runs), runs, slowest, heavy)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+                ["git", "rev-parse", "HEAD"], cwd=ROOT,
+                capture_output=True, text=True, check=True
+                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata() -> Dict[str, Any]:
+    return {
+            'commit': _git_commit(),
+            'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+            }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 1.2) -> bool:
+    """
+    Prints the import time ratio new / base of the modules in both reports,
+    returns True if any ratio is above threshold.
+    """
+    base_results = {r['module']: r for r in base['results']}
+    regression = False
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for result in new['results']:
+        if result['module'] not in base_results:
+            continue
+        ratio = result['median_us'] / base_results[result['module']]['median_us']
+        flag = ""
+        if ratio > threshold:
+            flag = "  <- slower"
+            regression = True
+        print(f"{result['module']:24s} {ratio:6.2f}x{flag}")
+    return regression
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Import time of the package entry points")
+    parser.add_argument("--modules", nargs="+", default=list(MODULES))
+    parser.add_argument("--light", nargs="*", default=list(LIGHT),
+                        help=f"modules that must not import {', '.join(HEAVY)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports shown per module")
+    parser.add_argument("--output", type=Path, default=None, help="JSON report")
+    parser.add_argument("--compare", nargs="+", type=Path, default=None, metavar="REPORT",
+                        help="BASE [NEW]: compare against BASE (NEW or a fresh run)")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 1:
+        report = json.loads(args.compare[1].read_text())
+    else:
+        results = list()
+        for module in args.modules:
+            result = measure(module, repeat=args.repeat, top=args.top)
+            results.append(result)
+            heavy = ", ".join(result.heavy) or "-"
+            print(f"{module:24s} {result.median_us / 1e3:9.1f} ms   heavy: {heavy}")
+            for name, own in result.top:
+                print(f"    {name:36s} {own / 1e3:9.1f} ms")
+        report = {'meta': metadata(), 'results': [result._asdict() for result in results]}
+        if args.output is not None:
+            args.output.write_text(json.dumps(report, indent=4))
+    status = 0
+    for result in report['results']:
+        if result['module'] in args.light and result['heavy']:
+            print(f"{result['module']} imports {', '.join(result['heavy'])}")
+            status = 1
+    if args.compare:
+        base = json.loads(args.compare[0].read_text())
+        status = max(status, int(compare(base, report, threshold=args.threshold)))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
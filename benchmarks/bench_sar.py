@@ -0,0 +1,329 @@
+"""
+Benchmarks of the SAR hot paths on synthetic speckled quad-pol scenes.
+
+Every case is timed at every scene size (median of --repeat runs, the setup
+of a run is not timed) and reported as throughput in Mpix/s together with
+the peak RSS of the process during the run. The numba compile time of a case
+is measured separately on a tiny scene before the timed runs (kernels shared
+between cases are compiled, and counted, by the first case that uses them;
+computeT is compiled while the scenes are prepared and shows none).
+
+    python -m benchmarks.bench_sar --sizes 512x512 2048x2048 --output bench.json
+    python -m benchmarks.bench_sar --cases computeT multilook --repeat 5
+    python -m benchmarks.bench_sar --compare base.json bench.json
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import warnings
+import threading
+import subprocess
+import numba
+import numpy as np
+
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+from pathlib import Path
+from rasterio.errors import NotGeoreferencedWarning
+
+from sar import SAR, filters
+from sar.models import read_sli
+from sar.sar import MULTILOOK_METHODS
+from benchmarks.synthetic import synthetic_coeffs, write_geotiffs
+
+try:
+    import psutil
+    __psutil_import__ = True
+except ImportError:
+    __psutil_import__ = False
+
+
+WARMUP_SIZE = (64, 48)
+
+
+class Case(NamedTuple):
+    name    : str
+    # (scene with T computed, scratch directory) -> function to time
+    setup   : Callable[[SAR, Path], Callable[[], Any]]
+
+
+def _rss() -> int:
+    if __psutil_import__:
+        return psutil.Process().memory_info().rss
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakRSS:
+    """
+    Samples the resident set size of the process in a background thread
+    while the context is active.
+    """
+    interval    : float
+    start       : int
+    peak        : int
+
+    def __init__(self, interval: float = 0.002) -> None:
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self) -> PeakRSS:
+        self.start = self.peak = _rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+
+def _fresh(scene: SAR, calibrated: bool = True) -> SAR:
+    return SAR(scene._coeffs, calibrated=calibrated)
+
+
+def _ingest(scene: SAR, tmp: Path) -> Callable[[], Any]:
+    tif_dir = tmp / "calibrated"
+    if not tif_dir.is_dir():
+        write_geotiffs(tif_dir, scene._coeffs)
+    paths = sorted(tif_dir.glob("*sli*.tif"))
+    return lambda: read_sli(paths)
+
+
+def _calibrate(scene: SAR, tmp: Path) -> Callable[[], Any]:
+    sar_img = SAR(scene._coeffs.copy(), calibrated=False)
+    return lambda: sar_img.calibrate()
+
+
+def _compute(method: str) -> Callable[[SAR, Path], Callable[[], Any]]:
+    def setup(scene: SAR, tmp: Path) -> Callable[[], Any]:
+        return getattr(_fresh(scene), method)
+    return setup
+
+
+def _multilook(method: str) -> Callable[[SAR, Path], Callable[[], Any]]:
+    return lambda scene, tmp: lambda: scene.multilook_azimuth(4, method=method)
+
+
+def _crop(scene: SAR, tmp: Path) -> Callable[[], Any]:
+    _, _, x, y = scene._coeffs.shape
+    return lambda: scene.crop_new((x // 4, 3 * x // 4, y // 4, 3 * y // 4))
+
+
+def _save(format: str, **options: Any) -> Callable[[SAR, Path], Callable[[], Any]]:
+    def setup(scene: SAR, tmp: Path) -> Callable[[], Any]:
+        shutil.rmtree(tmp / format, ignore_errors=True)
+        return lambda: scene.save(tmp / format, format=format, **options)
+    return setup
+
+
+def _load(format: str, **options: Any) -> Callable[[SAR, Path], Callable[[], Any]]:
+    def setup(scene: SAR, tmp: Path) -> Callable[[], Any]:
+        if not (tmp / format / "config.json").is_file():
+            scene.save(tmp / format, format=format, **options)
+        # chunked arrays are lazy, read them to time the decompression
+        return lambda: np.asarray(SAR.from_path(tmp / format).T)
+    return setup
+
+
+def _speckle(method: str) -> Callable[[SAR, Path], Callable[[], Any]]:
+    return lambda scene, tmp: lambda: scene.speckle_filter(method)
+
+
+def _edges(method: str) -> Callable[[SAR, Path], Callable[[], Any]]:
+    return lambda scene, tmp: lambda: scene.detect_edges(method)
+
+
+def _decompose(method: str) -> Callable[[SAR, Path], Callable[[], Any]]:
+    return lambda scene, tmp: lambda: scene.decompose(method)
+
+
+def cases() -> List[Case]:
+    all_cases = [Case("ingest", _ingest)]
+    if hasattr(SAR, "calibrate"):
+        all_cases.append(Case("calibrate", _calibrate))
+    all_cases += [Case(method, _compute(method)) for method in ("computeT", "computeC", "computeTC")]
+    all_cases += [Case(f"multilook_azimuth[{method}]", _multilook(method)) for method in MULTILOOK_METHODS]
+    all_cases.append(Case("crop_new", _crop))
+    all_cases += [
+            Case("save[npy]", _save("npy")),
+            Case("load[npy]", _load("npy")),
+            Case("save[chunked]", _save("chunked", compressor="zlib")),
+            Case("load[chunked]", _load("chunked", compressor="zlib"))
+            ]
+    all_cases += [Case(f"speckle_filter[{method}]", _speckle(method)) for method in filters.METHODS]
+    all_cases += [Case(f"detect_edges[{method}]", _edges(method)) for method in ("ratio", "wishart")]
+    all_cases += [Case(f"decompose[{method}]", _decompose(method)) for method in ("freeman_durden", "h_a_alpha")]
+    return all_cases
+
+
+def _scene(x: int, y: int, seed: int) -> SAR:
+    scene = SAR(synthetic_coeffs(x, y, seed=seed), calibrated=True)
+    scene.computeT()
+    return scene
+
+
+def _time(case: Case, scene: SAR, tmp: Path) -> Tuple[float, PeakRSS]:
+    func = case.setup(scene, tmp)
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    return elapsed, rss
+
+
+def run(
+        sizes: List[Tuple[int, int]],
+        selected: List[Case],
+        repeat: int = 3,
+        seed: int = 0
+        ) -> List[Dict[str, Any]]:
+    results = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+
+        # compile times: first minus second run on a tiny scene
+        jit: Dict[str, float] = dict()
+        warmup = _scene(*WARMUP_SIZE, seed=seed)
+        for case in selected:
+            case_tmp = tmp / "warmup" / case.name
+            case_tmp.mkdir(parents=True)
+            first, _ = _time(case, warmup, case_tmp)
+            second, _ = _time(case, warmup, case_tmp)
+            jit[case.name] = max(first - second, 0.0)
+
+        for x, y in sizes:
+            scene = _scene(x, y, seed=seed)
+            mpix = x * y / 1e6
+            for case in selected:
+                case_tmp = tmp / f"{x}x{y}" / case.name
+                case_tmp.mkdir(parents=True)
+                times, peak, delta = list(), 0, 0
+                for _ in range(repeat):
+                    elapsed, rss = _time(case, scene, case_tmp)
+                    times.append(elapsed)
+                    peak = max(peak, rss.peak)
+                    delta = max(delta, rss.peak - rss.start)
+                median = float(np.median(times))
+                result = {
+                        'case': case.name,
+                        'size': [x, y],
+                        'mpix': mpix,
+                        'times_s': times,
+                        'median_s': median,
+                        'mpix_per_s': mpix / median if median > 0 else float('inf'),
+                        'peak_rss_mb': peak / 2 ** 20,
+                        'rss_delta_mb': delta / 2 ** 20,
+                        'jit_s': jit[case.name]
+                        }
+                results.append(result)
+                print(
+                        f"{case.name:32s} {x:>6d}x{y:<6d} {median * 1e3:10.2f} ms "
+                        f"{result['mpix_per_s']:10.2f} Mpix/s {result['rss_delta_mb']:9.1f} MB "
+                        f"jit {result['jit_s']:6.2f} s",
+                        flush=True
+                        )
+            shutil.rmtree(tmp / f"{x}x{y}")
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+                ["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+                capture_output=True, text=True, check=True
+                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata() -> Dict[str, Any]:
+    return {
+            'commit': _git_commit(),
+            'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numba_threads': numba.config.NUMBA_NUM_THREADS
+            }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 1.1) -> bool:
+    """
+    Prints the median time ratio new / base of the (case, size) pairs in both
+    reports, returns True if any ratio is above threshold.
+    """
+    base_results = {(r['case'], tuple(r['size'])): r for r in base['results']}
+    regression = False
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for result in new['results']:
+        key = (result['case'], tuple(result['size']))
+        if key not in base_results:
+            continue
+        ratio = result['median_s'] / base_results[key]['median_s']
+        flag = ""
+        if ratio > threshold:
+            flag = "  <- slower"
+            regression = True
+        print(f"{key[0]:32s} {key[1][0]:>6d}x{key[1][1]:<6d} {ratio:6.2f}x{flag}")
+    return regression
+
+
+def _size(size: str) -> Tuple[int, int]:
+    x, _, y = size.lower().partition("x")
+    return (int(x), int(y or x))
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of the SAR hot paths on synthetic scenes")
+    parser.add_argument("--sizes", nargs="+", type=_size, default=[(512, 512), (2048, 1024)],
+                        help="scene sizes as ROWSxCOLS")
+    parser.add_argument("--cases", nargs="+", default=None,
+                        help="only run the cases whose name contains one of these strings")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="JSON report")
+    parser.add_argument("--compare", nargs="+", type=Path, default=None, metavar="REPORT",
+                        help="BASE [NEW]: compare against BASE (NEW or a fresh run)")
+    parser.add_argument("--threshold", type=float, default=1.1,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    args = parser.parse_args(argv)
+    # the synthetic GeoTIFFs have no geotransform
+    warnings.filterwarnings("ignore", category=NotGeoreferencedWarning)
+
+    selected = cases()
+    if args.cases:
+        selected = [case for case in selected if any(name in case.name for name in args.cases)]
+    if args.list:
+        print("\n".join(case.name for case in selected))
+        return 0
+
+    if args.compare and len(args.compare) > 1:
+        report = json.loads(args.compare[1].read_text())
+    else:
+        report = {'meta': metadata(), 'results': run(args.sizes, selected, repeat=args.repeat, seed=args.seed)}
+        if args.output is not None:
+            args.output.write_text(json.dumps(report, indent=4))
+    if args.compare:
+        base = json.loads(args.compare[0].read_text())
+        return int(compare(base, report, threshold=args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
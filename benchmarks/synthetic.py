@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+import rasterio as rs
+
+from typing import List
+from pathlib import Path
+
+from sar import SAR
+
+
+# Lexicographic covariances (HH, sqrt(2) HV, VV) of a few scattering classes
+# the synthetic scenes are made of (relative powers only).
+CLASSES = {
+        "surface": np.array([
+            [1.0, 0.0, 0.6],
+            [0.0, 0.05, 0.0],
+            [0.6, 0.0, 0.8]
+            ], dtype=np.complex128),
+        "double": np.array([
+            [1.2, 0.0, -0.7],
+            [0.0, 0.08, 0.0],
+            [-0.7, 0.0, 0.9]
+            ], dtype=np.complex128),
+        "volume": np.array([
+            [1.0, 0.0, 1 / 3],
+            [0.0, 2 / 3, 0.0],
+            [1 / 3, 0.0, 1.0]
+            ], dtype=np.complex128),
+        }
+
+
+def synthetic_coeffs(
+        x: int,
+        y: int,
+        seed: int = 0,
+        block: int = 64,
+        dtype: npt.DTypeLike = np.complex64
+        ) -> npt.NDArray:
+    """
+    Fully developed single look speckle over a patchwork of block x block
+    regions of random class and brightness, as (2, 2, x, y) HH, HV, VH, VV
+    scattering coefficients (HV == VH).
+    """
+    rng = np.random.default_rng(seed)
+    chol = np.array([np.linalg.cholesky(C) for C in CLASSES.values()])
+    bx, by = -(-x // block), -(-y // block)
+    labels = rng.integers(0, len(CLASSES), size=(bx, by))
+    gain = np.sqrt(10 ** rng.uniform(-1, 1, size=(bx, by)))
+
+    coeffs = np.empty([2, 2, x, y], dtype=dtype)
+    for i in range(bx):
+        r1, r2 = i * block, min((i + 1) * block, x)
+        for j in range(by):
+            c1, c2 = j * block, min((j + 1) * block, y)
+            n = (r2 - r1) * (c2 - c1)
+            z = (rng.standard_normal((3, n)) + 1j * rng.standard_normal((3, n))) / np.sqrt(2)
+            k = (gain[i, j] * chol[labels[i, j]] @ z).reshape(3, r2 - r1, c2 - c1)
+            coeffs[0, 0, r1:r2, c1:c2] = k[0]
+            coeffs[0, 1, r1:r2, c1:c2] = k[1] / np.sqrt(2)
+            coeffs[1, 1, r1:r2, c1:c2] = k[2]
+    coeffs[1, 0] = coeffs[0, 1]
+    return coeffs
+
+
+def synthetic_scene(x: int, y: int, seed: int = 0, calibrated: bool = True, **kwarg) -> SAR:
+    return SAR(synthetic_coeffs(x, y, seed=seed, **kwarg), calibrated=calibrated)
+
+
+def write_geotiffs(path: Path, coeffs: npt.NDArray) -> List[Path]:
+    """
+    Writes coeffs as the hh, hv, vh, vv SLI GeoTIFFs of a calibrated
+    directory (band 1 real, band 2 imaginary, float32), see
+    sar.models.read_sli.
+    """
+    if not path.is_dir():
+        path.mkdir(parents=True)
+    _, _, x, y = coeffs.shape
+    paths = list()
+    for k, pol in enumerate(("hh", "hv", "vh", "vv")):
+        tif_path = path / f"synthetic_sli_{pol}.tif"
+        plane = coeffs[k // 2, k % 2]
+        with rs.open(
+                tif_path.__str__(), 'w', driver='GTiff', height=x, width=y,
+                count=2, dtype='float32', tiled=True, blockxsize=256, blockysize=256
+                ) as dst:
+            dst.write(plane.real.astype(np.float32), 1)
+            dst.write(plane.imag.astype(np.float32), 2)
+        paths.append(tif_path)
+    return paths
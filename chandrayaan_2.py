@@ -1,11 +1,12 @@
 import json
-import rasterio as rs
 
 import numpy as np
 import numpy.typing as npt
 
 from pathlib import Path
+from sar import dtypes
 from sar_img import SARImage
+from sar.models import LazyDateMap, date_from_path, read_sli, sli_paths
 from typing import List, Union, Dict
 from dataclasses import dataclass, field
 
@@ -33,7 +34,7 @@ class SAR(SARImage):
     # TODO: auto make local numpy files
 
     def __post_init__(self) -> None:
-        self.date = self.path.name.split("_")[3].split("t")[0]
+        self.date = date_from_path(self.path)
         self.calibrated_data_path = self.path / "data" / "calibrated" / self.date
         self.local_save_paths = {
                 'scattering_coeffs' : self.local_path / "scattering_coeffs.npy",
@@ -84,14 +85,12 @@ class SAR(SARImage):
     
     def get_scattering_coeff(self) -> List[npt.NDArray]:
         """
-        Loads the scattering coefficients from the GeoTif files
+        Loads the scattering coefficients from the GeoTif files, read
+        concurrently into complex planes of the sar.dtypes policy (see
+        sar.models.read_sli)
         """
-        coeffs_path = sorted(self.calibrated_data_path.glob("*sli*.tif"))
-        coeffs: List = list()
-        for path in coeffs_path:
-            with rs.open(path.__str__()) as src:
-                coeffs.append(src.read())
-        return coeffs
+        coeffs = read_sli(sli_paths(self.calibrated_data_path), dtype=dtypes.get_dtype())
+        return [coeffs[0, 0], coeffs[0, 1], coeffs[1, 0], coeffs[1, 1]]
 
 
     def save(self, path: Path | None = None) -> None:
@@ -158,35 +157,28 @@ class SAR(SARImage):
 class Chandrayaan2:
     path: Path
     local_path: Path
-    date_map: Dict[str, SAR]
+    date_map: LazyDateMap
 
-    def __init__(self, path: Path, local_path: Path) -> None:
+    def __init__(self, path: Path, local_path: Path, max_loaded: int | None = None) -> None:
         self.path = path
         self.local_path = local_path
-        self.dateSARMap()
+        self.dateSARMap(max_loaded=max_loaded)
 
 
-    def dateSARMap(self) -> None:
+    def dateSARMap(self, max_loaded: int | None = None) -> None:
         sar_data_paths = [child for child in self.path.iterdir() if child.is_dir()]
-        sar_data_dates = [path.name.split("_")[3].split("t")[0] for path in sar_data_paths]
-        sar_list = [
-                # TODO: change local path
-                SAR(Path(path), self.local_path / date)
-                for path, date in zip(sar_data_paths, sar_data_dates)
-                ]
-        self.date_map = {
-                SAR.date : SAR
-                for SAR in sar_list
-                }
+        # TODO: change local path
+        self.date_map = LazyDateMap(
+                {date_from_path(path): path for path in sar_data_paths},
+                self.local_path,
+                factory=SAR,
+                max_loaded=max_loaded
+                )
 
 
-    def get_dirs(self) -> Dict[str, Union[Path, List[Path]]]:
+    def get_dirs(self) -> Dict[str, Union[Path, Dict[str, Path]]]:
         date_map = {
                 'BASE': self.path,
-                'DATE_MAP': {
-                    date: sarimg_data.path
-                    for date, sarimg_data in self.date_map.items()
-                    }
+                'DATE_MAP': self.date_map.paths
                 }
         return date_map
-
@@ -1,11 +1,18 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from dir import Dir
 from settings import DIR
-from sar.models import Chandrayaan2
+
+if TYPE_CHECKING:
+    from sar.models import Chandrayaan2
 
 def get_dirs() -> Dir:
     return Dir(DIR)
 
 def get_chandrayaan2Obj() -> Chandrayaan2:
+    from sar.models import Chandrayaan2
     dir = Dir(DIR)
     if hasattr(dir, 'data') and hasattr(dir.data, 'chandrayaan2'):
         if dir.data.chandrayaan2.is_dir():
@@ -1,10 +1,9 @@
 import numpy as np
 from numba import jit
-from numba import cuda
 
 
 
-jit(nopython=True, parallel=True, fastmath=True, nogil=True)
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
 def computeT_cpu(HH, HV, VH, VV) -> tuple:
     T11 = 0.5 * np.square(np.abs(HH + VV))
     T12 = 0.5 * (HH + VV) * np.conjugate(HH - VV)
@@ -18,8 +17,7 @@ def computeT_cpu(HH, HV, VH, VV) -> tuple:
     return (T11, T12, T13, T21, T22, T23, T31, T32, T33)
 
 
-@cuda.jit
-def computeT_gpu(HH, HV, VH, VV) -> tuple:
+def _computeT_gpu(HH, HV, VH, VV) -> tuple:
     T11 = 0.5 * np.square(np.abs(HH + VV))
     T12 = 0.5 * (HH + VV) * np.conjugate(HH - VV)
     T13 = (HH + VV) * np.conjugate(HV)
@@ -32,7 +30,7 @@ def computeT_gpu(HH, HV, VH, VV) -> tuple:
     return (T11, T12, T13, T21, T22, T23, T31, T32, T33)
 
 
-@jit(nopython=True, nogit=True, parallel=True, fastmath=True)
+@jit(nopython=True, nogil=True, parallel=True, fastmath=True, cache=True)
 def computeC_cpu(HH, HV, VH, VV) -> tuple:
     C11 = np.square(np.abs(HH))
     C12 = np.sqrt(2) * HH * np.conj(HV)
@@ -46,8 +44,7 @@ def computeC_cpu(HH, HV, VH, VV) -> tuple:
     return (C11, C12, C13, C21, C22, C23, C31, C32, C33)
 
 
-@cuda.jit
-def computeC_gpu(HH, HV, VH, VV) -> tuple:
+def _computeC_gpu(HH, HV, VH, VV) -> tuple:
     C11 = np.square(np.abs(HH))
     C12 = np.sqrt(2) * HH * np.conj(HV)
     C13 = HH * np.conj(VV)
@@ -58,3 +55,17 @@ def computeC_gpu(HH, HV, VH, VV) -> tuple:
     C32 = np.sqrt(2) * VV * np.conj(HV)
     C33 = np.square(np.abs(VV))
     return (C11, C12, C13, C21, C22, C23, C31, C32, C33)
+
+
+# the gpu kernels are compiled with numba.cuda (slow to import, and needing
+# a CUDA toolkit) on first access
+_GPU_KERNELS = {'computeT_gpu': _computeT_gpu, 'computeC_gpu': _computeC_gpu}
+
+
+def __getattr__(name: str):
+    if name in _GPU_KERNELS:
+        from numba import cuda
+        kernel = cuda.jit(_GPU_KERNELS[name])
+        globals()[name] = kernel
+        return kernel
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,35 @@
-from .sar import SAR
-from .models import SARChandrayaan2, Chandrayaan2
+from __future__ import annotations
+
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .sar import SAR
+    from .hermitian import HermitianMatrix
+    from .models import SARChandrayaan2, Chandrayaan2
 
 __version__ = '1.0'
+
+# the exports are imported on first access (PEP 562): `import sar` or
+# `import sar.dtypes` does not import numpy-heavy modules, numba, rasterio or
+# scipy, they are loaded by the modules that use them when they are used
+_EXPORTS = {
+        'SAR': 'sar.sar',
+        'HermitianMatrix': 'sar.hermitian',
+        'SARChandrayaan2': 'sar.models',
+        'Chandrayaan2': 'sar.models'
+        }
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name in _EXPORTS:
+        import importlib
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list:
+    return sorted([*globals(), *_EXPORTS])
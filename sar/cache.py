@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+from typing import Any, Dict, Iterator, List, Sequence, Tuple, TYPE_CHECKING
+from pathlib import Path
+from contextlib import contextmanager
+
+if TYPE_CHECKING:
+    from sar.sar import SAR
+
+
+# Content addressed cache of derived products (multilooked / filtered
+# scenes). The key of a product is the hash of its source (the GeoTIFFs with
+# their size and modification time, or the hash of the coefficients of an
+# in-memory scene), of the operation chain that produced it (SAR.lineage:
+# crops, calibration, multilook, filter and their parameters) and of the
+# dtype and matrices of the scene it was computed from. Entries are saved
+# scenes (SAR.save) under root/<key>, the index keeps their size and last
+# access, the least recently used entries are evicted to stay under max_bytes.
+#
+# Small JSON values (statistics of a scene) are cached the same way, as
+# root/<key>/value.json (get_json / put_json).
+#
+# Changing a source changes its key, the entries of the old version are
+# dropped by drop_stale (called by SAR.with_cache).
+
+DEFAULT_ROOT = Path(__file__).resolve().parents[1] / ".local" / "cache"
+DEFAULT_MAX_BYTES = 16 * 2 ** 30
+INDEX = "index.json"
+LOCK = ".lock"
+VALUE = "value.json"
+
+Step = Tuple[str, Dict[str, Any]]
+
+
+def product_key(source: str, lineage: Sequence[Step], **extra: Any) -> str:
+    """
+    sha256 of the source, the operation chain and extra (JSON, sorted keys).
+    """
+    material = json.dumps(
+            {'source': source, 'lineage': [list(step) for step in lineage], **extra},
+            sort_keys=True, default=str
+            )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def hash_array(array: Any, rows: int = 256) -> str:
+    """
+    blake2b of a (..., x, y) array read rows at a time (memory maps and lazy
+    arrays are not read into memory at once).
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{array.dtype}{array.shape}".encode())
+    x = array.shape[-2]
+    for r in range(0, x, rows):
+        digest.update(np.ascontiguousarray(array[..., r:r + rows, :]).tobytes())
+    return digest.hexdigest()
+
+
+def _size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+class ProductCache:
+    """
+    Parameters
+    ----------
+    root: Path | None
+        cache directory (.local/cache by default)
+    max_bytes: int
+        size budget, least recently used entries are evicted above it
+    mmap_mode: str | None
+        mmap_mode the entries are loaded with (see SAR.load), copy-on-write
+        by default so cached scenes can be modified without touching the cache
+    """
+    root        : Path
+    max_bytes   : int
+    mmap_mode   : str | None
+
+
+    def __init__(self, root: Path | None = None, max_bytes: int = DEFAULT_MAX_BYTES, mmap_mode: str | None = "c") -> None:
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes can not be negative [given -> {max_bytes}]")
+        self.root = Path(root) if root is not None else DEFAULT_ROOT
+        self.max_bytes = max_bytes
+        self.mmap_mode = mmap_mode
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # the locks stay in this process
+        return (ProductCache, (self.root, self.max_bytes, self.mmap_mode))
+
+
+    def __repr__(self) -> str:
+        return f"ProductCache(root={self.root}, entries={len(self)}, size={self.size}, max_bytes={self.max_bytes})"
+
+
+    @contextmanager
+    def _index(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        # index read / written under a thread lock and a file lock (several
+        # processes can share a cache)
+        with self._lock, (self.root / LOCK).open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = self.root / INDEX
+                try:
+                    index = json.loads(path.read_text())
+                except (FileNotFoundError, json.JSONDecodeError):
+                    index = dict()
+                before = json.dumps(index, sort_keys=True)
+                yield index
+                if json.dumps(index, sort_keys=True) != before:
+                    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                    tmp.write_text(json.dumps(index, indent=4))
+                    os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def __len__(self) -> int:
+        with self._index() as index:
+            return len(index)
+
+
+    def __contains__(self, key: str) -> bool:
+        with self._index() as index:
+            return key in index and (self.root / key).is_dir()
+
+
+    @property
+    def size(self) -> int:
+        with self._index() as index:
+            return sum(entry['size'] for entry in index.values())
+
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        """
+        key -> {'size', 'last_access', 'source', 'lineage'} of every entry.
+        """
+        with self._index() as index:
+            return {key: dict(entry) for key, entry in index.items()}
+
+
+    def get(self, key: str) -> SAR | None:
+        """
+        Cached scene for key or None. Entries whose files are missing or were
+        modified are dropped.
+        """
+        from sar.sar import SAR
+
+        path = self.root / key
+        with self._index() as index:
+            if key not in index:
+                return None
+            if not path.is_dir() or _size(path) != index[key]['size']:
+                del index[key]
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            index[key]['last_access'] = time.time()
+        return SAR.from_path(path, mmap_mode=self.mmap_mode)
+
+
+    def put(self, key: str, sar_img: SAR, **options: Any) -> None:
+        """
+        Saves sar_img (SAR.save, options are passed on) as the entry for key
+        and evicts entries above the size budget.
+        """
+        path = self.root / key
+        partial = self.root / f"{key}.partial-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(partial, ignore_errors=True)
+        sar_img.save(partial, **options)
+        size = _size(partial)
+        with self._index() as index:
+            if path.is_dir():
+                shutil.rmtree(path)
+            os.replace(partial, path)
+            index[key] = {
+                    'size': size,
+                    'last_access': time.time(),
+                    'source': sar_img.source,
+                    'lineage': [list(step) for step in sar_img.lineage]
+                    }
+            self._evict(index, self.max_bytes)
+
+
+    def get_json(self, key: str) -> Any | None:
+        """
+        Value stored by put_json for key or None.
+        """
+        path = self.root / key / VALUE
+        with self._index() as index:
+            if key not in index:
+                return None
+            if not path.is_file():
+                del index[key]
+                shutil.rmtree(self.root / key, ignore_errors=True)
+                return None
+            index[key]['last_access'] = time.time()
+        return json.loads(path.read_text())
+
+
+    def put_json(self, key: str, value: Any, source: str | None = None, lineage: Sequence[Step] = ()) -> None:
+        """
+        Stores a small JSON value (statistics of a scene...) as the entry for
+        key, source and lineage are the ones of the scene it describes.
+        """
+        path = self.root / key
+        partial = self.root / f"{key}.partial-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(partial, ignore_errors=True)
+        partial.mkdir()
+        (partial / VALUE).write_text(json.dumps(value))
+        size = _size(partial)
+        with self._index() as index:
+            if path.is_dir():
+                shutil.rmtree(path)
+            os.replace(partial, path)
+            index[key] = {
+                    'size': size,
+                    'last_access': time.time(),
+                    'source': source,
+                    'lineage': [list(step) for step in lineage]
+                    }
+            self._evict(index, self.max_bytes)
+
+
+    def _evict(self, index: Dict[str, Dict[str, Any]], max_bytes: int) -> List[str]:
+        evicted = list()
+        total = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]['last_access']):
+            if total <= max_bytes:
+                break
+            total -= index.pop(key)['size']
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            evicted.append(key)
+        return evicted
+
+
+    def evict(self, max_bytes: int | None = None) -> List[str]:
+        """
+        Drops the least recently used entries until the cache holds at most
+        max_bytes (the budget if None), returns their keys.
+        """
+        with self._index() as index:
+            return self._evict(index, self.max_bytes if max_bytes is None else max_bytes)
+
+
+    def invalidate(self, key: str) -> None:
+        with self._index() as index:
+            index.pop(key, None)
+            shutil.rmtree(self.root / key, ignore_errors=True)
+
+
+    def drop_stale(self, source: str) -> List[str]:
+        """
+        Drops the entries of older versions of source: same name (the part
+        before '@') but another fingerprint. Returns their keys.
+        """
+        name, sep, _ = source.partition("@")
+        if not sep:
+            return list()
+        with self._index() as index:
+            stale = [
+                    key for key, entry in index.items()
+                    if entry.get('source') is not None
+                    and entry['source'].partition("@")[0] == name and entry['source'] != source
+                    ]
+            for key in stale:
+                del index[key]
+                shutil.rmtree(self.root / key, ignore_errors=True)
+        return stale
+
+
+    def clear(self) -> None:
+        with self._index() as index:
+            for key in list(index):
+                del index[key]
+                shutil.rmtree(self.root / key, ignore_errors=True)
+
+
+_default: ProductCache | None = None
+
+
+def default_cache() -> ProductCache:
+    """
+    Shared cache under .local/cache (SAR_CACHE_DIR / SAR_CACHE_MAX_BYTES
+    override the directory and the budget).
+    """
+    global _default
+    if _default is None:
+        root = os.environ.get("SAR_CACHE_DIR")
+        _default = ProductCache(
+                Path(root) if root else None,
+                max_bytes=int(os.environ.get("SAR_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+                )
+    return _default
@@ -1,61 +1,381 @@
+import time
 import numpy as np
 import numpy.typing as npt
-from numba import jit
+from numba import jit, prange, types
+from numba.core.typing import Signature
+from typing import Dict, List, Sequence
 
 __cupy_import__ = False
 
+SQRT2 = np.sqrt(2.0)
 
-@jit(nopython=True, parallel=True, fastmath=True, nogil=True)
-def computeT_from_coeffs_cpu(coeffs: npt.NDArray[np.complex64], t: npt.NDArray[np.complex64]) -> None:
-    hh = coeffs[0, 0, :, :]
-    hv = coeffs[0, 1, :, :]
-    vh = coeffs[1, 0, :, :]
-    vv = coeffs[1, 1, :, :]
 
-    t[0, 0, :, :] = 0.5 * np.square(np.abs(hh + vv))
-    t[0, 1, :, :] = 0.5 * (hh + vv) * np.conj(hh - vv)
-    t[0, 2, :, :] = (hh + vv) * np.conj(hv)
-    t[1, 0, :, :] = 0.5 * (hh - vv) * np.conj(hh + vv)
-    t[1, 1, :, :] = 0.5 * np.square(np.abs(hh - vv))
-    t[1, 2, :, :] = (hh + vv) * np.conj(hv)
-    t[2, 0, :, :] = np.conj(hh + vv) * hv
-    t[2, 1, :, :] = np.conj(hh - vv) * hv
-    t[2, 2, :, :] = 2 * np.square(np.abs(hv))
+# The cpu kernels below work pixel by pixel: HH, HV and VV are read once per
+# pixel and every matrix entry is written from those registers, instead of
+# sweeping the full planes once per entry with (HH + VV) / (HH - VV)
+# temporaries. VH is not used, reciprocity (HV == VH) is assumed.
+#
+# T and C are written in the packed Hermitian layout of
+# sar.hermitian.HermitianMatrix: diag (3, x, y) real with the 11, 22, 33
+# elements and upper (3, x, y) complex with the 12, 13, 23 elements.
 
 
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def computeT_from_coeffs_cpu(
+        coeffs: npt.NDArray[np.complex64],
+        t_diag: npt.NDArray[np.float32],
+        t_upper: npt.NDArray[np.complex64]
+        ) -> None:
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            hh = coeffs[0, 0, i, j]
+            hv = coeffs[0, 1, i, j]
+            vv = coeffs[1, 1, i, j]
 
-def computeT_from_coeffs_gpu(coeffs: npt.NDArray[np.complex64], t:npt.NDArray[np.complex64]) -> npt.NDArray[np.complex64]:
+            a = hh + vv
+            b = hh - vv
+            hv_conj = np.conj(hv)
+
+            t_diag[0, i, j] = 0.5 * (a.real * a.real + a.imag * a.imag)
+            t_diag[1, i, j] = 0.5 * (b.real * b.real + b.imag * b.imag)
+            t_diag[2, i, j] = 2 * (hv.real * hv.real + hv.imag * hv.imag)
+            t_upper[0, i, j] = 0.5 * a * np.conj(b)
+            t_upper[1, i, j] = a * hv_conj
+            t_upper[2, i, j] = b * hv_conj
+
+
+
+def computeT_from_coeffs_gpu(
+        coeffs: npt.NDArray[np.complex64],
+        t_diag: npt.NDArray[np.float32],
+        t_upper: npt.NDArray[np.complex64]
+        ) -> None:
     # TODO: coeffs and T gpu ram object
     if not __cupy_import__:
         raise ImportError(f"Issue importing cupy for gpu computations")
     # TODO: complete this
-    return t
 
 
-@jit(nopython=True, parallel=True, fastmath=True, nogil=True)
-def computeC_from_coeffs_cpu(coeffs: npt.NDArray[np.complex64], c: npt.NDArray[np.complex64]) -> npt.NDArray[np.complex64]:
-    hh = coeffs[0, 0, :, :]
-    hv = coeffs[0, 1, :, :]
-    # vh = coeffs[1, 0, :, :]
-    vv = coeffs[1, 1, :, :]
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def computeC_from_coeffs_cpu(
+        coeffs: npt.NDArray[np.complex64],
+        c_diag: npt.NDArray[np.float32],
+        c_upper: npt.NDArray[np.complex64]
+        ) -> None:
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            hh = coeffs[0, 0, i, j]
+            hv = SQRT2 * coeffs[0, 1, i, j]
+            vv = coeffs[1, 1, i, j]
+
+            c_diag[0, i, j] = hh.real * hh.real + hh.imag * hh.imag
+            c_diag[1, i, j] = hv.real * hv.real + hv.imag * hv.imag
+            c_diag[2, i, j] = vv.real * vv.real + vv.imag * vv.imag
+            c_upper[0, i, j] = hh * np.conj(hv)
+            c_upper[1, i, j] = hh * np.conj(vv)
+            c_upper[2, i, j] = hv * np.conj(vv)
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def computeTC_from_coeffs_cpu(
+        coeffs: npt.NDArray[np.complex64],
+        t_diag: npt.NDArray[np.float32],
+        t_upper: npt.NDArray[np.complex64],
+        c_diag: npt.NDArray[np.float32],
+        c_upper: npt.NDArray[np.complex64]
+        ) -> None:
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            hh = coeffs[0, 0, i, j]
+            hv = coeffs[0, 1, i, j]
+            vv = coeffs[1, 1, i, j]
+
+            a = hh + vv
+            b = hh - vv
+            hv_conj = np.conj(hv)
+            vv_conj = np.conj(vv)
+            hv_pow = hv.real * hv.real + hv.imag * hv.imag
+
+            t_diag[0, i, j] = 0.5 * (a.real * a.real + a.imag * a.imag)
+            t_diag[1, i, j] = 0.5 * (b.real * b.real + b.imag * b.imag)
+            t_diag[2, i, j] = 2 * hv_pow
+            t_upper[0, i, j] = 0.5 * a * np.conj(b)
+            t_upper[1, i, j] = a * hv_conj
+            t_upper[2, i, j] = b * hv_conj
+
+            c_diag[0, i, j] = hh.real * hh.real + hh.imag * hh.imag
+            c_diag[1, i, j] = 2 * hv_pow
+            c_diag[2, i, j] = vv.real * vv.real + vv.imag * vv.imag
+            c_upper[0, i, j] = SQRT2 * hh * hv_conj
+            c_upper[1, i, j] = hh * vv_conj
+            c_upper[2, i, j] = SQRT2 * hv * vv_conj
+
+
+# Single planes of T / C, for the lazy element access of SAR (T11, C23, span
+# ...): only the requested element is computed. Both matrices are outer
+# products u u^H per pixel, with the Pauli vector u = ((HH + VV) / sqrt2,
+# (HH - VV) / sqrt2, sqrt2 HV) for T (matrix 0) and the lexicographic vector
+# u = (HH, sqrt2 HV, VV) for C (matrix 1).
+
 
-    # TODO: complete this functions
-    c[0, 0, :, :] = 0.5 * np.square(np.abs(hh + vv))
-    c[0, 1, :, :] = 0.5 * (hh + vv) * np.conj(hh - vv)
-    c[0, 2, :, :] = (hh + vv) * np.conj(hv)
-    c[1, 0, :, :] = 0.5 * (hh - vv) * np.conj(hh + vv)
-    c[1, 1, :, :] = 0.5 * np.square(np.abs(hh - vv))
-    c[1, 2, :, :] = (hh + vv) * np.conj(hv)
-    c[2, 0, :, :] = np.conj(hh + vv) * hv
-    c[2, 1, :, :] = np.conj(hh - vv) * hv
-    c[2, 2, :, :] = 2 * np.square(np.abs(hv))
+@jit(nopython=True, nogil=True, cache=True)
+def _scattering_vector(hh: complex, hv: complex, vv: complex, matrix: int, k: int) -> complex:
+    if matrix == 0:
+        if k == 0:
+            return (hh + vv) / SQRT2
+        if k == 1:
+            return (hh - vv) / SQRT2
+        return SQRT2 * hv
+    if k == 0:
+        return hh
+    if k == 1:
+        return SQRT2 * hv
+    return vv
 
-    return c
 
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def diag_element_cpu(coeffs: npt.NDArray[np.complex64], matrix: int, k: int, out: npt.NDArray[np.float32]) -> None:
+    # (k, k) element
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            u = _scattering_vector(coeffs[0, 0, i, j], coeffs[0, 1, i, j], coeffs[1, 1, i, j], matrix, k)
+            out[i, j] = u.real * u.real + u.imag * u.imag
 
-def computeC_from_coeffs_gpu(coeffs: npt.NDArray[np.complex64], c:npt.NDArray[np.complex64]) -> npt.NDArray[np.complex64]:
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def upper_element_cpu(coeffs: npt.NDArray[np.complex64], matrix: int, m: int, n: int, out: npt.NDArray[np.complex64]) -> None:
+    # (m, n) element, m < n
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            hh = coeffs[0, 0, i, j]
+            hv = coeffs[0, 1, i, j]
+            vv = coeffs[1, 1, i, j]
+            out[i, j] = _scattering_vector(hh, hv, vv, matrix, m) * np.conj(_scattering_vector(hh, hv, vv, matrix, n))
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def span_cpu(coeffs: npt.NDArray[np.complex64], out: npt.NDArray[np.float32]) -> None:
+    # |HH|^2 + 2 |HV|^2 + |VV|^2, the trace of T and of C
+    _, _, x, y = coeffs.shape
+    for i in prange(x):
+        for j in range(y):
+            hh = coeffs[0, 0, i, j]
+            hv = coeffs[0, 1, i, j]
+            vv = coeffs[1, 1, i, j]
+            out[i, j] = (hh.real * hh.real + hh.imag * hh.imag
+                         + 2 * (hv.real * hv.real + hv.imag * hv.imag)
+                         + vv.real * vv.real + vv.imag * vv.imag)
+
+
+def computeC_from_coeffs_gpu(
+        coeffs: npt.NDArray[np.complex64],
+        c_diag: npt.NDArray[np.float32],
+        c_upper: npt.NDArray[np.complex64]
+        ) -> None:
     # TODO: coeffs and C ram object
     if not __cupy_import__:
         raise ImportError(f"Issue importing cupy for gpu computations")
     # TODO: complete this
-    return c
+
+
+# Calibration: DN -> calibrated coefficients in one pass, every pixel is read
+# once and written once (out may be coeffs itself for an in-place
+# calibration). scale holds the (2, 2) per channel amplitude factors and
+# incidence (1 or x, 1 or y) the incidence angle in degrees, broadcast over
+# the scene. mode 0 keeps beta0, 1 converts to sigma0 (x sin) and 2 to gamma0
+# (x tan), applied as the square root on the amplitudes.
+
+CALIBRATION_MODES = ("beta0", "sigma0", "gamma0")
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def calibrate_cpu(
+        coeffs: npt.NDArray[np.complex64],
+        scale: npt.NDArray[np.float64],
+        incidence: npt.NDArray[np.float64],
+        mode: int,
+        out: npt.NDArray[np.complex64]
+        ) -> None:
+    _, _, x, y = coeffs.shape
+    # 0 strides broadcast a scalar / per column angle
+    row_step = 1 if incidence.shape[0] > 1 else 0
+    col_step = 1 if incidence.shape[1] > 1 else 0
+    to_rad = np.pi / 180
+    for i in prange(x):
+        for j in range(y):
+            g = 1.0
+            if mode != 0:
+                theta = incidence[i * row_step, j * col_step] * to_rad
+                g = np.sqrt(np.sin(theta)) if mode == 1 else np.sqrt(np.tan(theta))
+            for p in range(2):
+                for q in range(2):
+                    out[p, q, i, j] = coeffs[p, q, i, j] * (scale[p, q] * g)
+
+
+# Multilooking: block reductions of (n, x, y) real planes over (az, rg)
+# blocks into out (n, x // az, y // rg), NaNs are ignored (a block of only
+# NaNs gives NaN). Complex data is reduced through its .real / .imag views.
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def multilook_mean_cpu(data: npt.NDArray[np.float32], az: int, rg: int, out: npt.NDArray[np.float32]) -> None:
+    n, x, y = out.shape
+    for k in prange(n * x):
+        p = k // x
+        i = k % x
+        acc = np.zeros(y, dtype=np.float64)
+        cnt = np.zeros(y, dtype=np.int64)
+        for a in range(i * az, (i + 1) * az):
+            for b in range(y * rg):
+                v = data[p, a, b]
+                if not np.isnan(v):
+                    acc[b // rg] += v
+                    cnt[b // rg] += 1
+        for j in range(y):
+            out[p, i, j] = acc[j] / cnt[j] if cnt[j] > 0 else np.nan
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _gather_block(data: npt.NDArray[np.float32], p: int, i: int, j: int, az: int, rg: int, buf: npt.NDArray[np.float64]) -> int:
+    cnt = 0
+    for a in range(i * az, (i + 1) * az):
+        for b in range(j * rg, (j + 1) * rg):
+            v = data[p, a, b]
+            if not np.isnan(v):
+                buf[cnt] = v
+                cnt += 1
+    return cnt
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def multilook_median_cpu(data: npt.NDArray[np.float32], az: int, rg: int, out: npt.NDArray[np.float32]) -> None:
+    n, x, y = out.shape
+    for k in prange(n * x):
+        p = k // x
+        i = k % x
+        buf = np.empty(az * rg, dtype=np.float64)
+        for j in range(y):
+            cnt = _gather_block(data, p, i, j, az, rg, buf)
+            out[p, i, j] = np.median(buf[:cnt]) if cnt > 0 else np.nan
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def multilook_mode_cpu(data: npt.NDArray[np.float32], az: int, rg: int, out: npt.NDArray[np.float32]) -> None:
+    # most frequent value of the block, the smallest one on ties
+    n, x, y = out.shape
+    for k in prange(n * x):
+        p = k // x
+        i = k % x
+        buf = np.empty(az * rg, dtype=np.float64)
+        for j in range(y):
+            cnt = _gather_block(data, p, i, j, az, rg, buf)
+            if cnt == 0:
+                out[p, i, j] = np.nan
+                continue
+            values = np.sort(buf[:cnt])
+            best, best_run, run = values[0], 1, 1
+            for b in range(1, cnt):
+                run = run + 1 if values[b] == values[b - 1] else 1
+                if run > best_run:
+                    best, best_run = values[b], run
+            out[p, i, j] = best
+
+
+# Typed signatures of the kernels for complex64 / complex128 scenes (float32 /
+# float64 real planes). precompile() compiles them ahead of the first call,
+# with cache=True the machine code is also kept on disk (__pycache__ next to
+# this file, or NUMBA_CACHE_DIR), so later processes load it instead of
+# compiling again. Other layouts / dtypes are still compiled on demand.
+
+DTYPES = {
+        "complex64": (types.float32, types.complex64),
+        "complex128": (types.float64, types.complex128)
+        }
+
+
+def _coeffs_signatures(dtype: str, products: int) -> List[Signature]:
+    # C contiguous scenes and crops of them (any layout) for the coefficients,
+    # freshly allocated packed planes for the products
+    real, cplx = DTYPES[dtype]
+    planes = (real[:, :, ::1], cplx[:, :, ::1]) * products
+    return [types.void(coeffs, *planes) for coeffs in (cplx[:, :, :, ::1], cplx[:, :, :, :])]
+
+
+def _element_signatures(dtype: str, upper: bool) -> List[Signature]:
+    # one freshly allocated (x, y) plane, real for the diagonal
+    real, cplx = DTYPES[dtype]
+    indices = (types.int64,) * (3 if upper else 2)
+    plane = cplx[:, ::1] if upper else real[:, ::1]
+    return [types.void(coeffs, *indices, plane) for coeffs in (cplx[:, :, :, ::1], cplx[:, :, :, :])]
+
+
+def _span_signatures(dtype: str) -> List[Signature]:
+    real, cplx = DTYPES[dtype]
+    return [types.void(coeffs, real[:, ::1]) for coeffs in (cplx[:, :, :, ::1], cplx[:, :, :, :])]
+
+
+def _multilook_signatures(dtype: str) -> List[Signature]:
+    # T / C diagonal planes (contiguous) and .real / .imag views of complex
+    # arrays (strided)
+    real, _ = DTYPES[dtype]
+    return [
+            types.void(real[:, :, ::1], types.int64, types.int64, real[:, :, ::1]),
+            types.void(real[:, :, :], types.int64, types.int64, real[:, :, :])
+            ]
+
+
+def _calibrate_signatures(dtype: str) -> List[Signature]:
+    # in place on a contiguous scene, scalar / per column / per pixel angles
+    _, cplx = DTYPES[dtype]
+    return [
+            types.void(cplx[:, :, :, ::1], types.float64[:, ::1], types.float64[:, ::1], types.int64, cplx[:, :, :, ::1]),
+            types.void(cplx[:, :, :, ::1], types.float64[:, ::1], types.float32[:, ::1], types.int64, cplx[:, :, :, ::1])
+            ]
+
+
+SIGNATURES = {
+        calibrate_cpu: _calibrate_signatures,
+        computeT_from_coeffs_cpu: lambda dtype: _coeffs_signatures(dtype, 1),
+        computeC_from_coeffs_cpu: lambda dtype: _coeffs_signatures(dtype, 1),
+        computeTC_from_coeffs_cpu: lambda dtype: _coeffs_signatures(dtype, 2),
+        diag_element_cpu: lambda dtype: _element_signatures(dtype, upper=False),
+        upper_element_cpu: lambda dtype: _element_signatures(dtype, upper=True),
+        span_cpu: _span_signatures,
+        multilook_mean_cpu: _multilook_signatures,
+        multilook_median_cpu: _multilook_signatures,
+        multilook_mode_cpu: _multilook_signatures
+        }
+
+
+def precompile(dtypes: Sequence[str] = ("complex64", "complex128")) -> Dict[str, float]:
+    """
+    Compiles (or loads from the on-disk cache) the typed signatures of the
+    cpu kernels, so that the first computeT / computeC / multilook of a
+    process does not wait for the JIT.
+
+    Parameters
+    ----------
+    dtypes: Sequence[str]
+        scene dtypes to compile for ('complex64' and / or 'complex128')
+
+    Returns
+    -------
+    Dict[str, float]
+        seconds spent per kernel
+    """
+    for dtype in dtypes:
+        if dtype not in DTYPES:
+            raise ValueError(f"un-supported dtype: {dtype}. Available dtypes: {tuple(DTYPES)}")
+    timings = dict()
+    for kernel, signatures in SIGNATURES.items():
+        start = time.perf_counter()
+        for dtype in dtypes:
+            for signature in signatures(dtype):
+                kernel.compile(signature)
+        timings[kernel.__name__] = time.perf_counter() - start
+    return timings
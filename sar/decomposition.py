@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+from numba import jit, prange
+from typing import Callable, Dict, NamedTuple
+
+from sar.hermitian import HermitianMatrix
+from sar.tiling import iter_tiles
+
+
+# Polarimetric decompositions of the (averaged) coherency matrix T in the
+# packed layout of sar.hermitian.HermitianMatrix, with
+# T11 = |HH + VV|^2 / 2, T22 = |HH - VV|^2 / 2 and T33 = 2 |HV|^2.
+#
+# Every kernel reads the six stored planes of a pixel once and writes all of
+# its outputs, the results go to preallocated (k, x, y) arrays (the fields of
+# the returned named tuples are views of it) filled tile by tile, so a memory
+# mapped T and / or output never has to be loaded as a whole.
+
+METHODS = ("pauli", "freeman_durden", "yamaguchi", "h_a_alpha")
+
+
+class FreemanDurden(NamedTuple):
+    surface : npt.NDArray[np.float32]
+    double  : npt.NDArray[np.float32]
+    volume  : npt.NDArray[np.float32]
+
+
+class Yamaguchi(NamedTuple):
+    surface : npt.NDArray[np.float32]
+    double  : npt.NDArray[np.float32]
+    volume  : npt.NDArray[np.float32]
+    helix   : npt.NDArray[np.float32]
+
+
+class HAAlpha(NamedTuple):
+    entropy     : npt.NDArray[np.float32]
+    anisotropy  : npt.NDArray[np.float32]
+    # mean alpha angle in degrees
+    alpha       : npt.NDArray[np.float32]
+    # (3, x, y) eigenvalues in decreasing order
+    eigenvalues : npt.NDArray[np.float32]
+
+
+@jit(nopython=True, nogil=True, fastmath=True, cache=True)
+def _powers(t11: float, t22: float, t12: complex):
+    # |HH|^2, |VV|^2 and HH VV* from the T elements
+    hh = 0.5 * (t11 + t22) + t12.real
+    vv = 0.5 * (t11 + t22) - t12.real
+    hhvv = complex(0.5 * (t11 - t22), -t12.imag)
+    return hh, vv, hhvv
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _freeman_durden_cpu(t_diag: npt.NDArray, t_upper: npt.NDArray, out: npt.NDArray) -> None:
+    _, x, y = t_diag.shape
+    for i in prange(x):
+        for j in range(y):
+            t11 = np.float64(t_diag[0, i, j])
+            t22 = np.float64(t_diag[1, i, j])
+            t33 = np.float64(t_diag[2, i, j])
+            span = t11 + t22 + t33
+            hh, vv, c = _powers(t11, t22, np.complex128(t_upper[0, i, j]))
+
+            # volume: <|HH|^2> = <|VV|^2> = 3 <|HV|^2> = 3 <HH VV*> = fv
+            fv = 1.5 * t33
+            pv = 4 * t33
+            hh -= fv
+            vv -= fv
+            c -= fv / 3
+            ps = 0.0
+            pd = 0.0
+            if hh <= 0 or vv <= 0:
+                pv = span
+            else:
+                residue = hh * vv - (c.real * c.real + c.imag * c.imag)
+                if c.real >= 0:
+                    # surface dominant, alpha = -1
+                    den = hh + vv + 2 * c.real
+                    fd = min(max(residue / den, 0.0), min(hh, vv)) if den > 0 else 0.0
+                    ps = vv - fd + hh - fd
+                    pd = 2 * fd
+                else:
+                    # double bounce dominant, beta = 1
+                    den = hh + vv - 2 * c.real
+                    fs = min(max(residue / den, 0.0), min(hh, vv)) if den > 0 else 0.0
+                    ps = 2 * fs
+                    pd = vv - fs + hh - fs
+            out[0, i, j] = ps
+            out[1, i, j] = pd
+            out[2, i, j] = pv
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _yamaguchi_cpu(t_diag: npt.NDArray, t_upper: npt.NDArray, out: npt.NDArray) -> None:
+    _, x, y = t_diag.shape
+    for i in prange(x):
+        for j in range(y):
+            t11 = np.float64(t_diag[0, i, j])
+            t22 = np.float64(t_diag[1, i, j])
+            t33 = np.float64(t_diag[2, i, j])
+            t12 = np.complex128(t_upper[0, i, j])
+            span = t11 + t22 + t33
+            hh, vv, _ = _powers(t11, t22, t12)
+
+            # volume model from 10 log10(<|VV|^2> / <|HH|^2>): uniform
+            # within +-2 dB, cos^2 distributed dipoles otherwise
+            pc = 2 * abs(np.complex128(t_upper[2, i, j]).imag)
+            ratio = 10 * np.log10(vv / hh) if hh > 0 and vv > 0 else 0.0
+            if ratio < -2:
+                model, v12 = 3.75, 1 / 6
+            elif ratio > 2:
+                model, v12 = 3.75, -1 / 6
+            else:
+                model, v12 = 4.0, 0.0
+            pv = model * (t33 - pc / 2)
+            if pv < 0:
+                pc = 0.0
+                pv = model * t33
+
+            ps = 0.0
+            pd = 0.0
+            if pv + pc > span:
+                pv = span - pc
+            else:
+                s = t11 - pv / 2
+                d = span - pv - pc - s
+                cc = t12 - v12 * pv
+                c2 = cc.real * cc.real + cc.imag * cc.imag
+                if s - d > 0:
+                    ps = s + c2 / s if s > 0 else 0.0
+                    pd = d - c2 / s if s > 0 else d
+                else:
+                    pd = d + c2 / d if d > 0 else 0.0
+                    ps = s - c2 / d if d > 0 else s
+                if ps < 0:
+                    ps = 0.0
+                    pd = span - pv - pc
+                if pd < 0:
+                    pd = 0.0
+                    ps = span - pv - pc
+            out[0, i, j] = max(ps, 0.0)
+            out[1, i, j] = max(pd, 0.0)
+            out[2, i, j] = max(pv, 0.0)
+            out[3, i, j] = pc
+
+
+@jit(nopython=True, nogil=True, fastmath=True, cache=True)
+def eigvalsh3(t11: float, t22: float, t33: float, t12: complex, t13: complex, t23: complex):
+    """
+    Eigenvalues (decreasing) of a 3x3 Hermitian matrix with the trigonometric
+    solution of the characteristic polynomial.
+    """
+    p1 = (t12.real * t12.real + t12.imag * t12.imag
+          + t13.real * t13.real + t13.imag * t13.imag
+          + t23.real * t23.real + t23.imag * t23.imag)
+    q = (t11 + t22 + t33) / 3
+    d1 = t11 - q
+    d2 = t22 - q
+    d3 = t33 - q
+    p2 = d1 * d1 + d2 * d2 + d3 * d3 + 2 * p1
+    if p2 <= 1e-30 * q * q:
+        return q, q, q
+    p = np.sqrt(p2 / 6)
+    # det(T - q I) / (2 p^3)
+    det = (d1 * d2 * d3
+           + 2 * (t12 * t23 * np.conj(t13)).real
+           - d1 * (t23.real * t23.real + t23.imag * t23.imag)
+           - d2 * (t13.real * t13.real + t13.imag * t13.imag)
+           - d3 * (t12.real * t12.real + t12.imag * t12.imag))
+    r = min(max(det / (2 * p * p * p), -1.0), 1.0)
+    phi = np.arccos(r) / 3
+    l1 = q + 2 * p * np.cos(phi)
+    l3 = q + 2 * p * np.cos(phi + 2 * np.pi / 3)
+    return l1, 3 * q - l1 - l3, l3
+
+
+@jit(nopython=True, nogil=True, fastmath=True, cache=True)
+def _first_component(t11: float, t22: float, t33: float, t12: complex, t13: complex, t23: complex, lam: float):
+    # |v_1|^2 / |v|^2 of the eigenvector of lam and |v|^2: v is the largest
+    # cross product of two rows of T - lam I (orthogonal to all of them)
+    a = complex(t11 - lam, 0.0)
+    b = complex(t22 - lam, 0.0)
+    c = complex(t33 - lam, 0.0)
+    # rows: (a, t12, t13), (t12*, b, t23), (t13*, t23*, c)
+    best = -1.0
+    first = 0.0
+    for k in range(3):
+        if k == 0:
+            u0, u1, u2 = a, t12, t13
+            w0, w1, w2 = np.conj(t12), b, t23
+        elif k == 1:
+            u0, u1, u2 = a, t12, t13
+            w0, w1, w2 = np.conj(t13), np.conj(t23), c
+        else:
+            u0, u1, u2 = np.conj(t12), b, t23
+            w0, w1, w2 = np.conj(t13), np.conj(t23), c
+        v0 = u1 * w2 - u2 * w1
+        v1 = u2 * w0 - u0 * w2
+        v2 = u0 * w1 - u1 * w0
+        n0 = v0.real * v0.real + v0.imag * v0.imag
+        norm = n0 + v1.real * v1.real + v1.imag * v1.imag + v2.real * v2.real + v2.imag * v2.imag
+        if norm > best:
+            best = norm
+            first = n0 / norm if norm > 0 else 0.0
+    return first, best
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _h_a_alpha_cpu(t_diag: npt.NDArray, t_upper: npt.NDArray, out: npt.NDArray) -> None:
+    _, x, y = t_diag.shape
+    log3 = np.log(3.0)
+    for i in prange(x):
+        for j in range(y):
+            t11 = np.float64(t_diag[0, i, j])
+            t22 = np.float64(t_diag[1, i, j])
+            t33 = np.float64(t_diag[2, i, j])
+            t12 = np.complex128(t_upper[0, i, j])
+            t13 = np.complex128(t_upper[1, i, j])
+            t23 = np.complex128(t_upper[2, i, j])
+            l1, l2, l3 = eigvalsh3(t11, t22, t33, t12, t13, t23)
+            # eigenvalues below the float32 precision of T are 0
+            floor = 1e-6 * (t11 + t22 + t33)
+            l1 = l1 if l1 > floor else 0.0
+            l2 = l2 if l2 > floor else 0.0
+            l3 = l3 if l3 > floor else 0.0
+            total = l1 + l2 + l3
+            out[3, i, j] = l1
+            out[4, i, j] = l2
+            out[5, i, j] = l3
+            if total <= 0:
+                out[0, i, j] = 0
+                out[1, i, j] = 0
+                out[2, i, j] = 0
+                continue
+
+            # eigenvectors of (nearly) repeated eigenvalues are not defined,
+            # their first components share what the others leave
+            tol = 1e-12 * total * total * total * total
+            w1, n1 = _first_component(t11, t22, t33, t12, t13, t23, l1)
+            w2, n2 = _first_component(t11, t22, t33, t12, t13, t23, l2)
+            w3, n3 = _first_component(t11, t22, t33, t12, t13, t23, l3)
+            ok1 = n1 > tol
+            ok2 = n2 > tol
+            ok3 = n3 > tol
+            n_ok = ok1 + ok2 + ok3
+            if n_ok == 0:
+                w1 = w2 = w3 = 1 / 3
+            elif n_ok == 1:
+                rest = (1 - (w1 if ok1 else (w2 if ok2 else w3))) / 2
+                w1 = w1 if ok1 else rest
+                w2 = w2 if ok2 else rest
+                w3 = w3 if ok3 else rest
+            elif n_ok == 2:
+                rest = max(1 - (w1 if ok1 else 0) - (w2 if ok2 else 0) - (w3 if ok3 else 0), 0.0)
+                w1 = w1 if ok1 else rest
+                w2 = w2 if ok2 else rest
+                w3 = w3 if ok3 else rest
+
+            p1 = l1 / total
+            p2 = l2 / total
+            p3 = l3 / total
+            entropy = 0.0
+            for p in (p1, p2, p3):
+                if p > 0:
+                    entropy -= p * np.log(p)
+            out[0, i, j] = entropy / log3
+            out[1, i, j] = (l2 - l3) / (l2 + l3) if l2 + l3 > 0 else 0.0
+            out[2, i, j] = np.degrees(
+                    p1 * np.arccos(np.sqrt(min(w1, 1.0)))
+                    + p2 * np.arccos(np.sqrt(min(w2, 1.0)))
+                    + p3 * np.arccos(np.sqrt(min(w3, 1.0)))
+                    )
+
+
+def _run(
+        kernel: Callable,
+        matrix: HermitianMatrix,
+        planes: int,
+        out: npt.NDArray | None,
+        tile_rows: int
+        ) -> npt.NDArray:
+    _, _, x, y = matrix.shape
+    if out is None:
+        out = np.empty([planes, x, y], dtype=np.float32)
+    elif out.shape != (planes, x, y):
+        raise ValueError(f"out should be of shape {(planes, x, y)} [given -> {out.shape}]")
+    for start, stop, _, _ in iter_tiles(x, tile_rows):
+        kernel(
+                np.asarray(matrix.diag[:, start:stop]),
+                np.asarray(matrix.upper[:, start:stop]),
+                np.asarray(out[:, start:stop])
+                )
+    return out
+
+
+def pauli(matrix: HermitianMatrix, out: npt.NDArray | None = None, tile_rows: int = 1024) -> npt.NDArray:
+    """
+    Pauli powers as (3, x, y) R, G, B planes: |HH - VV|^2 / 2 (T22),
+    2 |HV|^2 (T33) and |HH + VV|^2 / 2 (T11).
+    """
+    _, _, x, y = matrix.shape
+    if out is None:
+        out = np.empty([3, x, y], dtype=np.float32)
+    elif out.shape != (3, x, y):
+        raise ValueError(f"out should be of shape {(3, x, y)} [given -> {out.shape}]")
+    for start, stop, _, _ in iter_tiles(x, tile_rows):
+        for k, element in enumerate((1, 2, 0)):
+            out[k, start:stop] = matrix.diag[element, start:stop]
+    return out
+
+
+def pauli_rgb(matrix: HermitianMatrix, percentile: float = 99, db: bool = False) -> npt.NDArray[np.float32]:
+    """
+    (x, y, 3) Pauli RGB image for display, every channel is scaled to [0, 1]
+    by its percentile (in dB with db=True).
+    """
+    planes = pauli(matrix)
+    if db:
+        planes = 10 * np.log10(np.maximum(planes, np.finfo(np.float32).tiny))
+    rgb = np.empty([*planes.shape[1:], 3], dtype=np.float32)
+    for k in range(3):
+        low, high = np.nanpercentile(planes[k], [100 - percentile, percentile]) if db else (0, np.nanpercentile(planes[k], percentile))
+        rgb[..., k] = np.clip((planes[k] - low) / (high - low if high > low else 1), 0, 1)
+    return rgb
+
+
+def freeman_durden(matrix: HermitianMatrix, out: npt.NDArray | None = None, tile_rows: int = 1024) -> FreemanDurden:
+    """
+    Freeman-Durden three component decomposition (surface, double bounce,
+    volume powers). Pixels where the volume model leaves a negative |HH|^2 or
+    |VV|^2 are all volume.
+
+    Parameters
+    ----------
+    matrix: HermitianMatrix
+        averaged T matrix
+    out: npt.NDArray | None
+        (3, x, y) array to write the powers into
+    tile_rows: int
+        rows processed at a time
+
+    Returns
+    -------
+    FreemanDurden
+    """
+    return FreemanDurden(*_run(_freeman_durden_cpu, matrix, 3, out, tile_rows))
+
+
+def yamaguchi(matrix: HermitianMatrix, out: npt.NDArray | None = None, tile_rows: int = 1024) -> Yamaguchi:
+    """
+    Yamaguchi four component decomposition (surface, double bounce, volume,
+    helix powers) with the volume model chosen from the |VV|^2 / |HH|^2 ratio,
+    see freeman_durden for the parameters.
+    """
+    return Yamaguchi(*_run(_yamaguchi_cpu, matrix, 4, out, tile_rows))
+
+
+def h_a_alpha(matrix: HermitianMatrix, out: npt.NDArray | None = None, tile_rows: int = 1024) -> HAAlpha:
+    """
+    Cloude-Pottier entropy, anisotropy and mean alpha angle from the
+    eigen decomposition of T, computed in closed form per pixel.
+
+    Parameters
+    ----------
+    matrix: HermitianMatrix
+        averaged T matrix
+    out: npt.NDArray | None
+        (6, x, y) array for entropy, anisotropy, alpha and the 3 eigenvalues
+    tile_rows: int
+        rows processed at a time
+
+    Returns
+    -------
+    HAAlpha
+    """
+    out = _run(_h_a_alpha_cpu, matrix, 6, out, tile_rows)
+    return HAAlpha(out[0], out[1], out[2], out[3:])
+
+
+DECOMPOSITIONS: Dict[str, Callable] = {
+        "pauli": pauli,
+        "freeman_durden": freeman_durden,
+        "yamaguchi": yamaguchi,
+        "h_a_alpha": h_a_alpha
+        }
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import os
+import numpy as np
+import numpy.typing as npt
+
+from typing import Any, Iterator
+from contextlib import contextmanager
+
+
+# Precision policy of the pipeline: the complex dtype of the scattering
+# coefficients, which also sets the dtype of T / C (float for the diagonal,
+# complex for the upper triangle), of multilooked / filtered products and of
+# what is saved. complex64 by default (float32 is plenty for DFSAR data and
+# halves memory, disk and kernel time), the SAR_DTYPE environment variable or
+# set_dtype / dtype_policy change it.
+
+COMPLEX_DTYPES = ("complex64", "complex128")
+
+
+def _check(dtype: npt.DTypeLike) -> np.dtype:
+    dtype = np.dtype(dtype)
+    if dtype.name not in COMPLEX_DTYPES:
+        raise ValueError(f"un-supported dtype: {dtype}. Available dtypes: {COMPLEX_DTYPES}")
+    return dtype
+
+
+_dtype = _check(os.environ.get("SAR_DTYPE", "complex64"))
+
+
+def get_dtype() -> np.dtype:
+    return _dtype
+
+
+def set_dtype(dtype: npt.DTypeLike) -> None:
+    global _dtype
+    _dtype = _check(dtype)
+
+
+@contextmanager
+def dtype_policy(dtype: npt.DTypeLike) -> Iterator[np.dtype]:
+    """
+    Sets the policy dtype within a with block.
+    """
+    previous = get_dtype()
+    set_dtype(dtype)
+    try:
+        yield get_dtype()
+    finally:
+        set_dtype(previous)
+
+
+def complex_dtype(dtype: npt.DTypeLike | None = None) -> np.dtype:
+    """
+    dtype (checked) or the policy dtype if None.
+    """
+    return get_dtype() if dtype is None else _check(dtype)
+
+
+def real_dtype(dtype: npt.DTypeLike | None = None) -> np.dtype:
+    """
+    Real counterpart (float32 / float64) of complex_dtype(dtype).
+    """
+    return np.finfo(complex_dtype(dtype)).dtype
+
+
+def as_dtype(array: Any, dtype: npt.DTypeLike) -> Any:
+    """
+    array unchanged if it already has dtype (memory maps and lazy arrays stay
+    as they are), otherwise converted in memory.
+    """
+    dtype = np.dtype(dtype)
+    if array.dtype == dtype:
+        return array
+    return np.asarray(array).astype(dtype)
+
+
+def complex_from_planes(real: npt.NDArray, imag: npt.NDArray, dtype: npt.DTypeLike | None = None, out: npt.NDArray | None = None) -> npt.NDArray:
+    """
+    real + 1j * imag written straight into a complex array of the policy dtype
+    (no complex128 temporaries).
+    """
+    if out is None:
+        out = np.empty(np.shape(real), dtype=complex_dtype(dtype))
+    out.real = real
+    out.imag = imag
+    return out
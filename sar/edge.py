@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import os
+import numpy as np
+import numpy.typing as npt
+from numba import jit
+from scipy import stats
+from typing import NamedTuple, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from sar.hermitian import HermitianMatrix
+from sar.tiling import iter_tiles
+
+
+# Edge detection on T with the four orientations of cfar_edge_detector.py:
+# for a win x win window the two halves of width `half` on either side of a
+# one pixel wide line through the centre are compared. The line is
+# horizontal (0), vertical (1), along the diagonal (2) or along the
+# anti-diagonal (3).
+#
+# Window sums come from integral images. The rectangular halves of
+# orientations 0 and 1 cost O(1) per pixel, the triangular halves of 2 and 3
+# one row segment per window row. Pixels closer than win // 2 to the scene
+# border are not tested (strength 0).
+
+METHODS = ("ratio", "wishart")
+ORIENTATIONS = ("horizontal", "vertical", "diagonal", "anti-diagonal")
+
+
+class Edges(NamedTuple):
+    # ratio: 1 - min(mean_a / mean_b, mean_b / mean_a) of the span
+    # wishart: -2 rho ln Q of the equality test of the two halves
+    strength    : npt.NDArray[np.float32]
+    orientation : npt.NDArray[np.int8]
+    # strength above threshold (None without a pfa)
+    edges       : npt.NDArray[np.bool_] | None
+    threshold   : float | None
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _rect(S: npt.NDArray[np.float64], k: int, r0: int, r1: int, c0: int, c1: int) -> float:
+    # sum of rows r0..r1, columns c0..c1 (inclusive) of plane k
+    return S[k, r1 + 1, c1 + 1] - S[k, r0, c1 + 1] - S[k, r1 + 1, c0] + S[k, r0, c0]
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _half_sums(S: npt.NDArray[np.float64], i: int, j: int, o: int, side: int, h: int, m: int, out: npt.NDArray[np.float64]) -> None:
+    # side -1: offsets -m..-1 from the centre line, side 1: 1..m
+    lo = 1 if side > 0 else -m
+    hi = m if side > 0 else -1
+    for k in range(S.shape[0]):
+        if o == 0:
+            out[k] = _rect(S, k, i + lo, i + hi, j - h, j + h)
+        elif o == 1:
+            out[k] = _rect(S, k, i - h, i + h, j + lo, j + hi)
+        else:
+            acc = 0.0
+            for dr in range(-h, h + 1):
+                if o == 2:
+                    c0, c1 = max(dr + lo, -h), min(dr + hi, h)
+                else:
+                    c0, c1 = max(-dr + lo, -h), min(-dr + hi, h)
+                if c0 <= c1:
+                    acc += _rect(S, k, i + dr, i + dr, j + c0, j + c1)
+            out[k] = acc
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _logdet(v: npt.NDArray[np.float64]) -> float:
+    # v: T11, T22, T33, Re T12, Im T12, Re T13, Im T13, Re T23, Im T23
+    t12 = complex(v[3], v[4])
+    t13 = complex(v[5], v[6])
+    t23 = complex(v[7], v[8])
+    det = (v[0] * v[1] * v[2]
+           + 2 * (t12 * t23 * np.conj(t13)).real
+           - v[0] * abs(t23) ** 2
+           - v[1] * abs(t13) ** 2
+           - v[2] * abs(t12) ** 2)
+    return np.log(max(det, 1e-300))
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _detect_cpu(
+        S: npt.NDArray[np.float64],
+        method: int,
+        h: int,
+        m: int,
+        counts: npt.NDArray[np.float64],
+        looks: float,
+        r0: int,
+        r1: int,
+        strength: npt.NDArray[np.float32],
+        orientation: npt.NDArray[np.int8]
+        ) -> None:
+    # rows r0..r1 of the tile are written to strength / orientation rows 0..
+    x = S.shape[1] - 1
+    y = S.shape[2] - 1
+    a = np.empty(S.shape[0], dtype=np.float64)
+    b = np.empty(S.shape[0], dtype=np.float64)
+    ab = np.empty(S.shape[0], dtype=np.float64)
+    for i in range(r0, r1):
+        for j in range(y):
+            strength[i - r0, j] = 0
+            orientation[i - r0, j] = 0
+            if i < h or i >= x - h or j < h or j >= y - h:
+                continue
+            best = -np.inf
+            for o in range(4):
+                _half_sums(S, i, j, o, -1, h, m, a)
+                _half_sums(S, i, j, o, 1, h, m, b)
+                if method == 0:
+                    if a[0] <= 0 or b[0] <= 0:
+                        continue
+                    value = 1 - min(a[0] / b[0], b[0] / a[0])
+                else:
+                    n = counts[o] * looks
+                    for k in range(S.shape[0]):
+                        ab[k] = a[k] + b[k]
+                    rho = 1 - 17 / (12 * n)
+                    lnq = n * (6 * np.log(2) + _logdet(a) + _logdet(b) - 2 * _logdet(ab))
+                    value = -2 * rho * lnq
+                if value > best:
+                    best = value
+                    strength[i - r0, j] = value
+                    orientation[i - r0, j] = o
+
+
+def half_counts(win: int, half: int) -> npt.NDArray[np.float64]:
+    """
+    Number of pixels in one half window for each orientation.
+    """
+    h = win // 2
+    r, c = np.mgrid[-h:h + 1, -h:h + 1]
+    return np.array([
+        ((d >= 1) & (d <= half)).sum()
+        for d in (r, c, c - r, c + r)
+        ], dtype=np.float64)
+
+
+def threshold(method: str, pfa: float, win: int = 7, half: int = 3, looks: float = 1) -> float:
+    """
+    CFAR threshold on the strength for a false alarm probability pfa per
+    orientation on homogeneous (uncorrelated) speckle.
+
+    ratio: the ratio of the two half means of L look intensities is
+    F(2 N L, 2 N L) distributed. wishart: -2 rho ln Q is chi2 with 9 degrees
+    of freedom. N is the smallest half window of the four orientations.
+    """
+    n = half_counts(win, half).min() * looks
+    if method == "ratio":
+        return float(1 - stats.f.ppf(pfa / 2, 2 * n, 2 * n))
+    elif method == "wishart":
+        return float(stats.chi2.isf(pfa, 9))
+    raise ValueError(f"un-supported edge detector: {method}. Available detectors: {METHODS}")
+
+
+def _planes(matrix: HermitianMatrix, method: str) -> npt.NDArray:
+    if method == "ratio":
+        return (matrix.diag[0] + matrix.diag[1] + matrix.diag[2])[np.newaxis]
+    upper = matrix.upper
+    return np.array([
+        matrix.diag[0], matrix.diag[1], matrix.diag[2],
+        upper[0].real, upper[0].imag,
+        upper[1].real, upper[1].imag,
+        upper[2].real, upper[2].imag
+        ])
+
+
+def integral_image(planes: npt.NDArray) -> npt.NDArray[np.float64]:
+    """
+    (k, x, y) planes -> (k, x + 1, y + 1) float64 integral images with a
+    leading row and column of zeros.
+    """
+    k, x, y = planes.shape
+    S = np.zeros([k, x + 1, y + 1], dtype=np.float64)
+    np.cumsum(planes, axis=1, dtype=np.float64, out=S[:, 1:, 1:])
+    np.cumsum(S[:, 1:, 1:], axis=2, out=S[:, 1:, 1:])
+    return S
+
+
+def detect_edges(
+        matrix: HermitianMatrix,
+        method: str = "ratio",
+        win: int = 7,
+        half: int = 3,
+        looks: float = 1,
+        pfa: float | None = None,
+        tile_rows: int = 1024,
+        workers: int | None = None
+        ) -> Edges:
+    """
+    Ratio (span) or Wishart (full T) edge detection over the four
+    orientations, the strongest orientation is kept per pixel.
+
+    Window sums are read from integral images: the horizontal and vertical
+    halves cost O(1) per pixel, the diagonal and anti-diagonal halves
+    O(win) (one row segment per window row), so the run time grows
+    linearly with win. O(1) diagonal halves (cumulative sums along the
+    diagonals) were measured slower below win ~ 50 and cost two more
+    float64 copies of the planes per tile.
+
+    Parameters
+    ----------
+    matrix: HermitianMatrix
+        T (or C) matrix, may be memory mapped
+    method: str
+        'ratio' or 'wishart'
+    win: int
+        odd window size
+    half: int
+        width of each half window, at most win // 2
+    looks: float
+        equivalent number of looks of the matrix
+    pfa: float | None
+        false alarm probability, sets Edges.edges / Edges.threshold
+    tile_rows: int
+        rows per tile, tiles are processed concurrently
+    workers: int | None
+        number of tiles processed at the same time (default: cpu count)
+
+    Returns
+    -------
+    Edges
+    """
+    if method not in METHODS:
+        raise ValueError(f"un-supported edge detector: {method}. Available detectors: {METHODS}")
+    if win < 3 or win % 2 == 0 or not 1 <= half <= win // 2:
+        raise ValueError(f"win should be odd >= 3 and 1 <= half <= win // 2 [given -> win={win}, half={half}]")
+    h = win // 2
+    _, _, x, y = matrix.shape
+    strength = np.zeros([x, y], dtype=np.float32)
+    orientation = np.zeros([x, y], dtype=np.int8)
+    counts = half_counts(win, half)
+    method_id = METHODS.index(method)
+
+    def run(tile: Tuple[int, int, int, int]) -> None:
+        start, stop, read_start, read_stop = tile
+        planes = _planes(matrix.crop(read_start, read_stop, 0, y), method)
+        _detect_cpu(
+                integral_image(planes), method_id, h, half, counts, looks,
+                start - read_start, stop - read_start,
+                strength[start:stop], orientation[start:stop]
+                )
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        list(executor.map(run, iter_tiles(x, tile_rows, overlap=h)))
+
+    edges = None
+    limit = None
+    if pfa is not None:
+        limit = threshold(method, pfa, win=win, half=half, looks=looks)
+        edges = strength > limit
+    return Edges(strength, orientation, edges, limit)
@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+from numba import jit, prange
+from typing import Tuple
+
+from sar.hermitian import HermitianMatrix
+
+
+# Speckle filters for intensity images (2-D real arrays) and for T / C
+# matrices (HermitianMatrix).
+#
+# Local statistics come from running-sum box means, O(1) per pixel whatever
+# the window size. Windows are truncated at the image borders. The matrix
+# versions derive one weight per pixel from the span (T11 + T22 + T33) and
+# apply it to every element, so the filtered matrix stays Hermitian and
+# positive semi-definite.
+#
+# The kernels are not fastmath, they see NaN (regions filled by writeback
+# or crops) and NaN checks / comparisons would be optimised away.
+
+METHODS = ("lee", "enhanced_lee", "kuan", "frost", "median", "refined_lee")
+_ADAPTIVE = {"lee": 0, "kuan": 1, "enhanced_lee": 2}
+_CHUNK = 256
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _row_sums_cpu(img: npt.NDArray, h: int, tmp: npt.NDArray) -> None:
+    # tmp sets the accumulation dtype (float64 / complex128)
+    x, y = img.shape
+    for i in prange(x):
+        # typed zero of the accumulation dtype (tmp may hold NaNs)
+        tmp[i, 0] = 0
+        acc = tmp[i, 0]
+        for j in range(min(h, y - 1) + 1):
+            acc += img[i, j]
+        tmp[i, 0] = acc
+        for j in range(1, y):
+            if j + h < y:
+                acc += img[i, j + h]
+            if j - h - 1 >= 0:
+                acc -= img[i, j - h - 1]
+            tmp[i, j] = acc
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _col_sums_cpu(tmp: npt.NDArray, h: int, out: npt.NDArray) -> None:
+    # running sums down the columns, restarted for every chunk of rows
+    x, y = tmp.shape
+    for c in prange((x + _CHUNK - 1) // _CHUNK):
+        r0 = c * _CHUNK
+        r1 = min(x, r0 + _CHUNK)
+        for j in range(y):
+            out[r0, j] = 0
+            acc = out[r0, j]
+            for i in range(max(0, r0 - h), min(x, r0 + h + 1)):
+                acc += tmp[i, j]
+            out[r0, j] = acc
+        for i in range(r0 + 1, r1):
+            for j in range(y):
+                acc = out[i - 1, j]
+                if i + h < x:
+                    acc += tmp[i + h, j]
+                if i - h - 1 >= 0:
+                    acc -= tmp[i - h - 1, j]
+                out[i, j] = acc
+        for i in range(r0, r1):
+            rows = min(i + h, x - 1) - max(i - h, 0) + 1
+            for j in range(y):
+                out[i, j] /= rows * (min(j + h, y - 1) - max(j - h, 0) + 1)
+
+
+def _check_win(win: int) -> int:
+    if win < 3 or win % 2 == 0:
+        raise ValueError(f"win should be an odd window size >= 3 [given -> {win}]")
+    return win // 2
+
+
+def box_mean(img: npt.NDArray, win: int) -> npt.NDArray:
+    """
+    Mean over win x win windows (truncated at the borders) of a 2-D real or
+    complex array, in float64 / complex128.
+    """
+    h = _check_win(win)
+    dtype = np.complex128 if np.iscomplexobj(img) else np.float64
+    tmp = np.empty(img.shape, dtype=dtype)
+    out = np.empty(img.shape, dtype=dtype)
+    _row_sums_cpu(img, h, tmp)
+    _col_sums_cpu(tmp, h, out)
+    return out
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _adaptive_weights_cpu(
+        mean: npt.NDArray[np.float64],
+        mean2: npt.NDArray[np.float64],
+        method: int,
+        cu2: float,
+        damping: float,
+        w: npt.NDArray[np.float64]
+        ) -> None:
+    # weight of the pixel value against the local mean, out = m + w (x - m)
+    x, y = mean.shape
+    cu = np.sqrt(cu2)
+    cmax = np.sqrt(1 + 2 * cu2)
+    for i in prange(x):
+        for j in range(y):
+            m = mean[i, j]
+            var = mean2[i, j] - m * m
+            # NaN (writeback / crop fill) and zero variance: the local mean
+            if not (m > 0 and var > 0):
+                w[i, j] = 0.0
+                continue
+            ci2 = var / (m * m)
+            if method == 0:
+                wij = 1 - cu2 / ci2
+            elif method == 1:
+                wij = (1 - cu2 / ci2) / (1 + cu2)
+            else:
+                ci = np.sqrt(ci2)
+                if ci <= cu:
+                    wij = 0.0
+                elif ci < cmax:
+                    wij = 1 - np.exp(-damping * (ci - cu) / (cmax - ci))
+                else:
+                    wij = 1.0
+            w[i, j] = min(1.0, max(0.0, wij))
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _apply_weights_cpu(img: npt.NDArray, mean: npt.NDArray, w: npt.NDArray[np.float64], out: npt.NDArray) -> None:
+    x, y = img.shape
+    for i in prange(x):
+        for j in range(y):
+            out[i, j] = mean[i, j] + w[i, j] * (img[i, j] - mean[i, j])
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _frost_cpu(img: npt.NDArray, ci2: npt.NDArray[np.float64], h: int, damping: float, out: npt.NDArray) -> None:
+    x, y = img.shape
+    for i in prange(x):
+        for j in range(y):
+            a = damping * ci2[i, j]
+            acc = img[i, j] * 0.0
+            norm = 0.0
+            for p in range(max(0, i - h), min(x, i + h + 1)):
+                for q in range(max(0, j - h), min(y, j + h + 1)):
+                    k = np.exp(-a * np.sqrt((p - i) ** 2 + (q - j) ** 2))
+                    acc += k * img[p, q]
+                    norm += k
+            out[i, j] = acc / norm
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _median_cpu(img: npt.NDArray, h: int, out: npt.NDArray) -> None:
+    x, y = img.shape
+    for i in prange(x):
+        buf = np.empty((2 * h + 1) ** 2, dtype=np.float64)
+        for j in range(y):
+            cnt = 0
+            for p in range(max(0, i - h), min(x, i + h + 1)):
+                for q in range(max(0, j - h), min(y, j + h + 1)):
+                    buf[cnt] = img[p, q]
+                    cnt += 1
+            out[i, j] = np.median(buf[:cnt])
+
+
+def _local_stats(img: npt.NDArray, win: int) -> Tuple[npt.NDArray, npt.NDArray]:
+    mean = box_mean(img, win)
+    mean2 = box_mean(np.square(img, dtype=np.float64), win)
+    return mean, mean2
+
+
+def _ci2(mean: npt.NDArray, mean2: npt.NDArray) -> npt.NDArray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ci2 = (mean2 - mean * mean) / (mean * mean)
+    return np.nan_to_num(np.maximum(ci2, 0), nan=0.0, posinf=0.0)
+
+
+def _filter_plane(
+        plane: npt.NDArray,
+        method: str,
+        win: int,
+        damping: float,
+        w: npt.NDArray | None = None,
+        ci2: npt.NDArray | None = None,
+        out: npt.NDArray | None = None
+        ) -> npt.NDArray:
+    if out is None:
+        out = np.empty_like(plane)
+    h = win // 2
+    if method == "median":
+        if np.iscomplexobj(plane):
+            _median_cpu(plane.real, h, out.real)
+            _median_cpu(plane.imag, h, out.imag)
+        else:
+            _median_cpu(plane, h, out)
+    elif method == "frost":
+        _frost_cpu(plane, ci2, h, damping, out)
+    else:
+        _apply_weights_cpu(plane, box_mean(plane, win), w, out)
+    return out
+
+
+def _check(method: str, win: int, looks: float) -> None:
+    if method not in METHODS:
+        raise ValueError(f"un-supported filter: {method}. Available filters: {METHODS}")
+    _check_win(win)
+    if looks <= 0:
+        raise ValueError(f"looks should be positive [given -> {looks}]")
+
+
+def speckle_filter(img: npt.NDArray, method: str = "lee", win: int = 7, looks: float = 1, damping: float = 1.0) -> npt.NDArray:
+    """
+    Speckle filter of an intensity image.
+
+    Parameters
+    ----------
+    img: npt.NDArray
+        2-D real image (intensity, e.g. T11 or |HH|^2)
+    method: str
+        'lee', 'enhanced_lee', 'kuan', 'frost' or 'median' ('refined_lee'
+        needs the full matrix, see filter_matrix)
+    win: int
+        odd window size
+    looks: float
+        equivalent number of looks of img, sets the speckle variation 1 / looks
+    damping: float
+        damping factor of the enhanced Lee and Frost filters
+
+    Returns
+    -------
+    npt.NDArray
+        filtered image, same dtype as img
+    """
+    _check(method, win, looks)
+    if method == "refined_lee":
+        raise ValueError("refined_lee filters a whole T / C matrix, use filter_matrix")
+    if np.iscomplexobj(img):
+        raise ValueError("speckle_filter expects a real (intensity) image")
+    w = ci2 = None
+    if method in _ADAPTIVE:
+        mean, mean2 = _local_stats(img, win)
+        w = np.empty(img.shape, dtype=np.float64)
+        _adaptive_weights_cpu(mean, mean2, _ADAPTIVE[method], 1 / looks, damping, w)
+    elif method == "frost":
+        ci2 = _ci2(*_local_stats(img, win))
+    return _filter_plane(img, method, win, damping, w=w, ci2=ci2)
+
+
+def lee(img: npt.NDArray, win: int = 7, looks: float = 1) -> npt.NDArray:
+    return speckle_filter(img, "lee", win=win, looks=looks)
+
+
+def enhanced_lee(img: npt.NDArray, win: int = 7, looks: float = 1, damping: float = 1.0) -> npt.NDArray:
+    return speckle_filter(img, "enhanced_lee", win=win, looks=looks, damping=damping)
+
+
+def kuan(img: npt.NDArray, win: int = 7, looks: float = 1) -> npt.NDArray:
+    return speckle_filter(img, "kuan", win=win, looks=looks)
+
+
+def frost(img: npt.NDArray, win: int = 7, damping: float = 1.0) -> npt.NDArray:
+    return speckle_filter(img, "frost", win=win, damping=damping)
+
+
+def median(img: npt.NDArray, win: int = 7) -> npt.NDArray:
+    return speckle_filter(img, "median", win=win)
+
+
+# refined Lee: edge aligned windows selected from the gradients of the 3x3
+# sub-window means of the span (Lee, Grunes & de Grandi, 1999)
+
+def _sub_window(win: int) -> Tuple[int, int]:
+    sub = win // 3
+    if sub % 2 == 0:
+        sub += 1
+    return sub, (win - sub) // 2
+
+
+def refined_lee_masks(win: int) -> npt.NDArray[np.bool_]:
+    """
+    The 8 edge aligned windows (win x win): left, right, top, bottom,
+    upper-right, lower-left, upper-left, lower-right halves, each including
+    the centre line.
+    """
+    r, c = np.mgrid[0:win, 0:win]
+    h = win // 2
+    return np.array([
+        c <= h, c >= h,
+        r <= h, r >= h,
+        c >= r, r >= c,
+        r + c <= win - 1, r + c >= win - 1
+        ])
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _refined_lee_select_cpu(
+        span: npt.NDArray,
+        sub_mean: npt.NDArray[np.float64],
+        masks: npt.NDArray[np.bool_],
+        step: int,
+        cu2: float,
+        direction: npt.NDArray[np.int8],
+        w: npt.NDArray[np.float64]
+        ) -> None:
+    x, y = span.shape
+    win = masks.shape[1]
+    h = win // 2
+    for i in prange(x):
+        m = np.empty((3, 3), dtype=np.float64)
+        for j in range(y):
+            for a in range(3):
+                for b in range(3):
+                    p = min(max(i + (a - 1) * step, 0), x - 1)
+                    q = min(max(j + (b - 1) * step, 0), y - 1)
+                    m[a, b] = sub_mean[p, q]
+            g = np.empty(4, dtype=np.float64)
+            g[0] = abs((m[0, 2] + m[1, 2] + m[2, 2]) - (m[0, 0] + m[1, 0] + m[2, 0]))
+            g[1] = abs((m[2, 0] + m[2, 1] + m[2, 2]) - (m[0, 0] + m[0, 1] + m[0, 2]))
+            g[2] = abs((m[0, 1] + m[0, 2] + m[1, 2]) - (m[1, 0] + m[2, 0] + m[2, 1]))
+            g[3] = abs((m[0, 0] + m[0, 1] + m[1, 0]) - (m[1, 2] + m[2, 1] + m[2, 2]))
+            d = np.argmax(g)
+            # side of the edge the centre belongs to
+            if d == 0:
+                k = 0 if abs(m[1, 0] - m[1, 1]) <= abs(m[1, 2] - m[1, 1]) else 1
+            elif d == 1:
+                k = 2 if abs(m[0, 1] - m[1, 1]) <= abs(m[2, 1] - m[1, 1]) else 3
+            elif d == 2:
+                k = 4 if abs(m[0, 2] - m[1, 1]) <= abs(m[2, 0] - m[1, 1]) else 5
+            else:
+                k = 6 if abs(m[0, 0] - m[1, 1]) <= abs(m[2, 2] - m[1, 1]) else 7
+            direction[i, j] = k
+
+            s = 0.0
+            s2 = 0.0
+            n = 0
+            for p in range(max(0, i - h), min(x, i + h + 1)):
+                for q in range(max(0, j - h), min(y, j + h + 1)):
+                    if masks[k, p - i + h, q - j + h]:
+                        v = span[p, q]
+                        s += v
+                        s2 += v * v
+                        n += 1
+            mean = s / n
+            var_y = s2 / n - mean * mean
+            if var_y <= 0:
+                w[i, j] = 0.0
+            else:
+                var_x = (var_y - mean * mean * cu2) / (1 + cu2)
+                w[i, j] = min(1.0, max(0.0, var_x / var_y))
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _refined_lee_apply_cpu(
+        plane: npt.NDArray,
+        masks: npt.NDArray[np.bool_],
+        direction: npt.NDArray[np.int8],
+        w: npt.NDArray[np.float64],
+        out: npt.NDArray
+        ) -> None:
+    x, y = plane.shape
+    h = masks.shape[1] // 2
+    for i in prange(x):
+        for j in range(y):
+            k = direction[i, j]
+            acc = plane[i, j] * 0.0
+            n = 0
+            for p in range(max(0, i - h), min(x, i + h + 1)):
+                for q in range(max(0, j - h), min(y, j + h + 1)):
+                    if masks[k, p - i + h, q - j + h]:
+                        acc += plane[p, q]
+                        n += 1
+            mean = acc / n
+            out[i, j] = mean + w[i, j] * (plane[i, j] - mean)
+
+
+def filter_matrix(
+        matrix: HermitianMatrix,
+        method: str = "refined_lee",
+        win: int = 7,
+        looks: float = 1,
+        damping: float = 1.0
+        ) -> HermitianMatrix:
+    """
+    Polarimetric speckle filter of a T / C matrix.
+
+    The filter weights are computed once per pixel from the span and applied
+    to all six stored planes (median filters every plane on its own).
+
+    Parameters
+    ----------
+    matrix: HermitianMatrix
+    method: str
+        one of METHODS
+    win: int
+        odd window size
+    looks: float
+        equivalent number of looks of the matrix
+    damping: float
+        damping factor of the enhanced Lee and Frost filters
+
+    Returns
+    -------
+    HermitianMatrix
+    """
+    _check(method, win, looks)
+    span = matrix.diag[0] + matrix.diag[1] + matrix.diag[2]
+    planes = [matrix.diag[k] for k in range(3)] + [matrix.upper[k] for k in range(3)]
+    # every plane is filtered straight into the packed output
+    diag = np.empty(matrix.diag.shape, dtype=matrix.diag.dtype)
+    upper = np.empty(matrix.upper.shape, dtype=matrix.upper.dtype)
+    outs = [diag[k] for k in range(3)] + [upper[k] for k in range(3)]
+
+    if method == "refined_lee":
+        masks = refined_lee_masks(win)
+        sub, step = _sub_window(win)
+        direction = np.empty(span.shape, dtype=np.int8)
+        w = np.empty(span.shape, dtype=np.float64)
+        _refined_lee_select_cpu(span, box_mean(span, sub), masks, step, 1 / looks, direction, w)
+        for plane, out in zip(planes, outs):
+            _refined_lee_apply_cpu(plane, masks, direction, w, out)
+    else:
+        w = ci2 = None
+        if method in _ADAPTIVE:
+            mean, mean2 = _local_stats(span, win)
+            w = np.empty(span.shape, dtype=np.float64)
+            _adaptive_weights_cpu(mean, mean2, _ADAPTIVE[method], 1 / looks, damping, w)
+        elif method == "frost":
+            ci2 = _ci2(*_local_stats(span, win))
+        for plane, out in zip(planes, outs):
+            _filter_plane(plane, method, win, damping, w=w, ci2=ci2, out=out)
+
+    return HermitianMatrix(diag, upper)
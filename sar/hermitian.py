@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+
+from typing import Any, Tuple
+from pathlib import Path
+
+from sar.store import write_array, read_array
+
+
+# (row, col) of the packed upper triangle planes
+UPPER = ((0, 1), (0, 2), (1, 2))
+UPPER_INDEX = {ele: k for k, ele in enumerate(UPPER)}
+
+
+class HermitianMatrix:
+    """
+    Packed storage of a per-pixel 3x3 Hermitian matrix (T or C).
+
+    Only the real diagonal (3, x, y) and the complex upper triangle
+    (3, x, y: 12, 13, 23) are stored, the lower triangle is the conjugate of
+    the upper one and is computed when it is accessed. Indexing with
+    [i, j, ...] returns the (i, j) element plane, so code written against the
+    full (3, 3, x, y) cube keeps working, and np.asarray gives the full cube.
+    """
+    diag    : npt.NDArray
+    upper   : npt.NDArray
+
+
+    def __init__(self, diag: npt.NDArray, upper: npt.NDArray) -> None:
+        if diag.shape[0] != 3 or upper.shape[0] != 3 or len(diag.shape) != 3 or diag.shape != upper.shape:
+            raise ValueError(f"diag and upper should both be of the form (3, x, y) [given shapes -> {diag.shape}, {upper.shape}]")
+        self.diag = diag
+        self.upper = upper
+
+
+    @classmethod
+    def empty(cls, x: int, y: int, dtype: npt.DTypeLike = np.complex64) -> HermitianMatrix:
+        dtype = np.dtype(dtype)
+        return cls(
+                np.empty([3, x, y], dtype=np.finfo(dtype).dtype),
+                np.empty([3, x, y], dtype=dtype)
+                )
+
+
+    @classmethod
+    def from_full(cls, full: npt.NDArray) -> HermitianMatrix:
+        if len(full.shape) != 4 or full.shape[:2] != (3, 3):
+            raise ValueError(f"the shape of the matrix should be of the form (3, 3, x, y) [given shape -> {full.shape}]")
+        diag = np.array([full[k, k, :, :].real for k in range(3)])
+        upper = np.array([full[i, j, :, :] for i, j in UPPER])
+        return cls(diag, upper)
+
+
+    @property
+    def shape(self) -> Tuple[int, int, int, int]:
+        _, x, y = self.diag.shape
+        return (3, 3, x, y)
+
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.upper.dtype
+
+
+    @property
+    def nbytes(self) -> int:
+        return self.diag.nbytes + self.upper.nbytes
+
+
+    def element(self, i: int, j: int) -> npt.NDArray:
+        """
+        (i, j) element plane (0 based), lower triangle elements are returned
+        as the conjugate of the stored upper triangle plane.
+        """
+        if not (0 <= i < 3 and 0 <= j < 3):
+            raise IndexError(f"element ({i}, {j}) is out of range for a 3x3 matrix")
+        if i == j:
+            return self.diag[i, :, :]
+        if i < j:
+            return self.upper[UPPER_INDEX[(i, j)], :, :]
+        return np.conj(self.upper[UPPER_INDEX[(j, i)], :, :])
+
+
+    def __getitem__(self, key: Any) -> npt.NDArray | HermitianMatrix:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) >= 2 and all(isinstance(k, (int, np.integer)) for k in key[:2]):
+            return self.element(int(key[0]), int(key[1]))[key[2:]]
+        if len(key) == 4 and key[0] == slice(None) and key[1] == slice(None):
+            return HermitianMatrix(self.diag[:, key[2], key[3]], self.upper[:, key[2], key[3]])
+        return self.full()[key]
+
+
+    def crop(self, r1: int, r2: int, c1: int, c2: int) -> HermitianMatrix:
+        return HermitianMatrix(self.diag[:, r1:r2, c1:c2], self.upper[:, r1:r2, c1:c2])
+
+
+    def full(self) -> npt.NDArray:
+        _, _, x, y = self.shape
+        full = np.empty([3, 3, x, y], dtype=self.dtype)
+        for i in range(3):
+            for j in range(3):
+                full[i, j, :, :] = self.element(i, j)
+        return full
+
+
+    def __array__(self, dtype: npt.DTypeLike | None = None, copy: bool | None = None) -> npt.NDArray:
+        full = self.full()
+        if dtype is not None:
+            full = full.astype(dtype, copy=False)
+        return full
+
+
+    def astype(self, dtype: npt.DTypeLike) -> HermitianMatrix:
+        """
+        Same matrix with a complex dtype (the diagonal takes the matching
+        float dtype), self if it already has it.
+        """
+        dtype = np.dtype(dtype)
+        real = np.finfo(dtype).dtype
+        if self.upper.dtype == dtype and self.diag.dtype == real:
+            return self
+        return HermitianMatrix(
+                np.asarray(self.diag).astype(real),
+                np.asarray(self.upper).astype(dtype)
+                )
+
+
+    def __repr__(self) -> str:
+        return f"HermitianMatrix(shape={self.shape}, dtype={self.dtype})"
+
+
+    def save(self, path: Path, name: str, format: str = "npy", **options: Any) -> None:
+        # options: see sar.store.save_chunked
+        write_array(path, f"{name}_diag", self.diag, format=format, **options)
+        write_array(path, f"{name}_upper", self.upper, format=format, **options)
+
+
+    @classmethod
+    def load(cls, path: Path, name: str, mmap_mode: str | None = None) -> HermitianMatrix:
+        return cls(
+                read_array(path, f"{name}_diag", mmap_mode),
+                read_array(path, f"{name}_upper", mmap_mode)
+                )
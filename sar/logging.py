@@ -1,15 +1,308 @@
-from rich.console import Console
-from rich.theme import Theme
-from rich.traceback import install
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple
+from pathlib import Path
 
-install()
 
 # Themes
-LogTheme = Theme({
+THEME = {
     'info': 'blue',
     'warn': 'magenta',
     'danger': 'bold red',
     'success': 'green',
-})
+}
+
+_rich: Dict[str, Any] = dict()
+
+
+def __getattr__(name: str) -> Any:
+    # the rich console (and its traceback hook) are set up on first use, so
+    # importing this module for the instrumentation does not import rich
+    if name in ("console", "LogTheme"):
+        if not _rich:
+            from rich.console import Console
+            from rich.theme import Theme
+            from rich.traceback import install
+
+            install()
+            _rich['LogTheme'] = Theme(THEME)
+            _rich['console'] = Console(theme=_rich['LogTheme'])
+        return _rich[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Instrumentation of the hot paths: spans time a block of code and carry
+# counters (pixels processed, bytes read / written / allocated), count()
+# adds to global counters and the numba compilations are recorded as 'jit:'
+# spans. Everything is off by default: span() then returns a shared no-op
+# object and count() returns at once, the cost is one function call.
+#
+#     with sar.logging.instrument():
+#         sar_img.computeT()
+#     sar.logging.print_summary()
+#     sar.logging.export_chrome_trace(Path("trace.json"))   # chrome://tracing, perfetto
+
+COUNTERS = ("pixels", "bytes_read", "bytes_written", "bytes_allocated")
+
+
+class Event(NamedTuple):
+    name        : str
+    # since enable(), in nanoseconds
+    start_ns    : int
+    duration_ns : int
+    thread      : int
+    # nesting level of the span in its thread
+    depth       : int
+    counters    : Dict[str, float]
+
+
+_enabled = False
+_origin_ns = 0
+_events: List[Event] = list()
+_counters: Dict[str, float] = defaultdict(float)
+_lock = threading.Lock()
+_local = threading.local()
+_jit_listener: Any = None
+
+
+class Span:
+    __slots__ = ("name", "counters", "start_ns", "depth")
+
+    def __init__(self, name: str, counters: Dict[str, float]) -> None:
+        self.name = name
+        self.counters = counters
+
+    def add(self, counter: str, value: float) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def __enter__(self) -> Span:
+        self.depth = getattr(_local, "depth", 0)
+        _local.depth = self.depth + 1
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        end = time.perf_counter_ns()
+        _local.depth = self.depth
+        _record(self.name, self.start_ns, end, self.depth, self.counters)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def add(self, counter: str, value: float) -> None:
+        pass
+
+    def __enter__(self) -> _NoSpan:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def _record(name: str, start: int, end: int, depth: int, counters: Dict[str, float]) -> None:
+    with _lock:
+        _events.append(Event(name, start - _origin_ns, end - start, threading.get_ident(), depth, counters))
+
+
+def span(name: str, **counters: float) -> Span | _NoSpan:
+    """
+    Context manager timing a block as name, counters (and the ones added
+    with .add inside the block) are attached to it.
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return Span(name, counters)
+
+
+def count(counter: str, value: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[counter] += value
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _jit_listener_class() -> type:
+    from numba.core import event
+
+    class JitListener(event.Listener):
+        # outermost compilation of each thread as a 'jit:<function>' span
+        def on_start(self, ev: event.Event) -> None:
+            stack = getattr(_local, "jit", None)
+            if stack is None:
+                stack = _local.jit = list()
+            stack.append(time.perf_counter_ns())
+
+        def on_end(self, ev: event.Event) -> None:
+            start = _local.jit.pop()
+            if not _local.jit:
+                dispatcher = ev.data.get('dispatcher') if isinstance(ev.data, dict) else None
+                name = getattr(getattr(dispatcher, 'py_func', None), '__qualname__', str(dispatcher))
+                _record(f"jit:{name}", start, time.perf_counter_ns(), getattr(_local, "depth", 0), {})
+
+    return JitListener
+
+
+def enable(reset: bool = True) -> None:
+    """
+    Starts recording (dropping what was recorded before with reset).
+    """
+    global _enabled, _origin_ns, _jit_listener
+    if reset:
+        clear()
+    if not _enabled:
+        from numba.core import event
+        _jit_listener = _jit_listener_class()()
+        event.register("numba:compile", _jit_listener)
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled, _jit_listener
+    if _enabled:
+        from numba.core import event
+        event.unregister("numba:compile", _jit_listener)
+        _jit_listener = None
+    _enabled = False
+
+
+def clear() -> None:
+    global _origin_ns
+    with _lock:
+        _events.clear()
+        _counters.clear()
+        _origin_ns = time.perf_counter_ns()
+
+
+class instrument:
+    """
+    Records within a with block (from scratch), the events stay available
+    after it.
+    """
+    def __enter__(self) -> instrument:
+        enable(reset=True)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        disable()
+
+
+def events() -> List[Event]:
+    with _lock:
+        return list(_events)
+
+
+def counters() -> Dict[str, float]:
+    with _lock:
+        return dict(_counters)
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """
+    name -> calls, total_s, mean_s, max_s and the sums of the counters of
+    the spans, in order of first occurrence.
+    """
+    table: Dict[str, Dict[str, float]] = dict()
+    for event in events():
+        row = table.setdefault(event.name, {'calls': 0, 'total_s': 0.0, 'max_s': 0.0})
+        seconds = event.duration_ns / 1e9
+        row['calls'] += 1
+        row['total_s'] += seconds
+        row['max_s'] = max(row['max_s'], seconds)
+        for counter, value in event.counters.items():
+            row[counter] = row.get(counter, 0) + value
+    for row in table.values():
+        row['mean_s'] = row['total_s'] / row['calls']
+    return table
+
+
+def _format_counter(counter: str, value: float) -> str:
+    if counter.startswith("bytes"):
+        return f"{value / 2 ** 20:.1f} MB"
+    if counter == "pixels":
+        return f"{value / 1e6:.2f} Mpix"
+    return f"{value:g}"
+
+
+def print_summary(console: Any = None) -> None:
+    """
+    Renders summary() (and the global counters) as a rich table.
+    """
+    from rich.table import Table
+
+    if console is None:
+        console = __getattr__("console")
+    table = Table(title="sar instrumentation")
+    table.add_column("span")
+    table.add_column("calls", justify="right")
+    table.add_column("total s", justify="right")
+    table.add_column("mean ms", justify="right")
+    table.add_column("max ms", justify="right")
+    for counter in COUNTERS:
+        table.add_column(counter.replace("_", " "), justify="right")
+    table.add_column("other")
+    for name, row in summary().items():
+        other = {key: value for key, value in row.items()
+                 if key not in COUNTERS and key not in ('calls', 'total_s', 'mean_s', 'max_s')}
+        table.add_row(
+                name,
+                str(int(row['calls'])),
+                f"{row['total_s']:.3f}",
+                f"{row['mean_s'] * 1e3:.2f}",
+                f"{row['max_s'] * 1e3:.2f}",
+                *(_format_counter(counter, row[counter]) if counter in row else "" for counter in COUNTERS),
+                " ".join(f"{key}={_format_counter(key, value)}" for key, value in other.items()),
+                style="dim" if name.startswith("jit:") else None
+                )
+    console.print(table)
+    totals = counters()
+    if totals:
+        console.print(" ".join(f"{key}={_format_counter(key, value)}" for key, value in totals.items()))
+
+
+def export_json(path: Path) -> None:
+    path.write_text(json.dumps({
+            'summary': summary(),
+            'counters': counters(),
+            'events': [event._asdict() for event in events()]
+            }, indent=4))
+
 
-console = Console(theme=LogTheme)
\ No newline at end of file
+def export_chrome_trace(path: Path) -> None:
+    """
+    Trace Event Format (chrome://tracing, ui.perfetto.dev): one complete
+    event per span, the global counters as counter events at the end.
+    """
+    pid = os.getpid()
+    trace = [
+            {
+                'name': event.name,
+                'cat': "jit" if event.name.startswith("jit:") else "sar",
+                'ph': "X",
+                'ts': event.start_ns / 1e3,
+                'dur': event.duration_ns / 1e3,
+                'pid': pid,
+                'tid': event.thread,
+                'args': event.counters
+            }
+            for event in events()
+            ]
+    end = max((event['ts'] + event['dur'] for event in trace), default=0)
+    trace += [
+            {'name': counter, 'ph': "C", 'ts': end, 'pid': pid, 'tid': 0, 'args': {counter: value}}
+            for counter, value in counters().items()
+            ]
+    path.write_text(json.dumps({'traceEvents': trace, 'displayTimeUnit': "ms"}))
@@ -1,13 +1,120 @@
+from __future__ import annotations
+
+from . import dtypes, logging as log
 from .sar import SAR
 
 import json
-import rasterio as rs
+import hashlib
 import numpy as np
 import numpy.typing as npt
 
-from typing import Dict, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Mapping, Tuple, TYPE_CHECKING
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from .stack import TimeStack
+
+# rasterio (GDAL) and sar.stack (scipy) are imported when a GeoTIFF is read /
+# a stack is built, listing the archive does not need them
+
+
+
+def date_from_path(path: Path) -> str:
+    return path.name.split("_")[3].split("t")[0]
+
+
+def sli_paths(calibrated_path: Path) -> List[Path]:
+    coeffs_path = sorted(calibrated_path.glob('*sli*.tif'))
+    if len(coeffs_path) != 4:
+        raise FileNotFoundError(f"expected 4 *sli*.tif files (hh, hv, vh, vv) in {calibrated_path}, found {len(coeffs_path)}")
+    return coeffs_path
+
+
+def read_sli(
+        paths: List[Path],
+        window: Tuple[int, int, int, int] | None = None,
+        dtype: npt.DTypeLike | None = None,
+        max_workers: int = 4,
+        out: npt.NDArray | None = None
+        ) -> npt.NDArray:
+    """
+    Reads the hh, hv, vh, vv SLI GeoTIFFs (band 1 real, band 2 imaginary)
+    into a (2, 2, x, y) complex array.
+
+    The four files are read concurrently (rasterio releases the GIL) and
+    each band is decoded straight into the real / imaginary part of the
+    output, so no intermediate full size arrays are created.
+
+    Parameters
+    ----------
+    paths: List[Path]
+        hh, hv, vh, vv files in this order
+    window: Tuple[int, int, int, int] | None
+        (r1, r2, c1, c2) region to read, same convention as SAR.crop_new
+    dtype: npt.DTypeLike | None
+        complex dtype of the output (the sar.dtypes policy if None)
+    max_workers: int
+        number of files read at the same time
+    out: npt.NDArray | None
+        preallocated (2, 2, x, y) output
+    """
+    import rasterio as rs
+    from rasterio.windows import Window
+
+    if len(paths) != 4:
+        raise ValueError(f"expected 4 paths (hh, hv, vh, vv), got {len(paths)}")
+    with rs.open(paths[0].__str__()) as src:
+        height, width = src.height, src.width
+    r1, r2, c1, c2 = window if window is not None else (0, height, 0, width)
+    r1, r2 = max(0, r1), min(height, r2)
+    c1, c2 = max(0, c1), min(width, c2)
+    rs_window = Window(c1, r1, c2 - c1, r2 - r1)
+    shape = (2, 2, r2 - r1, c2 - c1)
+    if out is None:
+        out = np.empty(shape, dtype=dtypes.complex_dtype(dtype))
+    elif out.shape != shape or not np.iscomplexobj(out):
+        raise ValueError(f"out should be a complex array of shape {shape} [given -> {out.dtype} {out.shape}]")
+
+    def read(k: int) -> None:
+        plane = out[k // 2, k % 2, :, :]
+        with rs.open(paths[k].__str__()) as src:
+            src.read(1, window=rs_window, out=plane.real)
+            src.read(2, window=rs_window, out=plane.imag)
+
+    with log.span("read_sli", pixels=shape[2] * shape[3], bytes_read=out.nbytes):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # list() to re-raise errors from the workers
+            list(executor.map(read, range(4)))
+    return out
+
+
+class GeoTiffSource:
+    """
+    Reads azimuth blocks of a scene straight from the calibrated SLI
+    GeoTIFFs with windowed reads (a TileSource, see sar.tiling), without
+    loading the whole scene.
+    """
+    paths       : List[Path]
+    calibrated  : bool
+
+    def __init__(self, calibrated_path: Path, calibrated: bool = False) -> None:
+        import rasterio as rs
+
+        self.paths = sli_paths(calibrated_path)
+        self.calibrated = calibrated
+        with rs.open(self.paths[0].__str__()) as src:
+            self._shape = (src.height, src.width)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self._shape
+
+    def read(self, r1: int, r2: int) -> SAR:
+        coeffs = read_sli(self.paths, window=(r1, r2, 0, self._shape[1]))
+        # the offset places the block in the scene (see tiling.calibrate)
+        return SAR(coeffs, calibrated=self.calibrated, offset=(r1, 0))
 
 
 class SARChandrayaan2(SAR):
@@ -26,17 +133,49 @@ class SARChandrayaan2(SAR):
     device      : str = "cpu"
 
 
-    def __init__(self, path: Path, local_path: Path, force_load: bool = False, **kwarg) -> None:
+    def __init__(
+            self,
+            path: Path,
+            local_path: Path,
+            force_load: bool = False,
+            mmap_mode: str | None = None,
+            window: Tuple[int, int, int, int] | None = None,
+            **kwarg
+            ) -> None:
+        """
+        Parameters
+        ----------
+        path: Path
+            directory of the acquisition
+        local_path: Path
+            directory of the local (numpy) copy, used instead of the GeoTIFFs
+            if it exists (unless force_load)
+        force_load: bool
+            always read the GeoTIFFs
+        mmap_mode: str | None
+            memory map the local copy (see SAR.load)
+        window: Tuple[int, int, int, int] | None
+            (r1, r2, c1, c2) region of the scene to keep, only this region is
+            read from the GeoTIFFs
+        """
         self.path = path
         self.local_path = local_path
 
-        self.date = self.path.name.split("_")[3].split("t")[0]
+        self.date = date_from_path(self.path)
         self.calibrated_path = self.path / "data" / "calibrated" / self.date
         
         if self.__check_local__() and not force_load:
-            self.load(self.local_path)
+            self.load(self.local_path, mmap_mode=mmap_mode)
+            if window is not None:
+                cropped = self.crop_new(window)
+                self._coeffs, self._T, self._C = cropped._coeffs, cropped._T, cropped._C
+                self.offset, self.lineage = cropped.offset, cropped.lineage
         else:
-            super().__init__(self.__load_coeffs__(), **kwarg)
+            offset = (max(0, window[0]), max(0, window[2])) if window is not None else (0, 0)
+            super().__init__(self.__load_coeffs__(window=window), offset=offset, **kwarg)
+            self.source = self.__source__()
+            if window is not None:
+                self.lineage = (("crop", {'window': list(window)}),)
 
 
     def __check_local__(self) -> bool:
@@ -51,52 +190,163 @@ class SARChandrayaan2(SAR):
             return False
 
     
-    def __load_coeffs__(self) -> npt.NDArray:
-        coeffs_path = sorted(self.calibrated_path.glob('*sli*.tif'))
-        coeffs = list()
-        for path in coeffs_path:
-            with rs.open(path.__str__()) as src:
-                coeffs.append(src.read())
-        hh, hv, vh, vv = [coeff[0] + 1j * coeff[1] for coeff in coeffs]
-        return np.array([
-            [hh, hv],
-            [vh, vv]
-            ])
+    def __source__(self) -> str:
+        # the GeoTIFFs and a stamp of their sizes / modification times
+        stamp = hashlib.sha256()
+        for path in sli_paths(self.calibrated_path):
+            stat = path.stat()
+            stamp.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return f"geotiff:{self.calibrated_path}@{stamp.hexdigest()[:16]}"
+
+
+    def __load_coeffs__(self, window: Tuple[int, int, int, int] | None = None) -> npt.NDArray:
+        with log.span("__load_coeffs__"):
+            return read_sli(sli_paths(self.calibrated_path), window=window)
 
 
     def save(self) -> None:
         super().save(self.local_path)
 
 
+class LazyDateMap(Mapping[str, SAR]):
+    """
+    Read-only mapping of acquisition date -> scene, where only the date
+    directories are scanned up front. A scene is constructed (and its coeffs
+    read) the first time its date is accessed and kept until it is unloaded.
+
+    Parameters
+    ----------
+    paths: Dict[str, Path]
+        date -> directory of the acquisition
+    local_path: Path
+        base directory for the local (numpy) copies, one sub directory per date
+    factory: Callable
+        called as factory(path, local_path / date, **kwarg) to build a scene
+    max_loaded: int | None
+        if given, the least recently used scenes are evicted so that at most
+        max_loaded scenes are held in memory at once
+    """
+    _paths      : Dict[str, Path]
+    _loaded     : OrderedDict[str, SAR]
+    local_path  : Path
+    factory     : Callable[..., SAR]
+    max_loaded  : int | None
+
+
+    def __init__(
+            self,
+            paths: Dict[str, Path],
+            local_path: Path,
+            factory: Callable[..., SAR],
+            max_loaded: int | None = None,
+            **kwarg
+            ) -> None:
+        if max_loaded is not None and max_loaded < 1:
+            raise ValueError(f"max_loaded should be at least 1 [given -> {max_loaded}]")
+        self._paths = dict(sorted(paths.items()))
+        self._loaded = OrderedDict()
+        self.local_path = local_path
+        self.factory = factory
+        self.max_loaded = max_loaded
+        self._kwarg = kwarg
+
+
+    def __getitem__(self, date: str) -> SAR:
+        if date in self._loaded:
+            self._loaded.move_to_end(date)
+            return self._loaded[date]
+        if date not in self._paths:
+            raise KeyError(f"no acquisition for date: {date}")
+        if self.max_loaded is not None:
+            while len(self._loaded) >= self.max_loaded:
+                self._loaded.popitem(last=False)
+        sar_img = self.factory(self._paths[date], self.local_path / date, **self._kwarg)
+        self._loaded[date] = sar_img
+        return sar_img
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+    def __repr__(self) -> str:
+        return f"LazyDateMap(dates={list(self._paths)}, loaded={list(self._loaded)})"
+
+
+    @property
+    def paths(self) -> Dict[str, Path]:
+        return dict(self._paths)
+
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
+
+    def is_loaded(self, date: str) -> bool:
+        return date in self._loaded
+
+
+    def unload(self, date: str) -> None:
+        """
+        Drops the scene for date, it will be loaded again on the next access.
+        """
+        if date not in self._paths:
+            raise KeyError(f"no acquisition for date: {date}")
+        self._loaded.pop(date, None)
+
+
+    def clear(self) -> None:
+        """
+        Drops every loaded scene.
+        """
+        self._loaded.clear()
+
+
 class Chandrayaan2:
     path            : Path
     local_path      : Path
-    date_map        : Dict[str, SARChandrayaan2]
+    date_map        : LazyDateMap
 
-    def __init__(self, path: Path, local_path: Path) -> None:
+    def __init__(self, path: Path, local_path: Path, max_loaded: int | None = None, **kwarg) -> None:
         self.path = path
         self.local_path = local_path
-        self.dateSARMap()
+        self.dateSARMap(max_loaded=max_loaded, **kwarg)
 
-    def dateSARMap(self) -> None:
+    def dateSARMap(self, max_loaded: int | None = None, **kwarg) -> None:
         sar_data_paths = [child for child in self.path.iterdir() if child.is_dir()]
-        sar_data_dates = [path.name.split("_")[3].split("t")[0] for path in sar_data_paths]
-        sar_list = [
-                SARChandrayaan2(Path(path), self.local_path / date)
-                for path, date in zip(sar_data_paths, sar_data_dates)
-                ]
-        self.date_map = {
-                SAR.date : SAR
-                for SAR in sar_list
-                }
+        self.date_map = LazyDateMap(
+                {date_from_path(path): path for path in sar_data_paths},
+                self.local_path,
+                factory=SARChandrayaan2,
+                max_loaded=max_loaded,
+                **kwarg
+                )
 
-    def get_dirs(self) -> Dict[str, Path | List[Path]]:
+    def tile_source(self, date: str) -> GeoTiffSource:
+        """
+        Block reader for the GeoTIFFs of date, nothing is loaded up front
+        (see sar.tiling.TiledProcessor).
+        """
+        if date not in self.date_map:
+            raise KeyError(f"no acquisition for date: {date}")
+        return GeoTiffSource(self.date_map.paths[date] / "data" / "calibrated" / date)
+
+    def stack(self, dates: List[str] | None = None, matrix: str = "T", tile_rows: int = 1024) -> TimeStack:
+        """
+        Time stack of the acquisitions (all the dates if None), see
+        sar.stack.TimeStack for the change detectors.
+        """
+        from .stack import TimeStack
+        return TimeStack(self.date_map, dates=dates, matrix=matrix, tile_rows=tile_rows)
+
+    def get_dirs(self) -> Dict[str, Path | Dict[str, Path]]:
         date_map = {
                 'BASE': self.path,
-                'DATE_MAP': {
-                    date: sarimg_data.path
-                    for date, sarimg_data in self.date_map.items()
-                    }
+                'DATE_MAP': self.date_map.paths
                 }
         return date_map
-
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from typing import Dict, List, Sequence
+
+from sar import computations
+from sar.sar import SAR
+
+
+def warmup(dtypes: Sequence[str] = ("complex64",), full: bool = True) -> Dict[str, float]:
+    """
+    Compiles the numba kernels before any real work, e.g. at the start of a
+    batch worker. The typed kernels of sar.computations are compiled for
+    dtypes, with full the speckle filters, edge detectors and decompositions
+    are compiled too by running them on a tiny scene. All of them are cached
+    on disk, so only the first run on a machine compiles anything.
+
+    Returns
+    -------
+    Dict[str, float]
+        seconds spent per kernel / step
+    """
+    timings = computations.precompile(dtypes)
+    if not full:
+        return timings
+    from sar import filters
+    from sar.decomposition import DECOMPOSITIONS
+
+    for dtype in dtypes:
+        rng = np.random.default_rng(0)
+        coeffs = (rng.standard_normal((2, 2, 16, 16)) + 1j * rng.standard_normal((2, 2, 16, 16))).astype(dtype)
+        sar_img = SAR(coeffs, dtype=dtype)
+        sar_img.computeT()
+        steps = {f"speckle_filter[{method}]": (lambda method=method: sar_img.speckle_filter(method)) for method in filters.METHODS}
+        steps.update({f"detect_edges[{method}]": (lambda method=method: sar_img.detect_edges(method)) for method in ("ratio", "wishart")})
+        steps.update({f"decompose[{method}]": (lambda method=method: sar_img.decompose(method)) for method in DECOMPOSITIONS})
+        steps["stats"] = lambda: (sar_img.stats("T11"), sar_img.stats("HH", log=True))
+        for name, step in steps.items():
+            start = time.perf_counter()
+            step()
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    return timings
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compile (and cache) the numba kernels of the sar package")
+    parser.add_argument("--dtypes", nargs="+", default=["complex64"], choices=tuple(computations.DTYPES))
+    parser.add_argument("--typed-only", action="store_true", help="only the typed kernels of sar.computations")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    for name, seconds in warmup(args.dtypes, full=not args.typed_only).items():
+        print(f"{name:40s} {seconds:8.2f} s")
+    print(f"{'total':40s} {time.perf_counter() - start:8.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
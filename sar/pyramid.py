@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import numpy as np
+import numpy.typing as npt
+
+from typing import Any, Dict, List, Tuple
+from pathlib import Path
+
+from sar import logging as log
+from sar.sar import SAR, _multilook_planes
+from sar.store import load_array
+from sar.tiling import iter_tiles
+
+
+# Quicklook pyramid of a scene: overview levels, each 2x coarser than the
+# previous one, of
+#
+#     span        total power (trace of T) in dB          float16 (1, x, y)
+#     t_diag      T11, T22, T33 in dB                     float16 (3, x, y)
+#     pauli       Pauli RGB (T22, T33, T11) stretched     uint8   (x, y, 3)
+#
+# built in one pass over the scene: every azimuth block is reduced to the
+# powers of the first level (averaged in linear power) and then 2x2 averaged
+# down to the coarsest level. The dB levels are float16 .npy files (memory
+# mapped when read, so any region of any level is read without loading the
+# level), the percentile stretch of every product is computed on a coarse
+# level and kept in meta.json, the Pauli RGB levels are quantised with it.
+
+PRODUCTS = ("span", "t_diag", "pauli")
+META = "meta.json"
+# the stretch is computed on the finest level with at most that many pixels
+STRETCH_PIXELS = 4 * 2 ** 20
+# T22, T33, T11 as R, G, B (see sar.decomposition.pauli)
+PAULI = (1, 2, 0)
+
+
+def _db(power: npt.NDArray) -> npt.NDArray[np.float16]:
+    return (10 * np.log10(np.maximum(power, np.finfo(np.float32).tiny))).astype(np.float16)
+
+
+def _stretch(planes: npt.NDArray, low: npt.NDArray, high: npt.NDArray) -> npt.NDArray[np.uint8]:
+    # (n, x, y) dB planes -> (x, y, n) uint8, NaN -> 0
+    scale = np.where(high > low, high - low, 1)[:, None, None]
+    image = np.clip((planes.astype(np.float32) - low[:, None, None]) / scale, 0, 1) * 255
+    return np.moveaxis(np.nan_to_num(image, nan=0).astype(np.uint8), 0, -1)
+
+
+def _n_levels(shape: Tuple[int, int], min_size: int) -> int:
+    levels = 1
+    x, y = shape
+    while max(x, y) > min_size and min(x, y) >= 2:
+        x, y = x // 2, y // 2
+        levels += 1
+    return levels
+
+
+def build(
+        sar_img: SAR,
+        path: Path,
+        levels: int | None = None,
+        looks: Tuple[int, int] = (1, 1),
+        tile_rows: int = 1024,
+        percentile: float = 99.0,
+        min_size: int = 512
+        ) -> Pyramid:
+    """
+    Builds the pyramid of sar_img into path (see SAR.pyramid).
+    """
+    if not 50 < percentile <= 100:
+        raise ValueError(f"percentile should be in (50, 100] [given -> {percentile}]")
+    az, rg = int(looks[0]), int(looks[1])
+    if az < 1 or rg < 1:
+        raise ValueError(f"looks should be positive [given -> {looks}]")
+    _, _, x, y = sar_img._coeffs.shape
+    if levels is None:
+        levels = _n_levels((x // az, y // rg), min_size)
+    if levels < 1 or x // (az * 2 ** (levels - 1)) < 1 or y // (rg * 2 ** (levels - 1)) < 1:
+        raise ValueError(f"levels should be between 1 and what the scene of shape {(x, y)} allows [given -> {levels}]")
+    # rows that do not fill a cell of the coarsest level are dropped
+    cell = az * 2 ** (levels - 1)
+    shapes = [((x // cell) * 2 ** (levels - 1 - k), y // (rg * 2 ** k)) for k in range(levels)]
+
+    path.mkdir(parents=True, exist_ok=True)
+    arrays: List[Dict[str, npt.NDArray]] = [
+            {
+                name: np.lib.format.open_memmap(
+                        path / f"{level}_{name}.npy", mode='w+', dtype=np.float16, shape=(planes, *shape))
+                for name, planes in (("span", 1), ("t_diag", 3))
+            }
+            for level, shape in enumerate(shapes)
+            ]
+
+    # blocks are a multiple of the coarsest cell so every block fills whole
+    # rows of every level
+    tile_rows = max(cell, (tile_rows // cell) * cell)
+    with log.span("pyramid", pixels=x * y):
+        for tile in iter_tiles((x // cell) * cell, tile_rows):
+            block = sar_img.crop_new((tile.start, tile.stop, 0, y))
+            # averaged in linear power, converted to dB level by level
+            power = np.stack([block.element("T", k, k) for k in range(3)]).astype(np.float32)
+            power = _multilook_planes(power, az, rg, "mean")
+            for level in range(levels):
+                if level > 0:
+                    power = _multilook_planes(power, 2, 2, "mean")
+                r1 = tile.start // (az * 2 ** level)
+                r2 = r1 + power.shape[1]
+                arrays[level]["t_diag"][:, r1:r2] = _db(power)
+                arrays[level]["span"][0, r1:r2] = _db(power.sum(axis=0))
+
+        reference = next(
+                (level for level, shape in enumerate(shapes) if shape[0] * shape[1] <= STRETCH_PIXELS),
+                levels - 1
+                )
+        stretch = {
+                name: np.nanpercentile(
+                        np.asarray(arrays[reference][name], dtype=np.float32), [100 - percentile, percentile], axis=(1, 2)
+                        ).T.tolist()
+                for name in ("span", "t_diag")
+                }
+        stretch["pauli"] = [stretch["t_diag"][k] for k in PAULI]
+        low, high = np.array(stretch["pauli"], dtype=np.float32).T
+        for level, shape in enumerate(shapes):
+            pauli = np.lib.format.open_memmap(
+                    path / f"{level}_pauli.npy", mode='w+', dtype=np.uint8, shape=(*shape, 3))
+            for start, stop, _, _ in iter_tiles(shape[0], tile_rows):
+                pauli[start:stop] = _stretch(arrays[level]["t_diag"][list(PAULI), start:stop], low, high)
+            pauli.flush()
+            for array in arrays[level].values():
+                array.flush()
+
+    meta = {
+            'levels': levels,
+            'looks': [az, rg],
+            'shape': [x, y],
+            'shapes': [list(shape) for shape in shapes],
+            'offset': list(sar_img.offset),
+            'source': sar_img.source,
+            'lineage': [list(step) for step in sar_img.lineage],
+            'percentile': percentile,
+            'stretch': stretch
+            }
+    (path / META).write_text(json.dumps(meta, indent=4))
+    return Pyramid(path)
+
+
+class Pyramid:
+    """
+    Quicklook pyramid written by SAR.pyramid. Levels are memory mapped, so
+    reading a region of any level only reads that region.
+
+    Parameters
+    ----------
+    path: Path
+        directory of the pyramid (meta.json and the <level>_<product>.npy
+        files)
+    """
+    path    : Path
+    meta    : Dict[str, Any]
+
+
+    def __init__(self, path: Path) -> None:
+        meta_path = path / META
+        if not meta_path.is_file():
+            raise FileNotFoundError(f"Pyramid meta file not found at location: {meta_path}")
+        self.path = path
+        self.meta = json.loads(meta_path.read_text())
+        self._arrays: Dict[Tuple[int, str], npt.NDArray] = dict()
+
+
+    def __repr__(self) -> str:
+        return f"Pyramid({self.path}, levels={self.levels}, shape={tuple(self.meta['shape'])})"
+
+
+    @property
+    def levels(self) -> int:
+        return self.meta['levels']
+
+
+    def shape(self, level: int = 0) -> Tuple[int, int]:
+        self._check_level(level)
+        return tuple(self.meta['shapes'][level])
+
+
+    def scale(self, level: int = 0) -> Tuple[int, int]:
+        """
+        (azimuth, range) scene pixels per pixel of level.
+        """
+        self._check_level(level)
+        az, rg = self.meta['looks']
+        return (az * 2 ** level, rg * 2 ** level)
+
+
+    def _check_level(self, level: int) -> None:
+        if not 0 <= level < self.levels:
+            raise ValueError(f"level should be between 0 and {self.levels - 1} [given -> {level}]")
+
+
+    def _array(self, product: str, level: int) -> npt.NDArray:
+        if product not in PRODUCTS:
+            raise ValueError(f"un-supported product: {product}. Available products: {PRODUCTS}")
+        self._check_level(level)
+        key = (level, product)
+        if key not in self._arrays:
+            self._arrays[key] = load_array(self.path / f"{level}_{product}.npy", mmap_mode='r')
+        return self._arrays[key]
+
+
+    def level_for(self, window: Tuple[int, int, int, int] | None = None, max_pixels: int = 2 ** 20) -> int:
+        """
+        Finest level at which window (r1, r2, c1, c2 in scene pixels, the
+        whole scene if None) holds at most max_pixels.
+        """
+        r1, r2, c1, c2 = window if window is not None else (0, self.meta['shape'][0], 0, self.meta['shape'][1])
+        for level in range(self.levels):
+            az, rg = self.scale(level)
+            if ((r2 - r1) // az) * ((c2 - c1) // rg) <= max_pixels:
+                return level
+        return self.levels - 1
+
+
+    def read(self, product: str, level: int = 0, window: Tuple[int, int, int, int] | None = None) -> npt.NDArray:
+        """
+        Region of a level: (1, x, y) / (3, x, y) float16 dB planes for 'span'
+        and 't_diag', a (x, y, 3) uint8 image for 'pauli'.
+
+        Parameters
+        ----------
+        product: str
+        level: int
+        window: Tuple[int, int, int, int] | None
+            (r1, r2, c1, c2) in scene pixels (same convention as
+            SAR.crop_new), the whole level if None
+        """
+        array = self._array(product, level)
+        if window is None:
+            return array
+        az, rg = self.scale(level)
+        r1, r2, c1, c2 = window
+        rows = slice(r1 // az, -(-r2 // az))
+        cols = slice(c1 // rg, -(-c2 // rg))
+        if product == "pauli":
+            return array[rows, cols]
+        return array[:, rows, cols]
+
+
+    def image(self, product: str, level: int = 0, window: Tuple[int, int, int, int] | None = None) -> npt.NDArray[np.uint8]:
+        """
+        uint8 image of a region (see read) with the percentile stretch of the
+        pyramid: (x, y) for 'span', (x, y, 3) for 't_diag' and 'pauli'.
+        """
+        planes = self.read(product, level, window)
+        if product == "pauli":
+            return np.asarray(planes)
+        low, high = np.array(self.meta['stretch'][product], dtype=np.float32).T
+        image = _stretch(np.asarray(planes), low, high)
+        return image[..., 0] if product == "span" else image
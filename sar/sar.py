@@ -1,26 +1,93 @@
 from __future__ import annotations
 
 import json
+import weakref
+import threading
 import numpy as np
 import numpy.typing as npt
 
-from typing import List, Dict
+from typing import Any, Callable, ClassVar, List, Dict, Sequence, Tuple, TYPE_CHECKING
 from pathlib import Path
 
-from sar import computations
+from sar import dtypes, logging as log
+from sar.hermitian import HermitianMatrix
+from sar.store import MMAP_MODES, FORMATS, load_array, read_array, write_array
+
+if TYPE_CHECKING:
+    from sar.cache import ProductCache, Step
+    from sar.edge import Edges
+    from sar.pyramid import Pyramid
+    from sar.stats import ProductStats
+    from sar.tiling import Operation
 
 
 # TODO: Ploting
 # TODO: Add logging (only print statements for now or using rich)
 # TODO: compute functions
-# TODO: add lazy python for T and C matrices
+
+MULTILOOK_METHODS = ("mean", "median", "mode", "nearest")
+# kernels of sar.computations, imported (and numba with it) on first use
+MULTILOOK_KERNELS = {
+        "mean": "multilook_mean_cpu",
+        "median": "multilook_median_cpu",
+        "mode": "multilook_mode_cpu"
+        }
+
+
+def _multilook_planes(data: npt.NDArray, az: int, rg: int, method: str) -> npt.NDArray:
+    # block reduction of (n, x, y) planes, see SAR.multilook
+    n, x, y = data.shape
+    if az == 1 and rg == 1:
+        return data
+    data = np.asarray(data)
+    if method == "nearest":
+        return np.ascontiguousarray(data[:, az // 2:(x // az) * az:az, rg // 2:(y // rg) * rg:rg])
+    out = np.empty([n, x // az, y // rg], dtype=data.dtype)
+    from sar import computations
+    kernel = getattr(computations, MULTILOOK_KERNELS[method])
+    if np.iscomplexobj(data):
+        kernel(data.real, az, rg, out.real)
+        kernel(data.imag, az, rg, out.imag)
+    else:
+        kernel(data, az, rg, out)
+    return out
+
+
+def _as_hermitian(matrix: npt.NDArray | HermitianMatrix | None, dtype: npt.DTypeLike) -> HermitianMatrix | None:
+    if matrix is None:
+        return matrix
+    if not isinstance(matrix, HermitianMatrix):
+        matrix = HermitianMatrix.from_full(matrix)
+    return matrix.astype(dtype)
+
 
 class SAR:
     _coeffs     : npt.NDArray
-    _T          : npt.NDArray | None
-    _C          : npt.NDArray | None
+    _T          : HermitianMatrix | None
+    _C          : HermitianMatrix | None
     calibrated  : bool = False
     device      : str = "cpu"
+    mmap_mode   : str | None = None
+    # (row, col) of the first pixel in the grid of the full scene, kept by
+    # crops (and divided by the looks of a multilook) to co-register scenes
+    offset      : Tuple[int, int] = (0, 0)
+    # what the scene was derived from, see sar.cache: the source scene and
+    # the chain of (operation, parameters) applied to it
+    source      : str | None = None
+    lineage     : Tuple[Step, ...] = ()
+    cache       : ProductCache | None = None
+    # crops and copies are views sharing the arrays of their parent, _window
+    # is the (r1, r2, c1, c2) region of the parent they cover (None once the
+    # parent was modified). Scenes with a parent or live views copy their
+    # coefficients before modifying them (copy-on-write).
+    _parent     : SAR | None = None
+    _window     : Tuple[int, int, int, int] | None = None
+    _views      : weakref.WeakSet[SAR] | None = None
+    # planes computed on their own (T22, C13, span ...) when T / C is not,
+    # see _plane. _planes_lock guards the creation of the per plane locks.
+    _planes     : Dict[str, npt.NDArray] | None = None
+    _locks      : Dict[str, threading.Lock] | None = None
+    _planes_lock: ClassVar[threading.Lock] = threading.Lock()
 
 
     def __init__(
@@ -28,23 +95,49 @@ class SAR:
             coeff: npt.NDArray,
             calibrated: bool = False,
             device: str = "cpu",
-            T: npt.NDArray | None = None,
-            C: npt.NDArray | None = None
+            T: npt.NDArray | HermitianMatrix | None = None,
+            C: npt.NDArray | HermitianMatrix | None = None,
+            dtype: npt.DTypeLike | None = None,
+            offset: Tuple[int, int] = (0, 0)
             ) -> None:
-        
+        """
+        coeff, T and C are converted to dtype (complex64 or complex128, the
+        sar.dtypes policy if None) unless they already are of that dtype.
+        """
         x, y, *_ = coeff.shape
+        dtype = dtypes.complex_dtype(dtype)
         if len(coeff.shape) == 4 and x == 2 and y == 2:
-            self._coeffs = coeff
+            self._coeffs = dtypes.as_dtype(coeff, dtype)
         else:
             raise ValueError(f"the shape of coeff should be of the form (2, 2, x, y) [given shape -> {coeff.shape}]")
 
         self.calibrated = calibrated
         self.device = device
-        self._T = T
-        self._C = C
+        self._T = _as_hermitian(T, dtype)
+        self._C = _as_hermitian(C, dtype)
+        self.offset = (int(offset[0]), int(offset[1]))
     
 
-    def load(self, path: Path) -> None:
+    def load(self, path: Path, mmap_mode: str | None = None) -> None:
+        """
+        Loads the scattering coefficients and the T and C matrices (if saved)
+        from a directory written by `save`.
+
+        Parameters
+        ----------
+        path: Path
+            directory containing config.json and the .npy files
+        mmap_mode: str | None
+            None reads the arrays into memory, otherwise the .npy files are
+            kept open as memory maps ('r' read-only, 'c' copy-on-write,
+            'r+' read-write) and only the pages that are accessed are read.
+            Arrays saved with format='chunked' are always opened lazily
+            (sar.store.ChunkedArray), only the chunks that are used are read.
+            Arrays of another dtype than the sar.dtypes policy are converted
+            (and read into memory).
+        """
+        if mmap_mode not in MMAP_MODES:
+            raise ValueError(f"mmap_mode: {mmap_mode} is not valid (should be one of {MMAP_MODES})")
         if path.is_dir():
             config_path = path / "config.json"
             if not config_path.is_file():
@@ -52,24 +145,54 @@ class SAR:
             with config_path.open('r') as config_file:
                 config = json.load(config_file)
 
-            self._T = None
-            self._C = None
+            with log.span("load") as trace:
+                self._T = None
+                self._C = None
+                self._forget_planes()
+                self.calibrated = config.get('calibrated', False)
+                self.offset = tuple(config.get('offset', (0, 0)))
+                self.source = config.get('source')
+                self.lineage = tuple((name, params) for name, params in config.get('lineage', []))
+                self.mmap_mode = mmap_mode
 
-            with (path / "coeffs.npy").open('rb') as coeffs_file:
-                self._coeffs = np.load(coeffs_file)
-            if config['t_mat']:
-                with (path / "t_mat.npy").open('rb') as t_file:
-                    self._T = np.load(t_file)
-            if config['c_mat']:
-                with (path / "c_mat.npy").open('rb') as c_file:
-                    self._C = np.load(c_file)
+                dtype = dtypes.get_dtype()
+                self._coeffs = dtypes.as_dtype(read_array(path, "coeffs", mmap_mode), dtype)
+                packed = config.get('layout', 'full') == 'packed'
+                if config['t_mat']:
+                    if packed:
+                        self._T = HermitianMatrix.load(path, "t_mat", mmap_mode)
+                    else:
+                        self._T = HermitianMatrix.from_full(load_array(path / "t_mat.npy", mmap_mode))
+                if config['c_mat']:
+                    if packed:
+                        self._C = HermitianMatrix.load(path, "c_mat", mmap_mode)
+                    else:
+                        self._C = HermitianMatrix.from_full(load_array(path / "c_mat.npy", mmap_mode))
+                self._T = _as_hermitian(self._T, dtype)
+                self._C = _as_hermitian(self._C, dtype)
+                _, _, x, y = self._coeffs.shape
+                nbytes = self._coeffs.nbytes + sum(m.nbytes for m in (self._T, self._C) if m is not None)
+                # memory maps and chunked arrays are only read when used
+                lazy = mmap_mode is not None or config.get('format') == 'chunked'
+                trace.add("pixels", x * y)
+                trace.add("bytes_mapped" if lazy else "bytes_read", nbytes)
 
         else:
             raise ValueError(f"path: {path} is not a valid directory.")
 
 
+    @classmethod
+    def from_path(cls, path: Path, mmap_mode: str | None = None) -> SAR:
+        """
+        New SAR from a directory written by `save` (see `load`).
+        """
+        sar_img = SAR.__new__(SAR)
+        sar_img.load(path, mmap_mode=mmap_mode)
+        return sar_img
+
+
     @property
-    def T(self) -> npt.NDArray:
+    def T(self) -> HermitianMatrix:
         if self._T is not None:
             return self._T
         else:
@@ -77,39 +200,495 @@ class SAR:
 
 
     @property
-    def C(self) -> npt.NDArray:
-        if self._C:
+    def C(self) -> HermitianMatrix:
+        if self._C is not None:
             return self._C
         else:
             raise ValueError(f"C matrix is not computed")
 
 
     def copy(self: SAR) -> SAR:
-        return SAR(
-                self._coeffs,
+        """
+        Shallow copy: a view of the whole scene, the arrays are only copied
+        when one of the two is modified.
+        """
+        _, _, x, y = self._coeffs.shape
+        return self._derive(self._coeffs, self._T, self._C, self.offset, shared=True, window=(0, x, 0, y))
+
+
+    def _derive(
+            self,
+            coeffs: npt.NDArray,
+            T: HermitianMatrix | None,
+            C: HermitianMatrix | None,
+            offset: Tuple[int, int],
+            step: Step | None = None,
+            shared: bool = False,
+            window: Tuple[int, int, int, int] | None = None
+            ) -> SAR:
+        # new scene derived from this one by step (None: same product),
+        # shared if it holds arrays of self (kept in their dtype, a
+        # conversion to the policy dtype would copy them)
+        sar_img = SAR(
+                coeffs,
                 calibrated=self.calibrated,
                 device=self.device,
-                T=self._T,
-                C=self._C
+                T=T,
+                C=C,
+                dtype=self._coeffs.dtype if shared else None,
+                offset=offset
                 )
+        sar_img.source = self.source
+        sar_img.lineage = self.lineage + ((step,) if step is not None else ())
+        sar_img.cache = self.cache
+        if shared:
+            sar_img._parent = self
+            sar_img._window = window
+            if self._views is None:
+                self._views = weakref.WeakSet()
+            self._views.add(sar_img)
+        return sar_img
+
+
+    @property
+    def is_view(self) -> bool:
+        """
+        True if the scene shares its arrays with the scene it was derived
+        from (crop_new, copy, speckle_filter).
+        """
+        return self._parent is not None
+
+
+    def _shares_memory(self) -> bool:
+        return self._parent is not None or bool(self._views)
+
+
+    def _diverge(self) -> None:
+        # the coefficients of self are replaced: the views keep the old ones
+        # (and share them with each other) but can not write back any more,
+        # self does not share anything with its parent
+        for view in self._views or ():
+            view._window = None
+        self._views = None
+        if self._parent is not None and self._parent._views is not None:
+            self._parent._views.discard(self)
+        self._parent = None
+        self._window = None
+
+
+    def detach(self) -> SAR:
+        """
+        Copies the arrays of the scene (shared with other scenes, memory
+        mapped or lazy) into memory owned by the scene. Returns self.
+        """
+        self._coeffs = np.array(self._coeffs)
+        if self._T is not None:
+            self._T = HermitianMatrix(np.array(self._T.diag), np.array(self._T.upper))
+        if self._C is not None:
+            self._C = HermitianMatrix(np.array(self._C.diag), np.array(self._C.upper))
+        self.mmap_mode = None
+        self._diverge()
+        return self
+
+
+    def share(self, backend: str = "shm", directory: Path | None = None) -> SAR:
+        """
+        Moves the coefficients and the computed T / C into shared memory
+        (sar.shared, 'shm') or memory mapped files in directory ('file'):
+        the scene and its crops are then pickled as handles to the shared
+        arrays, so a process pool gets them without copies and the writes of
+        the workers are seen by every process. Returns self.
+        """
+        from sar.shared import share
+        coeffs = share(self._coeffs, backend=backend, directory=directory)
+        matrices = [
+                None if matrix is None else HermitianMatrix(
+                    share(matrix.diag, backend=backend, directory=directory),
+                    share(matrix.upper, backend=backend, directory=directory)
+                    )
+                for matrix in (self._T, self._C)
+                ]
+        changed = coeffs is not self._coeffs or any(
+                new is not None and (new.diag is not old.diag or new.upper is not old.upper)
+                for new, old in zip(matrices, (self._T, self._C))
+                )
+        if changed:
+            self._coeffs = coeffs
+            self._T, self._C = matrices
+            self.mmap_mode = None
+            self._diverge()
+        return self
+
+
+    @property
+    def is_shared(self) -> bool:
+        from sar.shared import is_shared
+        arrays = [self._coeffs] + [plane for matrix in (self._T, self._C) if matrix is not None for plane in (matrix.diag, matrix.upper)]
+        return all(is_shared(array) for array in arrays)
+
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # arrays in shared memory are sent as handles (see sar.shared), views,
+        # memoised planes and locks are not pickled
+        from sar.shared import reduce_scene
+        return reduce_scene(self)
+
+
+    def writeback(self, recursive: bool = True) -> SAR:
+        """
+        Writes the T / C matrices computed on a crop (or copy) into the same
+        region of its parent, the crop then holds views of the parent's
+        matrices. A matrix the parent has not computed is allocated and set
+        to NaN outside the written regions. With recursive, a crop of a crop
+        is written to the first scene of the chain.
+
+        Returns
+        -------
+        SAR
+            the scene written to
+        """
+        if self._parent is None or self._window is None:
+            raise ValueError("writeback needs a crop or copy of a scene that was not modified since")
+        parent = self._parent
+        r1, r2, c1, c2 = self._window
+        while recursive and parent._parent is not None and parent._window is not None:
+            r0, _, c0, _ = parent._window
+            r1, r2, c1, c2 = r1 + r0, r2 + r0, c1 + c0, c2 + c0
+            parent = parent._parent
+        _, _, x, y = parent._coeffs.shape
+        for name in ("_T", "_C"):
+            matrix = getattr(self, name)
+            if matrix is None:
+                continue
+            target = getattr(parent, name)
+            if target is None:
+                target = HermitianMatrix(
+                        np.full([3, x, y], np.nan, dtype=matrix.diag.dtype),
+                        np.full([3, x, y], np.nan, dtype=matrix.upper.dtype)
+                        )
+                setattr(parent, name, target)
+            region = target.crop(r1, r2, c1, c2)
+            # nothing to copy if the crop already holds a view of the parent
+            if not np.may_share_memory(region.diag, matrix.diag):
+                region.diag[...] = matrix.diag
+                region.upper[...] = matrix.upper
+            setattr(self, name, region)
+        return parent
+
+
+    def fingerprint(self) -> str:
+        """
+        Identity of the source scene, the hash of the coefficients if the
+        scene was not read from files (computed once).
+        """
+        if self.source is None:
+            from sar.cache import hash_array
+            self.source = f"coeffs:{hash_array(self._coeffs)}"
+        return self.source
+
+
+    def with_cache(self, cache: ProductCache | None = None) -> SAR:
+        """
+        Looks up / stores the products derived from this scene (multilook,
+        speckle_filter) in cache (sar.cache.default_cache() if None), the
+        scenes derived from it share the cache. Entries of older versions of
+        the source are dropped. Returns self.
+        """
+        from sar.cache import default_cache
+        self.cache = cache if cache is not None else default_cache()
+        self.cache.drop_stale(self.fingerprint())
+        return self
+
+
+    def _cache_key(self, step: Step) -> str:
+        from sar.cache import product_key
+        return product_key(
+                self.fingerprint(), self.lineage + (step,),
+                dtype=np.dtype(self._coeffs.dtype).name, T=self._T is not None, C=self._C is not None
+                )
+
+
+    def _cached(self, step: Step) -> Tuple[str | None, SAR | None]:
+        # (key, cached product) of self + step, (None, None) without a cache
+        if self.cache is None:
+            return None, None
+        key = self._cache_key(step)
+        cached = self.cache.get(key)
+        if cached is not None:
+            cached.device = self.device
+            cached.cache = self.cache
+        return key, cached
+
+
+    def _store(self, key: str | None, sar_img: SAR) -> SAR:
+        if key is not None:
+            self.cache.put(key, sar_img)
+        return sar_img
+
+
+    def _plane(self, name: str, compute: Callable[[], npt.NDArray]) -> npt.NDArray:
+        # memoised plane: computed once, concurrent readers of the same plane
+        # wait for the first one instead of computing it again
+        with SAR._planes_lock:
+            if self._planes is None:
+                self._planes = dict()
+                self._locks = dict()
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            plane = self._planes.get(name)
+            if plane is None:
+                plane = compute()
+                self._planes[name] = plane
+        return plane
+
+
+    def _forget_planes(self, prefix: str = "") -> None:
+        # drops the memoised planes whose name starts with prefix
+        with SAR._planes_lock:
+            if self._planes is not None:
+                for name in [name for name in self._planes if name.startswith(prefix)]:
+                    del self._planes[name]
+
+
+    def _compute_element(self, matrix: str, i: int, j: int) -> npt.NDArray:
+        from sar import computations
+        _, _, x, y = self._coeffs.shape
+        coeffs = np.asarray(self._coeffs)
+        index = ("T", "C").index(matrix)
+        if i == j:
+            out = np.empty([x, y], dtype=np.finfo(coeffs.dtype).dtype)
+            computations.diag_element_cpu(coeffs, index, i, out)
+        else:
+            out = np.empty([x, y], dtype=coeffs.dtype)
+            computations.upper_element_cpu(coeffs, index, i, j, out)
+        return out
+
+
+    def element(self, matrix: str, i: int, j: int) -> npt.NDArray:
+        """
+        (i, j) element plane (0 based) of the 'T' or 'C' matrix. If the
+        matrix is not computed only this plane is (once, it is memoised),
+        lower triangle elements are the conjugate of the upper ones.
+        """
+        if matrix not in ("T", "C"):
+            raise ValueError(f"un-supported matrix: {matrix}. Available matrices: ('T', 'C')")
+        if not (0 <= i < 3 and 0 <= j < 3):
+            raise IndexError(f"element ({i}, {j}) is out of range for a 3x3 matrix")
+        full = self._T if matrix == "T" else self._C
+        if full is not None:
+            return full.element(i, j)
+        if i > j:
+            return np.conj(self.element(matrix, j, i))
+        if self.device != "cpu":
+            getattr(self, f"compute{matrix}")()
+            return self.element(matrix, i, j)
+        return self._plane(f"{matrix}{i + 1}{j + 1}", lambda: self._compute_element(matrix, i, j))
+
+
+    @property
+    def span(self) -> npt.NDArray:
+        """
+        Total power |HH|^2 + 2 |HV|^2 + |VV|^2 (the trace of T and of C), from
+        the computed matrices or in a single pass over the coefficients
+        (memoised).
+        """
+        for matrix in (self._T, self._C):
+            if matrix is not None:
+                return matrix.diag[0] + matrix.diag[1] + matrix.diag[2]
+
+        def compute() -> npt.NDArray:
+            from sar import computations
+            _, _, x, y = self._coeffs.shape
+            coeffs = np.asarray(self._coeffs)
+            out = np.empty([x, y], dtype=np.finfo(coeffs.dtype).dtype)
+            computations.span_cpu(coeffs, out)
+            return out
+
+        return self._plane("span", compute)
+
+
+    def _check_device(self) -> None:
+        if self.device not in ("cpu", "gpu"):
+            raise ValueError(f"Device: {self.device} is not a valid device (should be 'cpu' or 'gpu').")
 
 
     def computeC(self) -> None:
-        # TODO: complete this function
-        self._C = np.arange(0, 36).reshape([3, 3, 2, 2])
+        if self._C is not None:
+            return
+        self._check_device()
+        from sar import computations
+        a, b, x, y = self._coeffs.shape
+        with log.span("computeC", pixels=x * y) as trace:
+            self._C = HermitianMatrix.empty(x, y, dtype=self._coeffs.dtype)
+            trace.add("bytes_allocated", self._C.nbytes)
+            if self.device == "cpu":
+                computations.computeC_from_coeffs_cpu(np.asarray(self._coeffs), self._C.diag, self._C.upper)
+            else:
+                computations.computeC_from_coeffs_gpu(np.asarray(self._coeffs), self._C.diag, self._C.upper)
+        self._forget_planes("C")
 
 
     def computeT(self) -> None:
         if self._T is not None:
             return 
+        self._check_device()
+        from sar import computations
         a, b, x, y = self._coeffs.shape
-        self._T = np.empty([3, 3, x, y], dtype=self._coeffs.dtype)
-        if self.device == "cpu":
-            computations.computeT_from_coeffs_cpu(self._coeffs, self._T)
-        elif self.device == "gpu":
-            computations.computeT_from_coeffs_gpu(self._coeffs, self._T)
+        with log.span("computeT", pixels=x * y) as trace:
+            self._T = HermitianMatrix.empty(x, y, dtype=self._coeffs.dtype)
+            trace.add("bytes_allocated", self._T.nbytes)
+            if self.device == "cpu":
+                computations.computeT_from_coeffs_cpu(np.asarray(self._coeffs), self._T.diag, self._T.upper)
+            else:
+                computations.computeT_from_coeffs_gpu(np.asarray(self._coeffs), self._T.diag, self._T.upper)
+        self._forget_planes("T")
+
+
+    def compute_parallel(
+            self,
+            matrix: str = "T",
+            workers: int | None = None,
+            tile_rows: int = 1024,
+            backend: str = "shm",
+            directory: Path | None = None
+            ) -> None:
+        """
+        Computes T or C in a pool of worker processes: the scene is shared
+        (see share), every worker computes azimuth blocks of tile_rows
+        straight into the shared output matrix.
+
+        Parameters
+        ----------
+        matrix: str
+            'T' or 'C'
+        workers: int | None
+            worker processes (one per cpu if None), each runs
+            cpu_count // workers numba threads
+        tile_rows: int
+        backend: str
+            'shm' or 'file' (memory mapped files in directory)
+        directory: Path | None
+        """
+        from sar.shared import compute_parallel
+        compute_parallel(self, matrix, workers=workers, tile_rows=tile_rows, backend=backend, directory=directory)
+
+
+    def computeTC(self) -> None:
+        """
+        Computes the T and C matrices together in a single pass over the
+        scattering coefficients (falls back to the separate kernels if one
+        of them is already computed or the device is not 'cpu').
+        """
+        if self._T is not None or self._C is not None or self.device != "cpu":
+            self.computeT()
+            self.computeC()
+            return
+        from sar import computations
+        a, b, x, y = self._coeffs.shape
+        with log.span("computeTC", pixels=x * y) as trace:
+            self._T = HermitianMatrix.empty(x, y, dtype=self._coeffs.dtype)
+            self._C = HermitianMatrix.empty(x, y, dtype=self._coeffs.dtype)
+            trace.add("bytes_allocated", self._T.nbytes + self._C.nbytes)
+            computations.computeTC_from_coeffs_cpu(
+                    np.asarray(self._coeffs), self._T.diag, self._T.upper, self._C.diag, self._C.upper)
+        self._forget_planes("T")
+        self._forget_planes("C")
+
+
+    def calibrate(
+            self,
+            constant: float | Sequence[float] = 10000,
+            incidence: float | npt.NDArray | None = None,
+            output: str = "beta0",
+            out: npt.NDArray | None = None
+            ) -> None:
+        """
+        Converts the DN scattering coefficients to calibrated ones in a single
+        parallel pass, in place (or straight into out) without temporaries.
+        Computed T / C matrices are dropped. Does nothing if the scene is
+        already calibrated.
+
+        Parameters
+        ----------
+        constant: float | Sequence[float]
+            amplitude calibration constant the coefficients are divided by,
+            one for all channels or one per channel (HH, HV, VH, VV). A power
+            constant K in dB is 10 ** (K / 20) in amplitude.
+        incidence: float | npt.NDArray | None
+            incidence angle in degrees as a scalar, per range column (y,) or
+            per pixel (x, y), needed for 'sigma0' and 'gamma0'
+        output: str
+            'beta0' (constant only), 'sigma0' or 'gamma0'
+        out: npt.NDArray | None
+            preallocated (2, 2, x, y) array of the coefficients dtype that
+            receives the result and becomes the coefficients of the scene.
+            Without it the coefficients are overwritten in place, unless
+            they are shared with other scenes (crops, copies), read-only /
+            lazy or memory mapped with 'r+', then a new array is allocated
+            (copy-on-write).
+        """
+        if self.calibrated:
+            return
+        from sar import computations
+        if output not in computations.CALIBRATION_MODES:
+            raise ValueError(f"un-supported output: {output}. Available outputs: {computations.CALIBRATION_MODES}")
+        self._check_device()
+        _, _, x, y = self._coeffs.shape
+
+        constants = np.broadcast_to(np.asarray(constant, dtype=np.float64), (4,)).reshape(2, 2)
+        if np.any(constants == 0):
+            raise ValueError(f"calibration constants can not be 0 [given -> {constant}]")
+        scale = 1 / constants
+
+        if output == "beta0":
+            angles = np.zeros([1, 1])
+        elif incidence is None:
+            raise ValueError(f"the incidence angle is needed to calibrate to {output}")
         else:
-            raise ValueError(f"Device: {self.device} is not a valid device (should be 'cpu' or 'gpu').")
+            angles = np.asarray(incidence)
+            if angles.dtype not in (np.float32, np.float64):
+                angles = angles.astype(np.float64)
+            if angles.ndim == 0 or angles.ndim == 1 and angles.shape[0] == y:
+                angles = angles.reshape(1, -1)
+            elif angles.shape != (x, y):
+                raise ValueError(f"incidence should be a scalar, (y,) or (x, y) [given shape -> {angles.shape}]")
+            angles = np.ascontiguousarray(angles)
+
+        if out is None:
+            if (
+                    self._shares_memory()
+                    or not isinstance(self._coeffs, np.ndarray)
+                    or not self._coeffs.flags.writeable
+                    or isinstance(self._coeffs, np.memmap) and self._coeffs.mode == 'r+'
+                    ):
+                # copy-on-write: views and read-only / lazy coefficients are
+                # calibrated into a new array, so are 'r+' memory maps (the
+                # file would be calibrated while its config.json is not)
+                out = np.empty(self._coeffs.shape, dtype=self._coeffs.dtype)
+            else:
+                out = self._coeffs
+        elif out.shape != self._coeffs.shape or out.dtype != self._coeffs.dtype:
+            raise ValueError(f"out should be a {self._coeffs.dtype} array of shape {self._coeffs.shape} [given -> {out.dtype} {out.shape}]")
+
+        computations.calibrate_cpu(
+                np.asarray(self._coeffs), scale, angles,
+                computations.CALIBRATION_MODES.index(output), out
+                )
+        if out is not self._coeffs:
+            self._diverge()
+        self._coeffs = out
+        self._T = None
+        self._C = None
+        self._forget_planes()
+        self.calibrated = True
+        if incidence is not None and np.ndim(incidence) > 0:
+            from sar.cache import hash_array
+            incidence = hash_array(np.atleast_2d(incidence))
+        self.lineage = self.lineage + (("calibrate", {
+                'constant': constants.ravel().tolist(),
+                'incidence': incidence if output != "beta0" else None,
+                'output': output
+                }),)
 
 
     def __getattr__(self, attr) -> npt.NDArray:
@@ -124,74 +703,85 @@ class SAR:
             i, j = coeffs_dict[attr]
             return self._coeffs[i, j, :, :]
 
-        # get matrices elements
-        for i in range(1, 4):
-            for j in range(1, 4):
-                if attr == f"T{i}{j}":
-                    if self._T is not None:
-                        return self._T[i - 1, j - 1, :, :]
-                    else:
-                        raise ValueError(f"T matrix is not computed")
-                elif attr == f"C{i}{j}":
-                    if self._C is not None:
-                        return self._C[i - 1, j - 1, :, :]
-                    else:
-                        raise ValueError(f"C matrix is not computed")
+        # get matrices elements, computed lazily if the matrix is not
+        if len(attr) == 3 and attr[0] in "TC" and attr[1] in "123" and attr[2] in "123":
+            return self.element(attr[0], int(attr[1]) - 1, int(attr[2]) - 1)
         raise AttributeError(f"Attribute {attr} does not exits")
 
 
     def multilook_azimuth(self: SAR, nmls: int, method: str = 'mean') -> SAR:
-        coeffs: List[List[npt.NDArray | None]] = [
-            [None, None],
-            [None, None]
-        ]
-        for i in range(2):
-            for j in range(2):
-                coeffs[i][j] = self._multilook_indi(
-                        self._coeffs[i, j, :, :], nmls=nmls, method=method)
-        return SAR(
-                np.array(coeffs),
-                calibrated=self.calibrated,
-                device=self.device
-                )
-
+        return self.multilook((nmls, 1), method=method)
 
-    def _multilook_indi(self, data: npt.NDArray, nmls: int, method: str = "mean") -> npt.NDArray:
-        method_list = ["mean", "median", "mode", "nearest"]
-        if method not in method_list:
-            msg = f"un-supported multilook method: {method}. Available methods: {method_list}"
-            raise ValueError(msg)
 
-        nmls = int(nmls)
-        if nmls == 1:
-            return data
-        dtype = data.dtype
-        shape = np.array(data.shape, dtype=int)
-        azimuth_size = shape[0] // nmls
+    def multilook(self: SAR, looks: int | Tuple[int, int], method: str = 'mean') -> SAR:
+        """
+        Multilooks the scene over blocks of (azimuth, range) looks and returns
+        a new SAR.
 
-        if method in ['mean', 'median']:
-            new_shape = np.floor(shape / (nmls, 1)).astype(int) * (nmls, 1)
-            crop_data = data[:new_shape[0], :new_shape[1]]
+        The scattering coefficients and the computed T / C matrices are
+        reduced in one pass per product, T and C are always averaged from
+        their full resolution values (incoherent multilook, whatever method)
+        so that they stay Hermitian positive semi-definite. Rows / columns
+        that do not fill a complete block are dropped.
 
-            temp = crop_data.reshape((new_shape[0] // nmls, nmls, new_shape[1], 1))
+        Parameters
+        ----------
+        looks: int | Tuple[int, int]
+            (azimuth, range) look factors, an int only multilooks in azimuth
+        method: str
+            reduction of the scattering coefficients: 'mean' and 'median'
+            ignore NaNs, 'mode' takes the most frequent value of the block
+            and 'nearest' the centre pixel. Complex values are reduced on
+            their real and imaginary parts separately.
 
-            if method == 'mean':
-                coarse_data = np.nanmean(temp, axis=(1, 3))
-            else:
-                coarse_data = np.nanmedian(temp, axis=(1, 3))
-            
-        elif method == 'nearest':
-            coarse_data = data[int(nmls / 2)::nmls, int(1 // 2)::1]
-            if coarse_data.shape != (azimuth_size, shape[1]):
-                coarse_data = coarse_data[:azimuth_size, :shape[1]]
+        Returns
+        -------
+        SAR
+        """
+        if method not in MULTILOOK_METHODS:
+            msg = f"un-supported multilook method: {method}. Available methods: {MULTILOOK_METHODS}"
+            raise ValueError(msg)
+        if isinstance(looks, (int, np.integer)):
+            looks = (int(looks), 1)
+        az, rg = int(looks[0]), int(looks[1])
+        if az < 1 or rg < 1:
+            raise ValueError(f"looks should be positive [given -> {looks}]")
+        step = ("multilook", {'looks': [az, rg], 'method': method})
+        key, cached = self._cached(step)
+        if cached is not None:
+            return cached
 
-        coarse_data = np.array(coarse_data, dtype=dtype)
-        return coarse_data
+        a, b, x, y = self._coeffs.shape
+        with log.span("multilook", pixels=x * y) as trace:
+            coeffs = _multilook_planes(np.asarray(self._coeffs).reshape(a * b, x, y), az, rg, method)
+            T = None
+            C = None
+            if self._T is not None:
+                T = HermitianMatrix(
+                        _multilook_planes(self._T.diag, az, rg, "mean"),
+                        _multilook_planes(self._T.upper, az, rg, "mean")
+                        )
+            if self._C is not None:
+                C = HermitianMatrix(
+                        _multilook_planes(self._C.diag, az, rg, "mean"),
+                        _multilook_planes(self._C.upper, az, rg, "mean")
+                        )
+            trace.add("bytes_allocated", coeffs.nbytes + sum(m.nbytes for m in (T, C) if m is not None))
+        return self._store(key, self._derive(
+                coeffs.reshape(a, b, *coeffs.shape[1:]), T, C,
+                (self.offset[0] // az, self.offset[1] // rg), step,
+                shared=az == 1 and rg == 1
+                ))
 
 
     def crop_new(self: SAR, margins: List[int]) -> SAR:
         """
         Crops the Image and returns a new SARImage object 
+
+        The crop is a view: its coefficients and T / C are slices of the
+        arrays of this scene (memory maps and lazy arrays are not read), they
+        are copied if one of the two scenes is calibrated, see writeback for
+        matrices computed on the crop.
         
         Parameters
         ----------
@@ -209,52 +799,245 @@ class SAR:
         if len(margins) == 4:
             r1, r2, c1, c2 = margins
             coeffs = self._coeffs[:, :, r1:r2, c1:c2]
+            _, _, x, y = self._coeffs.shape
+            rows = slice(r1, r2).indices(x)
+            cols = slice(c1, c2).indices(y)
+            offset = (self.offset[0] + rows[0], self.offset[1] + cols[0])
+            window = (*rows[:2], *cols[:2])
+            step = ("crop", {'window': list(window)})
             T = None
             C = None
             if self._T is not None:
-                T = self._T[:, :, r1:r2, c1:c2]
-            if self._C:
-                C = self._C[:, :, r1:r2, c1:c2]
-            return SAR(
-                    coeffs,
-                    calibrated=self.calibrated,
-                    device=self.device,
-                    T=T,
-                    C=C
-                    )
+                T = self._T.crop(r1, r2, c1, c2)
+            if self._C is not None:
+                C = self._C.crop(r1, r2, c1, c2)
+            # a view, nothing is allocated
+            with log.span("crop_new", pixels=(rows[1] - rows[0]) * (cols[1] - cols[0])):
+                return self._derive(coeffs, T, C, offset, step, shared=True, window=window)
         else:
             raise ValueError(f"size of margins should be 4, but got margin: {margins}")
 
-    def save(self, path: Path) -> None:
+    def save(self, path: Path, format: str = "npy", **options) -> None:
         """
         Save the scattering coefficients along with T and C matrices if computed,
-        for easy loading.
+        for easy loading. T and C are written packed (diagonal and upper
+        triangle planes, see HermitianMatrix).
+
+        Parameters
+        ----------
+        path: Path
+        format: str
+            'npy' writes one .npy file per array, 'chunked' a directory of
+            (optionally compressed) azimuth / range chunks per array that is
+            read lazily by `load`
+        options:
+            chunks, compressor, level and shuffle of sar.store.save_chunked
         """
+        if format not in FORMATS:
+            raise ValueError(f"un-supported format: {format}. Available formats: {FORMATS}")
         if not path.is_dir():
             path.mkdir(parents=True)
         config_path = path / "config.json"
-        coeffs_path = path / "coeffs.npy"
-        t_path = path / "t_mat.npy" 
-        c_path = path / "c_mat.npy" 
-        config: Dict[str, bool] = {
+        config: Dict[str, Any] = {
                 'calibrated': self.calibrated,
                 'config': True,
                 'coeffs': True,
                 't_mat': False,
-                'c_mat': False
+                'c_mat': False,
+                'layout': 'packed',
+                'format': format,
+                'dtype': np.dtype(self._coeffs.dtype).name,
+                'offset': list(self.offset),
+                'source': self.source,
+                'lineage': [list(step) for step in self.lineage]
                 }
 
-        with coeffs_path.open('wb') as coeffs_file:
-            np.save(coeffs_file, self._coeffs)
+        _, _, x, y = self._coeffs.shape
+        with log.span("save", pixels=x * y) as trace:
+            write_array(path, "coeffs", self._coeffs, format=format, **options)
+            if self._T is not None:
+                config['t_mat'] = True
+                self._T.save(path, "t_mat", format=format, **options)
+            if self._C is not None:
+                config['c_mat'] = True
+                self._C.save(path, "c_mat", format=format, **options)
+            with config_path.open('w') as config_file:
+                json.dump(config, config_file, indent=4)
+            if log.is_enabled():
+                trace.add("bytes_written", sum(file.stat().st_size for file in path.rglob("*") if file.is_file()))
+
+
+    def process_tiled(
+            self,
+            operations: Sequence[Operation],
+            path: Path,
+            tile_rows: int = 4096,
+            overlap: int = 0
+            ) -> SAR:
+        """
+        Runs operations (see sar.tiling) over the scene in azimuth blocks of
+        tile_rows and writes the result to path block by block.
+
+        Returns
+        -------
+        SAR
+            the result, memory mapped read-only from path
+        """
+        from sar.tiling import TiledProcessor
+        TiledProcessor(operations, tile_rows=tile_rows, overlap=overlap).run(self, path)
+        result = SAR.from_path(path, mmap_mode='r')
+        result.device = self.device
+        return result
+
+
+    def speckle_filter(
+            self: SAR,
+            method: str = "refined_lee",
+            win: int = 7,
+            looks: float = 1,
+            damping: float = 1.0
+            ) -> SAR:
+        """
+        Speckle filters the T and C matrices (T is computed first if neither
+        is) and returns a new SAR with the filtered matrices, see
+        sar.filters.filter_matrix for the methods and parameters.
+        """
+        if self._T is None and self._C is None:
+            self.computeT()
+        step = ("speckle_filter", {'method': method, 'win': win, 'looks': looks, 'damping': damping})
+        key, cached = self._cached(step)
+        if cached is not None:
+            return cached
+        from sar import filters
+        T = None
+        C = None
         if self._T is not None:
-            config['t_mat'] = True
-            with t_path.open('wb') as t_file:
-                np.save(t_file, self._T)
-        if self._C:
-            config['c_mat'] = True
-            with c_path.open('wb') as c_file:
-                np.save(c_file, self._C)
-        with config_path.open('w') as config_file:
-            json.dump(config, config_file, indent=4)
+            T = filters.filter_matrix(self._T, method=method, win=win, looks=looks, damping=damping)
+        if self._C is not None:
+            C = filters.filter_matrix(self._C, method=method, win=win, looks=looks, damping=damping)
+        return self._store(key, self._derive(self._coeffs, T, C, self.offset, step, shared=True))
+
+
+    def detect_edges(
+            self,
+            method: str = "ratio",
+            win: int = 7,
+            half: int = 3,
+            looks: float = 1,
+            pfa: float | None = 1e-3,
+            tile_rows: int = 1024,
+            workers: int | None = None
+            ) -> Edges:
+        """
+        Ratio / Wishart edge detection on T (computed if needed), see
+        sar.edge.detect_edges.
+        """
+        from sar.edge import detect_edges
+        self.computeT()
+        return detect_edges(
+                self._T, method=method, win=win, half=half, looks=looks,
+                pfa=pfa, tile_rows=tile_rows, workers=workers
+                )
 
 
+    def decompose(
+            self,
+            method: str = "h_a_alpha",
+            out: npt.NDArray | None = None,
+            tile_rows: int = 1024
+            ) -> npt.NDArray | Tuple[npt.NDArray, ...]:
+        """
+        Polarimetric decomposition of T (computed if needed), see
+        sar.decomposition for the methods. Multilook or speckle filter the
+        scene first, the decompositions expect an averaged T.
+        """
+        from sar.decomposition import DECOMPOSITIONS
+        if method not in DECOMPOSITIONS:
+            raise ValueError(f"un-supported decomposition: {method}. Available decompositions: {tuple(DECOMPOSITIONS)}")
+        self.computeT()
+        return DECOMPOSITIONS[method](self._T, out=out, tile_rows=tile_rows)
+
+
+    def stats(
+            self,
+            product: str = "span",
+            bins: int = 4096,
+            log: bool = False,
+            bounds: Tuple[float, float] | None = None,
+            window: Tuple[int, int, int, int] | None = None,
+            tile_rows: int = 1024
+            ) -> ProductStats:
+        """
+        Min / max / mean / variance, histogram and approximate quantiles of
+        product in one pass over the scene (sar.stats), without copying it.
+        Cached with the derived products if the scene has a cache (see
+        with_cache).
+
+        Parameters
+        ----------
+        product: str
+            'HH', 'HV', 'VH', 'VV' (amplitude), 'span' or a T / C element,
+            e.g. 'T11' ('T12'... are magnitudes)
+        bins: int
+            number of bins of the histogram (even)
+        log: bool
+            log spaced bins (positive values only)
+        bounds: Tuple[float, float] | None
+            range of the histogram, follows the data if None
+        window: Tuple[int, int, int, int] | None
+            (r1, r2, c1, c2) region (see crop_new), the whole scene if None
+        tile_rows: int
+
+        Returns
+        -------
+        ProductStats
+            moments (with std and enl), histogram and quantile()
+        """
+        from sar.stats import ProductStats, compute
+        sar_img = self.crop_new(window) if window is not None else self
+        step = ("stats", {'product': product, 'bins': bins, 'log': log, 'bounds': bounds})
+        key = sar_img._cache_key(step) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get_json(key)
+            if cached is not None:
+                return ProductStats.from_json(cached)
+        stats = compute(sar_img, product, bins=bins, log=log, bounds=bounds, tile_rows=tile_rows)
+        if key is not None:
+            self.cache.put_json(key, stats.to_json(), source=sar_img.source, lineage=sar_img.lineage)
+        return stats
+
+
+    def pyramid(
+            self,
+            path: Path,
+            levels: int | None = None,
+            looks: Tuple[int, int] = (1, 1),
+            tile_rows: int = 1024,
+            percentile: float = 99.0
+            ) -> Pyramid:
+        """
+        Builds a quicklook pyramid (sar.pyramid) in one pass over the scene:
+        span and T diagonal in dB (float16) and Pauli RGB (uint8) at levels
+        2x coarser each, down to about 512 pixels (or levels levels).
+
+        Parameters
+        ----------
+        path: Path
+            output directory
+        levels: int | None
+        looks: Tuple[int, int]
+            (azimuth, range) looks of the first level, e.g. to get square
+            pixels
+        tile_rows: int
+            rows of the scene per block, only the diagonal of T of a block is
+            computed if T is not
+        percentile: float
+            the stretch maps the (100 - percentile, percentile) percentiles
+            of every channel to 0 and 255
+
+        Returns
+        -------
+        Pyramid
+        """
+        from sar.pyramid import build
+        return build(self, path, levels=levels, looks=looks, tile_rows=tile_rows, percentile=percentile)
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import os
+import mmap
+import uuid
+import atexit
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+import numpy.typing as npt
+
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Tuple, TYPE_CHECKING
+from pathlib import Path
+
+from sar import logging as log
+from sar.hermitian import HermitianMatrix
+from sar.tiling import iter_tiles
+
+if TYPE_CHECKING:
+    from sar.sar import SAR
+
+
+# Scenes in shared memory, for process pools working on one scene.
+#
+# SAR.share moves the coefficients and the computed T / C into segments of
+# multiprocessing.shared_memory ('shm') or of memory mapped files ('file').
+# An array living in a segment is pickled as a SharedArray handle (segment,
+# byte offset, shape, strides, dtype) and attached again on the other side,
+# so sending a scene - or a crop of it, crops are views - to a worker
+# process copies nothing and what the worker writes into it is seen by
+# every process. Other arrays are pickled with their data as usual.
+#
+# Segments are created (and unlinked at exit or by release) by the process
+# that shares the scene, the workers attach them once and keep them mapped.
+# Handles are meant for processes of the same tree (the pool workers of the
+# owner), which share its multiprocessing resource tracker.
+
+BACKENDS = ("shm", "file")
+SHM = "shm:"
+FILE = "file:"
+
+
+class SharedArray(NamedTuple):
+    # 'shm:<name>' or 'file:<path>'
+    segment     : str
+    # bytes of the segment
+    size        : int
+    # bytes from the start of the segment to the first item
+    offset      : int
+    shape       : Tuple[int, ...]
+    strides     : Tuple[int, ...]
+    dtype       : str
+
+
+class _Segment(NamedTuple):
+    owner       : Any
+    buffer      : Any
+    address     : int
+    size        : int
+
+
+# segments mapped by this process, the ones it created
+_segments: Dict[str, _Segment] = dict()
+_owned: List[str] = list()
+_lock = threading.Lock()
+
+
+def _map(segment: str, size: int, create: bool = False) -> _Segment:
+    if segment.startswith(SHM):
+        owner = shared_memory.SharedMemory(name=segment[len(SHM):], create=create, size=size if create else 0)
+        buffer = owner.buf
+    else:
+        path = Path(segment[len(FILE):])
+        with path.open("w+b" if create else "r+b") as file:
+            if create:
+                file.truncate(size)
+            owner = buffer = mmap.mmap(file.fileno(), size)
+    address = np.frombuffer(buffer, dtype=np.uint8, count=1).ctypes.data
+    return _Segment(owner, buffer, address, size)
+
+
+def _segment(segment: str, size: int) -> _Segment:
+    with _lock:
+        if segment not in _segments:
+            _segments[segment] = _map(segment, size)
+        return _segments[segment]
+
+
+def allocate(shape: Tuple[int, ...], dtype: npt.DTypeLike, backend: str = "shm", directory: Path | None = None) -> npt.NDArray:
+    """
+    Uninitialised array in a new segment ('shm' shared memory or a memory
+    mapped file in directory, the temporary directory by default).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"un-supported backend: {backend}. Available backends: {BACKENDS}")
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    name = f"sar-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    if backend == "shm":
+        segment = SHM + name
+    else:
+        segment = FILE + str(Path(directory if directory is not None else tempfile.gettempdir()) / f"{name}.bin")
+    mapped = _map(segment, size, create=True)
+    with _lock:
+        _segments[segment] = mapped
+        _owned.append(segment)
+    return np.ndarray(shape, dtype=dtype, buffer=mapped.buffer)
+
+
+def share(array: Any, backend: str = "shm", directory: Path | None = None, rows: int = 1024) -> npt.NDArray:
+    """
+    array copied into a new segment (rows at a time, memory maps and lazy
+    arrays are not read at once), array itself if it already is in one.
+    """
+    if describe(array) is not None:
+        return array
+    out = allocate(array.shape, array.dtype, backend=backend, directory=directory)
+    for tile in iter_tiles(array.shape[-2], rows):
+        out[..., tile.start:tile.stop, :] = array[..., tile.start:tile.stop, :]
+    return out
+
+
+def describe(array: Any) -> SharedArray | None:
+    """
+    Handle of array if it lies in a segment mapped by this process.
+    """
+    if not isinstance(array, np.ndarray) or array.size == 0:
+        return None
+    start = array.__array_interface__['data'][0]
+    first = sum(min(0, (n - 1) * s) for n, s in zip(array.shape, array.strides))
+    last = sum(max(0, (n - 1) * s) for n, s in zip(array.shape, array.strides)) + array.itemsize
+    with _lock:
+        for segment, mapped in _segments.items():
+            if mapped.address <= start + first and start + last <= mapped.address + mapped.size:
+                return SharedArray(
+                        segment, mapped.size, start - mapped.address,
+                        tuple(array.shape), tuple(array.strides), array.dtype.str
+                        )
+    return None
+
+
+def attach(handle: SharedArray) -> npt.NDArray:
+    """
+    Array described by handle (the segment is mapped on first use).
+    """
+    mapped = _segment(handle.segment, handle.size)
+    return np.ndarray(
+            handle.shape, dtype=np.dtype(handle.dtype), buffer=mapped.buffer,
+            offset=handle.offset, strides=handle.strides
+            )
+
+
+def is_shared(array: Any) -> bool:
+    return describe(array) is not None
+
+
+def release(*arrays: Any) -> None:
+    """
+    Unlinks the segments (created by this process) holding arrays, the
+    processes that mapped them keep them until they unmap them.
+    """
+    for array in arrays:
+        handle = describe(array)
+        if handle is not None and handle.segment in _owned:
+            _unlink(handle.segment)
+
+
+def _unlink(segment: str) -> None:
+    with _lock:
+        if segment not in _owned:
+            return
+        _owned.remove(segment)
+    try:
+        if segment.startswith(SHM):
+            _segments[segment].owner.unlink()
+        else:
+            os.unlink(segment[len(FILE):])
+    except FileNotFoundError:
+        pass
+
+
+@atexit.register
+def _cleanup() -> None:
+    for segment in list(_owned):
+        _unlink(segment)
+
+
+def _reduce_array(array: Any) -> Any:
+    handle = describe(array)
+    return handle if handle is not None else array
+
+
+def _restore_array(value: Any) -> Any:
+    return attach(value) if isinstance(value, SharedArray) else value
+
+
+# attributes of a scene kept by pickling, views, memoised planes and locks
+# are not (an unpickled scene is detached from its parent)
+STATE = ("calibrated", "device", "mmap_mode", "offset", "source", "lineage", "cache")
+
+
+def reduce_scene(sar_img: SAR) -> Tuple[Any, Tuple[Any, ...]]:
+    """
+    SAR.__reduce__: the arrays in segments are replaced by their handles.
+    """
+    arrays: Dict[str, Any] = {'coeffs': _reduce_array(sar_img._coeffs)}
+    for name in ("T", "C"):
+        matrix = getattr(sar_img, f"_{name}")
+        arrays[name] = None if matrix is None else (_reduce_array(matrix.diag), _reduce_array(matrix.upper))
+    return (_rebuild_scene, (arrays, {name: getattr(sar_img, name) for name in STATE}))
+
+
+def _rebuild_scene(arrays: Dict[str, Any], state: Dict[str, Any]) -> SAR:
+    from sar.sar import SAR
+
+    sar_img = SAR.__new__(SAR)
+    sar_img._coeffs = _restore_array(arrays['coeffs'])
+    for name in ("T", "C"):
+        planes = arrays[name]
+        setattr(sar_img, f"_{name}", None if planes is None else HermitianMatrix(*map(_restore_array, planes)))
+    for name, value in state.items():
+        setattr(sar_img, name, value)
+    return sar_img
+
+
+def _init_worker(threads: int) -> None:
+    import numba
+    numba.set_num_threads(threads)
+
+
+def _compute_tile(block: SAR, matrix: str) -> None:
+    # the block holds views of the shared coefficients and output matrix
+    from sar import computations
+    kernel = getattr(computations, f"compute{matrix}_from_coeffs_cpu")
+    out = getattr(block, f"_{matrix}")
+    kernel(np.asarray(block._coeffs), out.diag, out.upper)
+
+
+def compute_parallel(
+        sar_img: SAR,
+        matrix: str = "T",
+        workers: int | None = None,
+        tile_rows: int = 1024,
+        backend: str = "shm",
+        directory: Path | None = None
+        ) -> HermitianMatrix:
+    """
+    Computes T or C of sar_img in a pool of worker processes (see
+    SAR.compute_parallel) and sets it on the scene.
+    """
+    if matrix not in ("T", "C"):
+        raise ValueError(f"un-supported matrix: {matrix}. Available matrices: ('T', 'C')")
+    if getattr(sar_img, f"_{matrix}") is not None:
+        return getattr(sar_img, f"_{matrix}")
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers < 1:
+        raise ValueError(f"workers should be at least 1 [given -> {workers}]")
+    sar_img.share(backend=backend, directory=directory)
+    _, _, x, y = sar_img._coeffs.shape
+    dtype = sar_img._coeffs.dtype
+    out = HermitianMatrix(
+            allocate((3, x, y), np.finfo(dtype).dtype, backend=backend, directory=directory),
+            allocate((3, x, y), dtype, backend=backend, directory=directory)
+            )
+    # a scene holding the (not yet computed) output, its crops are sent, in
+    # the dtype of the scene so that nothing is converted (copied)
+    from sar.sar import SAR
+    target = SAR(
+            sar_img._coeffs,
+            T=out if matrix == "T" else None,
+            C=out if matrix == "C" else None,
+            dtype=dtype
+            )
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with log.span("compute_parallel", pixels=x * y, bytes_allocated=out.nbytes):
+        # spawn: see batch.run
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,)
+                ) as executor:
+            blocks = [target.crop_new((tile.start, tile.stop, 0, y)) for tile in iter_tiles(x, tile_rows)]
+            list(executor.map(_compute_tile, blocks, [matrix] * len(blocks)))
+    setattr(sar_img, f"_{matrix}", out)
+    sar_img._forget_planes(matrix)
+    return out
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+from numba import jit, prange
+from scipy import stats
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Sequence, Tuple
+
+from sar.sar import SAR
+from sar.hermitian import HermitianMatrix
+from sar.tiling import iter_tiles
+
+
+# Multi-date stacks and change detection.
+#
+# Scenes are co-registered on the pixel grid of the full scene through their
+# offset (set by crop_new / multilook), the stack covers the intersection of
+# the scenes. Detectors walk the stack date by date and each date tile by
+# tile: every scene is accessed once per detector (so a LazyDateMap with
+# max_loaded=1 is enough) and T / C is only computed for one tile at a time.
+# What is kept across dates is a fixed number of planes of the stack extent,
+# independent of the number of dates.
+#
+# The Wishart tests follow Conradsen et al. (2016): for k matrices of n looks
+# and dimension p = 3, ln Q = n (p k ln k + sum ln|T_i| - k ln|sum T_i|) and
+# -2 rho ln Q is approximately chi2 with (k - 1) p^2 degrees of freedom.
+
+MATRICES = ("T", "C")
+CHANNELS = ("span", "11", "22", "33")
+PAIRS = ("consecutive", "reference")
+_P = 3
+
+
+class ChangeTest(NamedTuple):
+    # -2 rho ln Q per pixel
+    statistic   : npt.NDArray[np.float32]
+    # chi2 survival function of the statistic (None unless asked for)
+    pvalue      : npt.NDArray[np.float32] | None
+    dof         : int
+
+
+class TemporalStats(NamedTuple):
+    mean        : npt.NDArray[np.float32]
+    variance    : npt.NDArray[np.float32]
+
+
+@jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _logdet_cpu(diag: npt.NDArray, upper: npt.NDArray, out: npt.NDArray[np.float64]) -> None:
+    # ln det of the packed 3x3 Hermitian matrices, in float64
+    _, x, y = diag.shape
+    for i in prange(x):
+        for j in range(y):
+            t11 = np.float64(diag[0, i, j])
+            t22 = np.float64(diag[1, i, j])
+            t33 = np.float64(diag[2, i, j])
+            t12 = np.complex128(upper[0, i, j])
+            t13 = np.complex128(upper[1, i, j])
+            t23 = np.complex128(upper[2, i, j])
+            det = (t11 * t22 * t33
+                   + 2 * (t12 * t23 * np.conj(t13)).real
+                   - t11 * abs(t23) ** 2
+                   - t22 * abs(t13) ** 2
+                   - t33 * abs(t12) ** 2)
+            out[i, j] = np.log(max(det, 1e-300))
+
+
+def _rho(k: int, looks: float) -> float:
+    return 1 - (2 * _P ** 2 - 1) / (6 * (k - 1) * _P) * (k / looks - 1 / (looks * k))
+
+
+def _intensity(matrix: HermitianMatrix, channel: str) -> npt.NDArray[np.float64]:
+    if channel == "span":
+        return matrix.diag[0] + matrix.diag[1] + matrix.diag[2]
+    return np.asarray(matrix.diag[CHANNELS.index(channel) - 1], dtype=np.float64)
+
+
+def _test(statistic: npt.NDArray, dof: int, pvalue: bool) -> ChangeTest:
+    statistic = statistic.astype(np.float32)
+    p = stats.chi2.sf(statistic, dof).astype(np.float32) if pvalue else None
+    return ChangeTest(statistic, p, dof)
+
+
+class TimeStack:
+    """
+    Co-registered stack of the T (or C) matrices of several acquisitions.
+
+    Parameters
+    ----------
+    scenes: Mapping[str, SAR]
+        date -> scene (Chandrayaan2.date_map or any dict), the scenes should
+        share the pixel grid (same looks) and are aligned by their offset
+    dates: Sequence[str] | None
+        dates to stack (all of them if None), sorted
+    matrix: str
+        'T' or 'C'
+    tile_rows: int
+        rows of the stack processed at a time
+    """
+    scenes      : Mapping[str, SAR]
+    dates       : List[str]
+    matrix      : str
+    tile_rows   : int
+    # (r1, r2, c1, c2) of the stack in the grid of the full scene
+    extent      : Tuple[int, int, int, int]
+    # complex dtype of the scenes (they should all have the same)
+    dtype       : np.dtype
+
+
+    def __init__(
+            self,
+            scenes: Mapping[str, SAR],
+            dates: Sequence[str] | None = None,
+            matrix: str = "T",
+            tile_rows: int = 1024
+            ) -> None:
+        if matrix not in MATRICES:
+            raise ValueError(f"un-supported matrix: {matrix}. Available matrices: {MATRICES}")
+        if tile_rows < 1:
+            raise ValueError(f"tile_rows should be at least 1 [given -> {tile_rows}]")
+        dates = sorted(scenes) if dates is None else sorted(dates)
+        if len(dates) < 2:
+            raise ValueError(f"a stack needs at least 2 dates [given -> {dates}]")
+        for date in dates:
+            if date not in scenes:
+                raise KeyError(f"no acquisition for date: {date}")
+        self.scenes = scenes
+        self.dates = dates
+        self.matrix = matrix
+        self.tile_rows = tile_rows
+
+        r1, r2, c1, c2 = 0, np.iinfo(np.int64).max, 0, np.iinfo(np.int64).max
+        found: Dict[str, str] = dict()
+        for date in dates:
+            scene = scenes[date]
+            found.setdefault(np.dtype(scene._coeffs.dtype).name, date)
+            _, _, x, y = scene._coeffs.shape
+            r0, c0 = scene.offset
+            r1, r2 = max(r1, r0), min(r2, r0 + x)
+            c1, c2 = max(c1, c0), min(c2, c0 + y)
+        if r1 >= r2 or c1 >= c2:
+            raise ValueError(f"the scenes of {dates} do not overlap")
+        self.extent = (int(r1), int(r2), int(c1), int(c2))
+        if len(found) > 1:
+            raise ValueError(f"the scenes should share their dtype [given -> {found}]")
+        self.dtype = np.dtype(next(iter(found)))
+
+
+    @property
+    def shape(self) -> Tuple[int, int, int, int, int]:
+        r1, r2, c1, c2 = self.extent
+        return (len(self.dates), 3, 3, r2 - r1, c2 - c1)
+
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+    def __repr__(self) -> str:
+        return f"TimeStack(dates={self.dates}, matrix={self.matrix}, shape={self.shape})"
+
+
+    def _tile(self, scene: SAR, r1: int, r2: int, c1: int, c2: int) -> HermitianMatrix:
+        # rows r1:r2, columns c1:c2 of the stack in the packed form
+        r0 = self.extent[0] - scene.offset[0]
+        c0 = self.extent[2] - scene.offset[1]
+        window = (r0 + r1, r0 + r2, c0 + c1, c0 + c2)
+        matrix = scene._T if self.matrix == "T" else scene._C
+        if matrix is not None:
+            return matrix.crop(*window)
+        tile = scene.crop_new(list(window))
+        getattr(tile, f"compute{self.matrix}")()
+        return getattr(tile, self.matrix)
+
+
+    def _walk(self) -> Iterator[Tuple[int, int, int, HermitianMatrix]]:
+        # (date index, start, stop, matrix tile), date by date
+        _, _, _, x, y = self.shape
+        for k, date in enumerate(self.dates):
+            scene = self.scenes[date]
+            for start, stop, _, _ in iter_tiles(x, self.tile_rows):
+                yield k, start, stop, self._tile(scene, start, stop, 0, y)
+
+
+    def read(self, r1: int, r2: int, c1: int, c2: int) -> npt.NDArray:
+        """
+        (dates, 3, 3, r2 - r1, c2 - c1) cube of rows r1:r2 and columns c1:c2
+        of the stack (coordinates relative to the extent).
+        """
+        _, _, _, x, y = self.shape
+        if not (0 <= r1 < r2 <= x and 0 <= c1 < c2 <= y):
+            raise ValueError(f"window out of the stack of shape {(x, y)} [given -> {(r1, r2, c1, c2)}]")
+        out = np.empty([len(self.dates), 3, 3, r2 - r1, c2 - c1], dtype=self.dtype)
+        for k, date in enumerate(self.dates):
+            out[k] = self._tile(self.scenes[date], r1, r2, c1, c2).full()
+        return out
+
+
+    def __array__(self, dtype: npt.DTypeLike | None = None, copy: bool | None = None) -> npt.NDArray:
+        _, _, _, x, y = self.shape
+        full = self.read(0, x, 0, y)
+        if dtype is not None:
+            full = full.astype(dtype, copy=False)
+        return full
+
+
+    def log_ratio(self, pairs: str = "consecutive", channel: str = "span") -> npt.NDArray[np.float32]:
+        """
+        ln(I_b / I_a) of an intensity channel for every pair of dates.
+
+        Parameters
+        ----------
+        pairs: str
+            'consecutive' (date k against k - 1) or 'reference' (date k
+            against the first date)
+        channel: str
+            'span' or a diagonal element: '11', '22', '33'
+
+        Returns
+        -------
+        npt.NDArray[np.float32]
+            (dates - 1, rows, cols)
+        """
+        if pairs not in PAIRS:
+            raise ValueError(f"un-supported pairs: {pairs}. Available pairs: {PAIRS}")
+        if channel not in CHANNELS:
+            raise ValueError(f"un-supported channel: {channel}. Available channels: {CHANNELS}")
+        d, _, _, x, y = self.shape
+        out = np.empty([d - 1, x, y], dtype=np.float32)
+        # ln I of the date compared against
+        base = np.empty([x, y], dtype=np.float32)
+        for k, start, stop, tile in self._walk():
+            log_i = np.log(np.maximum(_intensity(tile, channel), 1e-30))
+            if k > 0:
+                out[k - 1, start:stop] = log_i - base[start:stop]
+            if k == 0 or pairs == "consecutive":
+                base[start:stop] = log_i
+        return out
+
+
+    def omnibus(self, looks: float, pvalue: bool = False) -> ChangeTest:
+        """
+        Omnibus Wishart test that all the dates share the same matrix.
+
+        Parameters
+        ----------
+        looks: float
+            equivalent number of looks of the matrices
+        pvalue: bool
+            also compute the chi2 p-values
+
+        Returns
+        -------
+        ChangeTest
+            (rows, cols) statistic with (dates - 1) 9 degrees of freedom
+        """
+        d, _, _, x, y = self.shape
+        sum_diag = np.zeros([3, x, y], dtype=np.float64)
+        sum_upper = np.zeros([3, x, y], dtype=np.complex128)
+        sum_logdet = np.zeros([x, y], dtype=np.float64)
+        logdet = np.empty([self.tile_rows, y], dtype=np.float64)
+        for _, start, stop, tile in self._walk():
+            sum_diag[:, start:stop] += tile.diag
+            sum_upper[:, start:stop] += tile.upper
+            _logdet_cpu(np.asarray(tile.diag), np.asarray(tile.upper), logdet[:stop - start])
+            sum_logdet[start:stop] += logdet[:stop - start]
+        logdet_sum = np.empty([x, y], dtype=np.float64)
+        _logdet_cpu(sum_diag, sum_upper, logdet_sum)
+        lnq = looks * (_P * d * np.log(d) + sum_logdet - d * logdet_sum)
+        return _test(-2 * _rho(d, looks) * lnq, (d - 1) * _P ** 2, pvalue)
+
+
+    def wishart(self, looks: float, pvalue: bool = False) -> ChangeTest:
+        """
+        Wishart equality test of every pair of consecutive dates.
+
+        Parameters
+        ----------
+        looks: float
+            equivalent number of looks of the matrices
+        pvalue: bool
+            also compute the chi2 p-values
+
+        Returns
+        -------
+        ChangeTest
+            (dates - 1, rows, cols) statistic with 9 degrees of freedom
+        """
+        d, _, _, x, y = self.shape
+        statistic = np.empty([d - 1, x, y], dtype=np.float32)
+        previous = HermitianMatrix.empty(x, y, dtype=self.dtype)
+        previous_logdet = np.empty([x, y], dtype=np.float64)
+        logdet = np.empty([self.tile_rows, y], dtype=np.float64)
+        logdet_sum = np.empty([self.tile_rows, y], dtype=np.float64)
+        rho = _rho(2, looks)
+        for k, start, stop, tile in self._walk():
+            n = stop - start
+            diag, upper = np.asarray(tile.diag), np.asarray(tile.upper)
+            _logdet_cpu(diag, upper, logdet[:n])
+            if k > 0:
+                _logdet_cpu(
+                        previous.diag[:, start:stop] + diag,
+                        previous.upper[:, start:stop] + upper,
+                        logdet_sum[:n]
+                        )
+                lnq = looks * (2 * _P * np.log(2) + previous_logdet[start:stop] + logdet[:n] - 2 * logdet_sum[:n])
+                statistic[k - 1, start:stop] = -2 * rho * lnq
+            previous.diag[:, start:stop] = diag
+            previous.upper[:, start:stop] = upper
+            previous_logdet[start:stop] = logdet[:n]
+        return _test(statistic, _P ** 2, pvalue)
+
+
+    def temporal_stats(self, channel: str = "span", ddof: int = 0) -> TemporalStats:
+        """
+        Per-pixel mean and variance of an intensity channel over the dates
+        (Welford's update, one date at a time).
+
+        Parameters
+        ----------
+        channel: str
+            'span' or a diagonal element: '11', '22', '33'
+        ddof: int
+            delta degrees of freedom of the variance
+        """
+        if channel not in CHANNELS:
+            raise ValueError(f"un-supported channel: {channel}. Available channels: {CHANNELS}")
+        d, _, _, x, y = self.shape
+        if ddof >= d:
+            raise ValueError(f"ddof should be smaller than the number of dates [given -> {ddof}]")
+        mean = np.zeros([x, y], dtype=np.float64)
+        m2 = np.zeros([x, y], dtype=np.float64)
+        for k, start, stop, tile in self._walk():
+            value = _intensity(tile, channel)
+            delta = value - mean[start:stop]
+            mean[start:stop] += delta / (k + 1)
+            m2[start:stop] += delta * (value - mean[start:stop])
+        return TemporalStats(mean.astype(np.float32), (m2 / (d - ddof)).astype(np.float32))
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import numba
+import numpy as np
+import numpy.typing as npt
+from numba import jit, prange
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+from sar import logging
+from sar.sar import SAR
+from sar.tiling import iter_tiles
+
+
+# Streaming statistics of a scene product: moments (count, min, max, mean,
+# variance, Welford) and a histogram in one pass over azimuth blocks, every
+# block is reduced in parallel over chunks of rows and the partial results
+# are merged (Chan et al.). Coefficients are read block by block (memory
+# maps and lazy arrays are not read at once) and matrix elements that are
+# not computed are computed for one block at a time.
+#
+# Without bounds the histogram range follows the data: it starts at the
+# range of the first block and doubles its bin width (merging pairs of bins)
+# whenever a block falls outside, so it stays a single pass. Quantiles are
+# interpolated from the histogram, their error is at most one bin.
+#
+# The kernels are not fastmath, NaN checks would be optimised away.
+
+COEFFICIENTS = {"HH": (0, 0), "HV": (0, 1), "VH": (1, 0), "VV": (1, 1)}
+PRODUCTS = (
+        *COEFFICIENTS, "span",
+        *(f"{matrix}{i}{j}" for matrix in ("T", "C") for i in range(1, 4) for j in range(1, 4))
+        )
+# count, min, max, mean, M2, smallest positive value
+_MOMENTS = 6
+
+
+class Moments(NamedTuple):
+    # of the finite values
+    count       : int
+    minimum     : float
+    maximum     : float
+    mean        : float
+    # population variance
+    variance    : float
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    @property
+    def enl(self) -> float:
+        """
+        Equivalent number of looks mean^2 / variance (of an intensity over a
+        homogeneous area).
+        """
+        return self.mean ** 2 / self.variance if self.variance > 0 else float("inf")
+
+
+class Histogram(NamedTuple):
+    counts      : npt.NDArray[np.int64]
+    # bins + 1 edges (in the units of the product, log spaced with log)
+    edges       : npt.NDArray[np.float64]
+    log         : bool
+
+    def quantile(self, q: float | Sequence[float]) -> float | npt.NDArray[np.float64]:
+        """
+        Approximate quantile(s), linearly interpolated in the bins (in log10
+        with log).
+        """
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if np.any((qs < 0) | (qs > 1)):
+            raise ValueError(f"quantiles should be in [0, 1] [given -> {q}]")
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(qs.shape, np.nan) if np.ndim(q) else float("nan")
+        edges = np.log10(self.edges) if self.log else self.edges
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        values = np.interp(qs * total, cumulative, edges)
+        values = 10 ** values if self.log else values
+        return values if np.ndim(q) else float(values[0])
+
+
+class ProductStats(NamedTuple):
+    product     : str
+    moments     : Moments
+    histogram   : Histogram
+
+    def quantile(self, q: float | Sequence[float]) -> float | npt.NDArray[np.float64]:
+        return self.histogram.quantile(q)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+                'product': self.product,
+                'moments': self.moments._asdict(),
+                'histogram': {
+                    'counts': self.histogram.counts.tolist(),
+                    'edges': self.histogram.edges.tolist(),
+                    'log': self.histogram.log
+                    }
+                }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> ProductStats:
+        histogram = data['histogram']
+        return cls(
+                data['product'],
+                Moments(**data['moments']),
+                Histogram(np.array(histogram['counts'], dtype=np.int64), np.array(histogram['edges']), histogram['log'])
+                )
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _moments_cpu(data: npt.NDArray, out: npt.NDArray[np.float64]) -> None:
+    # moments of the finite values of each chunk of rows
+    x, y = data.shape
+    chunks = out.shape[0]
+    for c in prange(chunks):
+        n = 0
+        low = np.inf
+        high = -np.inf
+        positive = np.inf
+        mean = 0.0
+        m2 = 0.0
+        for i in range(c * x // chunks, (c + 1) * x // chunks):
+            for j in range(y):
+                v = np.float64(data[i, j])
+                if not np.isfinite(v):
+                    continue
+                n += 1
+                delta = v - mean
+                mean += delta / n
+                m2 += delta * (v - mean)
+                low = min(low, v)
+                high = max(high, v)
+                if v > 0:
+                    positive = min(positive, v)
+        out[c, 0] = n
+        out[c, 1] = low
+        out[c, 2] = high
+        out[c, 3] = mean
+        out[c, 4] = m2
+        out[c, 5] = positive
+
+
+@jit(nopython=True, parallel=True, nogil=True, cache=True)
+def _histogram_cpu(data: npt.NDArray, low: float, width: float, log: bool, counts: npt.NDArray[np.int64]) -> None:
+    # counts of each chunk of rows in bins of width from low (in log10 with
+    # log), values outside of the bins are not counted
+    x, y = data.shape
+    chunks, bins = counts.shape
+    for c in prange(chunks):
+        for i in range(c * x // chunks, (c + 1) * x // chunks):
+            for j in range(y):
+                v = np.float64(data[i, j])
+                if log:
+                    if not v > 0:
+                        continue
+                    v = np.log10(v)
+                if not np.isfinite(v):
+                    continue
+                k = int(np.floor((v - low) / width))
+                if 0 <= k < bins:
+                    counts[c, k] += 1
+
+
+def _merge(parts: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    # (n, 6) partial moments -> (6,)
+    parts = parts[parts[:, 0] > 0]
+    if len(parts) == 0:
+        return np.array([0, np.nan, np.nan, np.nan, np.nan, np.inf])
+    n = parts[:, 0].sum()
+    mean = (parts[:, 0] * parts[:, 3]).sum() / n
+    m2 = (parts[:, 4] + parts[:, 0] * (parts[:, 3] - mean) ** 2).sum()
+    return np.array([n, parts[:, 1].min(), parts[:, 2].max(), mean, m2, parts[:, 5].min()])
+
+
+class _StreamingHistogram:
+    # bins (even) of width from low, widened by merging pairs of bins when
+    # a block does not fit (unless fixed)
+    def __init__(self, bins: int, log: bool, bounds: Tuple[float, float] | None) -> None:
+        if bins < 2 or bins % 2:
+            raise ValueError(f"bins should be an even number of at least 2 [given -> {bins}]")
+        self.bins = bins
+        self.log = log
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.low: float | None = None
+        self.width = 0.0
+        self.fixed = bounds is not None
+        if bounds is not None:
+            low, high = np.log10(bounds) if log else bounds
+            if not high > low:
+                raise ValueError(f"bounds should be increasing (and positive with log) [given -> {bounds}]")
+            self.low = float(low)
+            self.width = (high - low) / bins
+
+    @property
+    def high(self) -> float:
+        return self.low + self.bins * self.width
+
+    def _fit(self, low: float, high: float) -> None:
+        if self.low is None:
+            self.low = low
+            # the maximum falls in the last bin
+            self.width = (high - low) / (self.bins - 1) if high > low else max(abs(low), 1.0) * 1e-6
+            return
+        half = self.bins // 2
+        while low < self.low:
+            self.counts[half:] = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts[:half] = 0
+            self.low = self.high - 2 * self.bins * self.width
+            self.width *= 2
+        while high >= self.high:
+            self.counts[:half] = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts[half:] = 0
+            self.width *= 2
+
+    def add(self, data: npt.NDArray, moments: npt.NDArray[np.float64], chunks: int) -> None:
+        if moments[0] == 0:
+            return
+        if not self.fixed:
+            if self.log:
+                if not np.isfinite(moments[5]):
+                    return
+                self._fit(float(np.log10(moments[5])), float(np.log10(moments[2])))
+            else:
+                self._fit(float(moments[1]), float(moments[2]))
+        counts = np.zeros((chunks, self.bins), dtype=np.int64)
+        _histogram_cpu(data, self.low, self.width, self.log, counts)
+        self.counts += counts.sum(axis=0)
+
+    def histogram(self) -> Histogram:
+        if self.low is None:
+            return Histogram(self.counts, np.full(self.bins + 1, np.nan), self.log)
+        edges = self.low + self.width * np.arange(self.bins + 1)
+        return Histogram(self.counts, 10 ** edges if self.log else edges, self.log)
+
+
+def _block(sar_img: SAR, product: str) -> npt.NDArray:
+    # real plane of product for a block (amplitude of the coefficients,
+    # magnitude of the off-diagonal elements)
+    if product in COEFFICIENTS:
+        i, j = COEFFICIENTS[product]
+        return np.abs(np.asarray(sar_img._coeffs[i, j]))
+    if product == "span":
+        return np.asarray(sar_img.span)
+    plane = sar_img.element(product[0], int(product[1]) - 1, int(product[2]) - 1)
+    return np.abs(plane) if np.iscomplexobj(plane) else np.asarray(plane)
+
+
+def compute(
+        sar_img: SAR,
+        product: str = "span",
+        bins: int = 4096,
+        log: bool = False,
+        bounds: Tuple[float, float] | None = None,
+        tile_rows: int = 1024
+        ) -> ProductStats:
+    """
+    Statistics of product over sar_img in one pass (see SAR.stats).
+    """
+    if product not in PRODUCTS:
+        raise ValueError(f"un-supported product: {product}. Available products: {PRODUCTS}")
+    histogram = _StreamingHistogram(bins, log, bounds)
+    _, _, x, y = sar_img._coeffs.shape
+    chunks = max(1, min(tile_rows, 4 * numba.get_num_threads()))
+    parts: List[npt.NDArray[np.float64]] = list()
+    with logging.span(f"stats:{product}", pixels=x * y):
+        for tile in iter_tiles(x, tile_rows):
+            data = _block(sar_img.crop_new((tile.start, tile.stop, 0, y)), product)
+            out = np.empty((min(chunks, data.shape[0]), _MOMENTS), dtype=np.float64)
+            _moments_cpu(data, out)
+            moments = _merge(out)
+            histogram.add(data, moments, out.shape[0])
+            parts.append(moments)
+    n, low, high, mean, m2, _ = _merge(np.array(parts).reshape(-1, _MOMENTS))
+    return ProductStats(
+            product,
+            Moments(int(n), float(low), float(high), float(mean), float(m2 / n) if n > 0 else float("nan")),
+            histogram.histogram()
+            )
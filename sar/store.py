@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import os
+import json
+import lzma
+import zlib
+import shutil
+import threading
+import numpy as np
+import numpy.typing as npt
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Tuple
+from pathlib import Path
+
+try:
+    import zstandard
+    __zstd_import__ = True
+except ImportError:
+    __zstd_import__ = False
+
+
+MMAP_MODES = (None, "r", "r+", "c")
+FORMATS = ("npy", "chunked")
+COMPRESSORS = ("none", "zlib", "lzma", "zstd")
+
+
+def save_array(path: Path, array: npt.NDArray) -> None:
+    # write next to the target and swap it in, so a scene memory mapped from
+    # path keeps reading the old (still valid) file while it is being replaced
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open('wb') as array_file:
+        np.save(array_file, array)
+    os.replace(tmp_path, path)
+
+
+def load_array(path: Path, mmap_mode: str | None = None) -> npt.NDArray:
+    if mmap_mode not in MMAP_MODES:
+        raise ValueError(f"mmap_mode: {mmap_mode} is not valid (should be one of {MMAP_MODES})")
+    if mmap_mode is None:
+        with path.open('rb') as array_file:
+            return np.load(array_file)
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+# Chunked store (one directory per array, Zarr like): the last two axes
+# (azimuth, range) are split into chunks, every chunk holds all the leading
+# axes and is written to its own file "{i}.{j}", optionally byte shuffled
+# (the k-th byte of every item stored together, which makes float data much
+# more compressible) and compressed. meta.json keeps the array description
+# and per chunk metadata (raw / stored size and crc32 of the stored bytes).
+
+
+def _compress(raw: bytes, compressor: str, level: int | None) -> bytes:
+    if compressor == "zlib":
+        return zlib.compress(raw, 6 if level is None else level)
+    if compressor == "lzma":
+        return lzma.compress(raw, preset=6 if level is None else level)
+    if compressor == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(raw)
+    return raw
+
+
+def _decompress(stored: bytes, compressor: str) -> bytes:
+    if compressor == "zlib":
+        return zlib.decompress(stored)
+    if compressor == "lzma":
+        return lzma.decompress(stored)
+    if compressor == "zstd":
+        return zstandard.ZstdDecompressor().decompress(stored)
+    return stored
+
+
+def _check_compressor(compressor: str) -> None:
+    if compressor not in COMPRESSORS:
+        raise ValueError(f"un-supported compressor: {compressor}. Available compressors: {COMPRESSORS}")
+    if compressor == "zstd" and not __zstd_import__:
+        raise ImportError(f"Issue importing zstandard for zstd compression")
+
+
+def _chunk_ranges(size: int, chunk: int) -> Iterator[Tuple[int, int]]:
+    for start in range(0, size, chunk):
+        yield start, min(start + chunk, size)
+
+
+def save_chunked(
+        path: Path,
+        array: npt.NDArray,
+        chunks: Tuple[int, int] = (512, 512),
+        compressor: str = "zlib",
+        level: int | None = None,
+        shuffle: bool = True
+        ) -> None:
+    """
+    Writes array (..., x, y) to the directory path in the chunked format.
+
+    Parameters
+    ----------
+    path: Path
+        directory of the array, replaced if it exists
+    array: npt.NDArray
+        any array like with a shape (ChunkedArray and memory maps are read
+        chunk by chunk)
+    chunks: Tuple[int, int]
+        (azimuth, range) size of the chunks
+    compressor: str
+        one of COMPRESSORS ('zstd' needs the zstandard package)
+    level: int | None
+        compression level (compressor default if None)
+    shuffle: bool
+        byte shuffle the chunks before compressing
+    """
+    _check_compressor(compressor)
+    if len(array.shape) < 2:
+        raise ValueError(f"the array should have at least 2 dimensions [given shape -> {array.shape}]")
+    rows, cols = int(chunks[0]), int(chunks[1])
+    if rows < 1 or cols < 1:
+        raise ValueError(f"chunks should be positive [given -> {chunks}]")
+
+    dtype = np.dtype(array.dtype)
+    *_, x, y = array.shape
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    info: Dict[str, Dict[str, int]] = dict()
+    for i, (r1, r2) in enumerate(_chunk_ranges(x, rows)):
+        for j, (c1, c2) in enumerate(_chunk_ranges(y, cols)):
+            block = np.ascontiguousarray(array[..., r1:r2, c1:c2], dtype=dtype)
+            raw = block.tobytes()
+            if shuffle and dtype.itemsize > 1:
+                raw = np.frombuffer(raw, dtype=np.uint8).reshape(-1, dtype.itemsize).T.tobytes()
+            stored = _compress(raw, compressor, level)
+            (tmp_path / f"{i}.{j}").write_bytes(stored)
+            info[f"{i}.{j}"] = {'nbytes': len(raw), 'stored': len(stored), 'crc32': zlib.crc32(stored)}
+
+    meta = {
+            'shape': list(array.shape),
+            'dtype': dtype.str,
+            'chunks': [rows, cols],
+            'compressor': compressor,
+            'level': level,
+            'shuffle': shuffle,
+            'chunk_info': info
+            }
+    with (tmp_path / "meta.json").open('w') as meta_file:
+        json.dump(meta, meta_file, indent=4)
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def is_chunked(path: Path) -> bool:
+    return (path / "meta.json").is_file()
+
+
+class _ChunkReader:
+    # chunk files of one array directory with a small LRU of decoded chunks,
+    # shared by all the views of the array
+    path        : Path
+    meta        : Dict[str, Any]
+    cache_size  : int
+
+    def __init__(self, path: Path, cache_size: int = 16) -> None:
+        with (path / "meta.json").open('r') as meta_file:
+            self.meta = json.load(meta_file)
+        _check_compressor(self.meta['compressor'])
+        self.path = path
+        self.cache_size = cache_size
+        self._cache: OrderedDict[Tuple[int, int], npt.NDArray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def chunk(self, i: int, j: int) -> npt.NDArray:
+        with self._lock:
+            if (i, j) in self._cache:
+                self._cache.move_to_end((i, j))
+                return self._cache[(i, j)]
+        stored = (self.path / f"{i}.{j}").read_bytes()
+        if zlib.crc32(stored) != self.meta['chunk_info'][f"{i}.{j}"]['crc32']:
+            raise IOError(f"chunk {i}.{j} of {self.path} is corrupted (crc32 mismatch)")
+        raw = _decompress(stored, self.meta['compressor'])
+        dtype = np.dtype(self.meta['dtype'])
+        *lead, x, y = self.meta['shape']
+        rows, cols = self.meta['chunks']
+        shape = (*lead, min(rows, x - i * rows), min(cols, y - j * cols))
+        if self.meta['shuffle'] and dtype.itemsize > 1:
+            data = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.copy().view(dtype)
+        else:
+            data = np.frombuffer(raw, dtype=dtype)
+        data = data.reshape(shape)
+        with self._lock:
+            self._cache[(i, j)] = data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+
+class ChunkedArray:
+    """
+    Read-only, lazily loaded array stored with save_chunked.
+
+    Slicing the last two axes with unit steps (e.g. the crops of
+    SAR.crop_new / HermitianMatrix.crop) gives a new view without reading
+    anything, every other indexing and np.asarray read (and decompress) only
+    the chunks the result overlaps.
+    """
+    shape   : Tuple[int, ...]
+    dtype   : np.dtype
+    # window of the view in the stored array
+    rows    : Tuple[int, int]
+    cols    : Tuple[int, int]
+
+
+    def __init__(self, path: Path | _ChunkReader, rows: Tuple[int, int] | None = None, cols: Tuple[int, int] | None = None) -> None:
+        self._reader = path if isinstance(path, _ChunkReader) else _ChunkReader(path)
+        meta = self._reader.meta
+        *lead, x, y = meta['shape']
+        self.rows = rows if rows is not None else (0, x)
+        self.cols = cols if cols is not None else (0, y)
+        self.shape = (*lead, self.rows[1] - self.rows[0], self.cols[1] - self.cols[0])
+        self.dtype = np.dtype(meta['dtype'])
+
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+
+    @property
+    def chunks(self) -> Tuple[int, int]:
+        rows, cols = self._reader.meta['chunks']
+        return (rows, cols)
+
+
+    @property
+    def real(self) -> npt.NDArray:
+        return np.asarray(self).real
+
+
+    @property
+    def imag(self) -> npt.NDArray:
+        return np.asarray(self).imag
+
+
+    def read(self, r1: int, r2: int, c1: int, c2: int) -> npt.NDArray:
+        """
+        Rows r1:r2 and columns c1:c2 of the view (clipped to it) as an array.
+        """
+        r1, r2 = max(r1, 0), min(r2, self.shape[-2])
+        c1, c2 = max(c1, 0), min(c2, self.shape[-1])
+        out = np.empty([*self.shape[:-2], max(r2 - r1, 0), max(c2 - c1, 0)], dtype=self.dtype)
+        if r2 <= r1 or c2 <= c1:
+            return out
+        rows, cols = self.chunks
+        r1, r2 = r1 + self.rows[0], r2 + self.rows[0]
+        c1, c2 = c1 + self.cols[0], c2 + self.cols[0]
+        for i in range(r1 // rows, (r2 - 1) // rows + 1):
+            for j in range(c1 // cols, (c2 - 1) // cols + 1):
+                chunk = self._reader.chunk(i, j)
+                a1, a2 = max(r1, i * rows), min(r2, (i + 1) * rows)
+                b1, b2 = max(c1, j * cols), min(c2, (j + 1) * cols)
+                out[..., a1 - r1:a2 - r1, b1 - c1:b2 - c1] = chunk[..., a1 - i * rows:a2 - i * rows, b1 - j * cols:b2 - j * cols]
+        return out
+
+
+    def __getitem__(self, key: Any) -> npt.NDArray | ChunkedArray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            at = key.index(Ellipsis)
+            key = key[:at] + (slice(None),) * (self.ndim - len(key) + 1) + key[at + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) != self.ndim or not all(isinstance(k, (slice, int, np.integer)) for k in key):
+            return np.asarray(self)[key]
+
+        lead, row_key, col_key = key[:-2], key[-2], key[-1]
+        windows = []
+        for k, size in ((row_key, self.shape[-2]), (col_key, self.shape[-1])):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step != 1:
+                    return np.asarray(self)[key]
+                windows.append((start, max(start, stop)))
+            else:
+                k = int(k) + size if k < 0 else int(k)
+                if not 0 <= k < size:
+                    raise IndexError(f"index {k} is out of bounds for axis with size {size}")
+                windows.append((k, k + 1))
+        (r1, r2), (c1, c2) = windows
+
+        if all(k == slice(None) for k in lead) and isinstance(row_key, slice) and isinstance(col_key, slice):
+            return ChunkedArray(
+                    self._reader,
+                    (self.rows[0] + r1, self.rows[0] + r2),
+                    (self.cols[0] + c1, self.cols[0] + c2)
+                    )
+        out = self.read(r1, r2, c1, c2)
+        return out[(*lead, 0 if not isinstance(row_key, slice) else slice(None), 0 if not isinstance(col_key, slice) else slice(None))]
+
+
+    def __array__(self, dtype: npt.DTypeLike | None = None, copy: bool | None = None) -> npt.NDArray:
+        out = self.read(0, self.shape[-2], 0, self.shape[-1])
+        if dtype is not None:
+            out = out.astype(dtype, copy=False)
+        return out
+
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+
+    def __repr__(self) -> str:
+        return f"ChunkedArray({self._reader.path}, shape={self.shape}, dtype={self.dtype}, chunks={self.chunks})"
+
+
+def open_chunked(path: Path) -> ChunkedArray:
+    if not is_chunked(path):
+        raise FileNotFoundError(f"no chunked array found at: {path}")
+    return ChunkedArray(path)
+
+
+def write_array(path: Path, name: str, array: npt.NDArray, format: str = "npy", **options: Any) -> None:
+    """
+    Writes array as {name}.npy or as the chunked directory {name} (options go
+    to save_chunked), the other representation is removed.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"un-supported format: {format}. Available formats: {FORMATS}")
+    if format == "chunked":
+        save_chunked(path / name, array, **options)
+        stale = path / f"{name}.npy"
+        if stale.is_file():
+            stale.unlink()
+    else:
+        save_array(path / f"{name}.npy", np.asarray(array))
+        if is_chunked(path / name):
+            shutil.rmtree(path / name)
+
+
+def read_array(path: Path, name: str, mmap_mode: str | None = None) -> npt.NDArray | ChunkedArray:
+    """
+    {name} of a directory written by write_array, chunked arrays are always
+    opened lazily (mmap_mode only applies to .npy files).
+    """
+    if is_chunked(path / name):
+        return open_chunked(path / name)
+    return load_array(path / f"{name}.npy", mmap_mode)
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import json
+import numpy as np
+import numpy.typing as npt
+
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Protocol, Sequence, Tuple, TYPE_CHECKING
+from pathlib import Path
+
+from sar import dtypes
+from sar.sar import SAR
+
+if TYPE_CHECKING:
+    from sar.cache import Step
+
+
+class Tile(NamedTuple):
+    # rows of the scene owned by the tile
+    start       : int
+    stop        : int
+    # rows actually read (start / stop extended by the overlap)
+    read_start  : int
+    read_stop   : int
+
+
+def iter_tiles(rows: int, tile_rows: int, overlap: int = 0) -> Iterator[Tile]:
+    """
+    Splits rows [0, rows) into azimuth blocks of tile_rows, each extended by
+    overlap rows on both sides (clipped to the scene).
+    """
+    if tile_rows < 1:
+        raise ValueError(f"tile_rows should be at least 1 [given -> {tile_rows}]")
+    if overlap < 0:
+        raise ValueError(f"overlap can not be negative [given -> {overlap}]")
+    for start in range(0, rows, tile_rows):
+        stop = min(start + tile_rows, rows)
+        yield Tile(start, stop, max(0, start - overlap), min(rows, stop + overlap))
+
+
+class TileSource(Protocol):
+    """
+    Anything a scene can be read from block by block.
+    """
+    @property
+    def shape(self) -> Tuple[int, int]: ...
+
+    def read(self, r1: int, r2: int) -> SAR: ...
+
+
+class SARSource:
+    """
+    TileSource over an existing SAR (in memory or memory mapped, see
+    SAR.load(..., mmap_mode='r')), blocks are zero-copy crops.
+    """
+    sar_img : SAR
+
+    def __init__(self, sar_img: SAR) -> None:
+        self.sar_img = sar_img
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        _, _, x, y = self.sar_img._coeffs.shape
+        return (x, y)
+
+    def read(self, r1: int, r2: int) -> SAR:
+        return self.sar_img.crop_new((r1, r2, 0, self.shape[1]))
+
+
+class Operation:
+    """
+    One step of a tiled pipeline.
+
+    Parameters
+    ----------
+    name: str
+    func: Callable[[SAR], SAR]
+        applied to every block, it should only depend on rows within halo of
+        the output row it produces
+    halo: int
+        rows of context needed on each side (in the rows the step sees)
+    looks: Tuple[int, int]
+        (azimuth, range) reduction applied by the step
+    """
+    name    : str
+    func    : Callable[[SAR], SAR]
+    halo    : int
+    looks   : Tuple[int, int]
+
+    def __init__(self, name: str, func: Callable[[SAR], SAR], halo: int = 0, looks: Tuple[int, int] = (1, 1)) -> None:
+        self.name = name
+        self.func = func
+        self.halo = int(halo)
+        self.looks = (int(looks[0]), int(looks[1]))
+
+    def __call__(self, sar_img: SAR) -> SAR:
+        return self.func(sar_img)
+
+    def __repr__(self) -> str:
+        return f"Operation({self.name}, halo={self.halo}, looks={self.looks})"
+
+
+def _compute(method: str) -> Callable[[SAR], SAR]:
+    def func(sar_img: SAR) -> SAR:
+        getattr(sar_img, method)()
+        return sar_img
+    return func
+
+
+def calibrate(
+        constant: float | Sequence[float] = 10000,
+        incidence: float | npt.NDArray | None = None,
+        output: str = "beta0"
+        ) -> Operation:
+    """
+    SAR.calibrate of every block. A per column (y,) or per pixel (x, y)
+    incidence covers the grid of the full scene (see SAR.offset), the rows
+    and columns of each block are sliced from it.
+    """
+    angles = None if incidence is None else np.asarray(incidence)
+    digest: List[str] = list()
+
+    def func(sar_img: SAR) -> SAR:
+        if sar_img.calibrated:
+            return sar_img
+        block = angles
+        if block is not None and block.ndim > 0:
+            _, _, x, y = sar_img._coeffs.shape
+            r, c = sar_img.offset
+            block = block[..., c:c + y] if block.ndim == 1 else block[r:r + x, c:c + y]
+            if block.shape[-1] != y or block.ndim == 2 and block.shape[0] != x:
+                raise ValueError(f"incidence of shape {angles.shape} does not cover the block at {(r, c)} of shape {(x, y)}")
+        sar_img.calibrate(constant, incidence=block, output=output)
+        if block is not None and block.ndim > 0 and output != "beta0":
+            # the step records the incidence of the whole scene, as
+            # SAR.calibrate of the scene does, not the one of the block
+            if not digest:
+                from sar.cache import hash_array
+                digest.append(hash_array(np.atleast_2d(angles)))
+            name, params = sar_img.lineage[-1]
+            sar_img.lineage = sar_img.lineage[:-1] + ((name, {**params, 'incidence': digest[0]}),)
+        return sar_img
+    return Operation(f"calibrate({output})", func)
+
+
+def compute_t() -> Operation:
+    return Operation("computeT", _compute("computeT"))
+
+
+def compute_c() -> Operation:
+    return Operation("computeC", _compute("computeC"))
+
+
+def compute_tc() -> Operation:
+    return Operation("computeTC", _compute("computeTC"))
+
+
+def multilook_azimuth(nmls: int, method: str = 'mean') -> Operation:
+    return multilook((nmls, 1), method=method)
+
+
+def multilook(looks: Tuple[int, int], method: str = 'mean') -> Operation:
+    return Operation(
+            f"multilook({looks[0]}x{looks[1]}, {method})",
+            lambda sar_img: sar_img.multilook(looks, method=method),
+            looks=looks
+            )
+
+
+def speckle_filter(method: str = "refined_lee", win: int = 7, looks: float = 1, damping: float = 1.0) -> Operation:
+    return Operation(
+            f"speckle_filter({method}, {win})",
+            lambda sar_img: sar_img.speckle_filter(method=method, win=win, looks=looks, damping=damping),
+            halo=win // 2
+            )
+
+
+class TiledWriter:
+    """
+    Writes blocks of a scene into the layout of SAR.save (coeffs.npy and the
+    packed T / C planes) through memory mapped .npy files, the arrays are
+    created from the first block written. source and lineage are the
+    provenance of the whole product (see SAR.lineage), its offset is the one
+    of the block written at row 0.
+    """
+    path        : Path
+    rows        : int
+    arrays      : Dict[str, npt.NDArray]
+    calibrated  : bool
+    offset      : Tuple[int, int]
+    source      : str | None
+    lineage     : Tuple[Step, ...]
+
+    def __init__(self, path: Path, rows: int, source: str | None = None, lineage: Sequence[Step] = ()) -> None:
+        self.path = path
+        self.rows = rows
+        self.arrays = dict()
+        self.calibrated = False
+        self.offset = (0, 0)
+        self.source = source
+        self.lineage = tuple(lineage)
+
+    def _planes(self, sar_img: SAR) -> Dict[str, npt.NDArray]:
+        planes = {'coeffs': sar_img._coeffs}
+        for name, matrix in (('t_mat', sar_img._T), ('c_mat', sar_img._C)):
+            if matrix is not None:
+                planes[f"{name}_diag"] = matrix.diag
+                planes[f"{name}_upper"] = matrix.upper
+        return planes
+
+    def write(self, sar_img: SAR, r1: int) -> None:
+        planes = self._planes(sar_img)
+        if not self.arrays:
+            if not self.path.is_dir():
+                self.path.mkdir(parents=True)
+            for name, plane in planes.items():
+                self.arrays[name] = np.lib.format.open_memmap(
+                        self.path / f"{name}.npy",
+                        mode='w+',
+                        dtype=plane.dtype,
+                        shape=(*plane.shape[:-2], self.rows, plane.shape[-1])
+                        )
+            self.calibrated = sar_img.calibrated
+        if planes.keys() != self.arrays.keys():
+            raise ValueError(f"blocks do not produce the same products: {list(planes)} != {list(self.arrays)}")
+        if r1 == 0:
+            self.offset = sar_img.offset
+        for name, plane in planes.items():
+            self.arrays[name][..., r1:r1 + plane.shape[-2], :] = plane
+
+    def close(self) -> None:
+        for array in self.arrays.values():
+            array.flush()
+        config: Dict[str, Any] = {
+                'calibrated': self.calibrated,
+                'config': True,
+                'coeffs': True,
+                't_mat': 't_mat_diag' in self.arrays,
+                'c_mat': 'c_mat_diag' in self.arrays,
+                'layout': 'packed',
+                'dtype': self.arrays['coeffs'].dtype.name if 'coeffs' in self.arrays else dtypes.get_dtype().name,
+                'offset': list(self.offset),
+                'source': self.source,
+                'lineage': [list(step) for step in self.lineage]
+                }
+        with (self.path / "config.json").open('w') as config_file:
+            json.dump(config, config_file, indent=4)
+        self.arrays = dict()
+
+
+class TiledProcessor:
+    """
+    Runs a chain of operations over a scene in azimuth blocks, so that the
+    peak memory depends on tile_rows and not on the scene size.
+
+    Every block is read with enough overlap for the halos of the operations,
+    pushed through the chain and only its own rows are written to the output
+    directory (readable with SAR.load, ideally with mmap_mode='r').
+
+    Parameters
+    ----------
+    operations: Sequence[Operation]
+    tile_rows: int
+        rows of the source per block, rounded down to a multiple of the total
+        azimuth looks of the chain
+    overlap: int
+        minimum overlap in source rows, raised to what the chain needs
+    """
+    operations  : List[Operation]
+    tile_rows   : int
+    overlap     : int
+
+    def __init__(self, operations: Sequence[Operation], tile_rows: int = 4096, overlap: int = 0) -> None:
+        self.operations = list(operations)
+        looks = self.looks[0]
+        if tile_rows < looks:
+            raise ValueError(f"tile_rows ({tile_rows}) should be at least the total azimuth looks ({looks})")
+        self.tile_rows = (tile_rows // looks) * looks
+        halo = max(int(overlap), self.halo)
+        self.overlap = -(-halo // looks) * looks
+
+    @property
+    def looks(self) -> Tuple[int, int]:
+        azimuth, rng = 1, 1
+        for operation in self.operations:
+            azimuth *= operation.looks[0]
+            rng *= operation.looks[1]
+        return (azimuth, rng)
+
+    @property
+    def halo(self) -> int:
+        # overlap in source rows needed by the whole chain
+        halo, looks = 0, 1
+        for operation in self.operations:
+            halo += operation.halo * looks
+            looks *= operation.looks[0]
+        return halo
+
+    def process(self, sar_img: SAR) -> SAR:
+        for operation in self.operations:
+            sar_img = operation(sar_img)
+        return sar_img
+
+    def run(self, source: TileSource | SAR, path: Path) -> None:
+        if isinstance(source, SAR):
+            source = SARSource(source)
+        rows, _ = source.shape
+        looks = self.looks[0]
+        # provenance of the product: the one of the scene and the steps the
+        # chain adds. An unsourced scene is only hashed (a full pass over
+        # its coefficients) when it has a cache the key is needed for.
+        scene = source.sar_img if isinstance(source, SARSource) else None
+        fingerprint = None
+        if scene is not None and (scene.source is not None or scene.cache is not None):
+            fingerprint = scene.fingerprint()
+        writer = TiledWriter(
+                path, rows // looks,
+                source=fingerprint,
+                lineage=scene.lineage if scene is not None else ()
+                )
+        for tile in iter_tiles(rows, self.tile_rows, self.overlap):
+            out_rows = (tile.stop - tile.start) // looks
+            if out_rows == 0:
+                continue
+            read = source.read(tile.read_start, tile.read_stop)
+            # steps can modify the block in place (calibrate)
+            steps = len(read.lineage)
+            block = self.process(read)
+            if tile.start == 0:
+                writer.lineage += block.lineage[steps:]
+            skip = (tile.start - tile.read_start) // looks
+            writer.write(block.crop_new((skip, skip + out_rows, 0, block._coeffs.shape[-1])), tile.start // looks)
+        writer.close()
@@ -1,6 +1,8 @@
 import numba_func
 import warnings
 
+from sar import dtypes
+
 import numpy as np
 import numpy.typing as npt
 
@@ -24,11 +26,11 @@ class SARImage:
 
 
     def __post_init__(self) -> None:
-        if self.T or self.C:
+        if self.T is not None or self.C is not None:
             self.calibrated = True
-            if not self.T:
+            if self.T is None:
                 self.computeT(device=self.device)
-            elif not self.C:
+            elif self.C is None:
                 self.computeC(device=self.device)
         elif self.calibrated:
             warnings.warn("T and C matrix are not computed but 'calibrated' True was provided", category=Warning)
@@ -44,8 +46,7 @@ class SARImage:
 
 
     def __make_complex__(self, img: npt.NDArray) -> npt.NDArray:
-        img = img[0, :, :] + 1j * img[1, :, :]
-        return img
+        return dtypes.complex_from_planes(img[0, :, :], img[1, :, :])
 
 
     def computeC(self, device: str | None = None) -> npt.NDArray:
@@ -93,16 +94,11 @@ class SARImage:
         uncal_coeffs = np.array([self.HH, self.HV, self.VH, self.VV])
         for coeff in uncal_coeffs:
             if len(coeff.shape) == 2:
-                cal_coeff = coeff / calibration
+                cal_coeff = (coeff / calibration).astype(dtypes.get_dtype(), copy=False)
             else:
                 coeff_real, coeff_im = coeff / calibration
-                coeff_im = 1j * coeff_im 
-                if np.can_cast(coeff_real.dtype, coeff_im.dtype):
-                    cal_coeff = np.add(coeff_real, coeff_im, casting="safe")
-                else:
-                    raise Exception("np.can_cast for coeff_real and coeff_im is not safe")
+                cal_coeff = dtypes.complex_from_planes(coeff_real, coeff_im)
             cal_coeff_list.append(cal_coeff)
-            coeff = coeff.astype(np.complex64)
         self.HH, self.HV, self.VH, self.VV = cal_coeff_list
         self.calibrated = True
 
@@ -110,7 +106,7 @@ class SARImage:
     def copy(self: SARImageType) -> SARImageType:
         return SARImage(self.HH, self.HV, self.VH, self.VV, 
                 calibrated=True, T=self.T, 
-                C=self.T, device=self.device)
+                C=self.C, device=self.device)
 
 
     def crop_new(self: SARImageType, margins: List[int]) -> SARImageType:
@@ -125,6 +121,9 @@ class SARImage:
                 margins=(r1, r2, c1, c2) is a valid input
                 r1, r2 being rows and c1, c2 being columns
 
+        The crop holds views of the planes (and of T / C if computed), nothing
+        is copied or computed again.
+
         Returns
         -------
         SARImage
@@ -134,11 +133,16 @@ class SARImage:
             r1, r2, c1, c2 = margins
             coeffs: List[npt.NDArray] = list()
             for coeff in (self.HH, self.HV, self.VH, self.VV):
-                coeffs.append(coeff[r1:r2 + 1, c1:c2 + 1])
-            if self.T or self.C:
-                raise Warning(f"If T of C matrices were computed for this SARImage they need to computed again from the return object")
+                coeffs.append(coeff[..., r1:r2 + 1, c1:c2 + 1])
+            T = self.T[..., r1:r2 + 1, c1:c2 + 1] if self.T is not None else None
+            C = self.C[..., r1:r2 + 1, c1:c2 + 1] if self.C is not None else None
+            if (T is None) != (C is None):
+                # __post_init__ would compute the missing matrix on the crop
+                T = C = None
             return SARImage(
                     *coeffs,
+                    T=T,
+                    C=C,
                     calibrated=self.calibrated,
                     device=self.device
                     )
@@ -1,9 +1,23 @@
+import sys
+import json
+import pickle
+import tempfile
+import subprocess
 import unittest
 from unittest import TestCase
 from pathlib import Path
 
+import numpy as np
+
+import batch
 from dir import Dir
-from main import get_chandrayaan2Obj, get_dirs
+from manage import get_chandrayaan2Obj, get_dirs
+from sar import SAR, HermitianMatrix
+from sar.models import LazyDateMap
+from sar.stack import TimeStack
+from sar.cache import ProductCache
+from sar import tiling, filters, dtypes
+from sar import logging as log
 
 
 BASE_PATH = Path(__file__).resolve().parent
@@ -94,6 +108,634 @@ class TestMain(TestCase):
                 get_chandrayaan2Obj()
 
 
+class LazyDateMapTest(TestCase):
+
+    def setUp(self) -> None:
+        self.calls = list()
+        def factory(path: Path, local_path: Path) -> Path:
+            self.calls.append(path)
+            return local_path
+        self.date_map = LazyDateMap(
+                {date: BASE_PATH / date for date in ('20210312', '20210401', '20210505')},
+                BASE_PATH / ".local",
+                factory=factory,
+                max_loaded=2
+                )
+
+    def test_lazy(self) -> None:
+        self.assertEqual(len(self.date_map), 3)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.date_map['20210312'], BASE_PATH / ".local" / "20210312")
+        self.date_map['20210312']
+        self.assertEqual(self.calls, [BASE_PATH / '20210312'])
+
+    def test_eviction(self) -> None:
+        for date in ('20210312', '20210401', '20210312', '20210505'):
+            self.date_map[date]
+        self.assertEqual(self.date_map.loaded, ['20210312', '20210505'])
+        self.date_map.unload('20210312')
+        self.assertFalse(self.date_map.is_loaded('20210312'))
+        with self.assertRaises(KeyError):
+            self.date_map['19700101']
+
+
+def random_coeffs(x: int = 64, y: int = 48, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    coeffs = (rng.standard_normal((2, 2, x, y)) + 1j * rng.standard_normal((2, 2, x, y))).astype(np.complex64)
+    coeffs[1, 0] = coeffs[0, 1]
+    return coeffs
+
+
+class SARComputeTest(TestCase):
+
+    def setUp(self) -> None:
+        self.coeffs = random_coeffs()
+        hh, hv, vv = self.coeffs[0, 0], self.coeffs[0, 1], self.coeffs[1, 1]
+        pauli = np.array([hh + vv, hh - vv, 2 * hv]) / np.sqrt(2)
+        lexico = np.array([hh, np.sqrt(2) * hv, vv])
+        self.T = np.einsum('iab,jab->ijab', pauli, pauli.conj())
+        self.C = np.einsum('iab,jab->ijab', lexico, lexico.conj())
+
+    def test_computeT(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeT()
+        np.testing.assert_allclose(np.asarray(sar_img.T), self.T, atol=1e-5)
+
+    def test_computeC(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeC()
+        np.testing.assert_allclose(np.asarray(sar_img.C), self.C, atol=1e-5)
+
+    def test_computeTC(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeTC()
+        np.testing.assert_allclose(np.asarray(sar_img.T), self.T, atol=1e-5)
+        np.testing.assert_allclose(np.asarray(sar_img.C), self.C, atol=1e-5)
+
+    def test_packed_elements(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeT()
+        self.assertEqual(sar_img.T.diag.dtype, np.float32)
+        np.testing.assert_allclose(sar_img.T22, self.T[1, 1].real, atol=1e-5)
+        np.testing.assert_allclose(sar_img.T32, self.T[2, 1], atol=1e-5)
+        np.testing.assert_allclose(sar_img.T[0, 2, :4, :4], self.T[0, 2, :4, :4], atol=1e-5)
+        np.testing.assert_allclose(np.asarray(sar_img.crop_new((2, 10, 3, 7)).T), self.T[:, :, 2:10, 3:7], atol=1e-5)
+
+    def test_save_load(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeTC()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            sar_img.save(path)
+            for mmap_mode in (None, 'r'):
+                loaded = SAR(self.coeffs)
+                loaded.load(path, mmap_mode=mmap_mode)
+                np.testing.assert_array_equal(loaded.HV, self.coeffs[0, 1])
+                np.testing.assert_allclose(np.asarray(loaded.T), self.T, atol=1e-5)
+                np.testing.assert_allclose(np.asarray(loaded.C), self.C, atol=1e-5)
+
+    def test_save_load_chunked(self) -> None:
+        sar_img = SAR(self.coeffs)
+        sar_img.computeT()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            for compressor in ("none", "zlib", "lzma"):
+                sar_img.save(path, format="chunked", chunks=(16, 20), compressor=compressor)
+                loaded = SAR.from_path(path)
+                cropped = loaded.crop_new((20, 30, 5, 25))
+                np.testing.assert_array_equal(np.asarray(cropped._coeffs), self.coeffs[:, :, 20:30, 5:25])
+                # only the 1 x 2 chunks under the crop are read
+                self.assertEqual(len(loaded._coeffs._reader._cache), 2)
+                np.testing.assert_array_equal(loaded.HV, self.coeffs[0, 1])
+                np.testing.assert_allclose(np.asarray(loaded.T), self.T, atol=1e-5)
+
+    def test_calibrate(self) -> None:
+        dn = self.coeffs * 1e4
+        sar_img = SAR(dn.copy())
+        sar_img.calibrate()
+        np.testing.assert_allclose(sar_img._coeffs, self.coeffs, rtol=1e-5)
+        incidence = np.linspace(30, 45, dn.shape[-1])
+        out = np.empty_like(dn)
+        sar_img = SAR(dn)
+        sar_img.calibrate([1e4, 2e4, 2e4, 1e4], incidence=incidence, output="sigma0", out=out)
+        self.assertIs(sar_img._coeffs, out)
+        scale = np.array([1, 0.5, 0.5, 1]).reshape(2, 2, 1, 1) * np.sqrt(np.sin(np.radians(incidence)))
+        np.testing.assert_allclose(out, self.coeffs * scale, rtol=1e-5)
+
+    def test_calibrate_mmap(self) -> None:
+        # an 'r+' map is not calibrated in place, the files keep matching
+        # their config
+        dn = self.coeffs * 1e4
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            SAR(dn).save(path)
+            sar_img = SAR.from_path(path, mmap_mode='r+')
+            sar_img.calibrate()
+            np.testing.assert_allclose(sar_img._coeffs, self.coeffs, rtol=1e-5)
+            reloaded = SAR.from_path(path)
+            self.assertFalse(reloaded.calibrated)
+            np.testing.assert_array_equal(reloaded._coeffs, dn)
+
+    def test_lazy_elements(self) -> None:
+        sar_img = SAR(self.coeffs)
+        for i in range(3):
+            for j in range(3):
+                np.testing.assert_allclose(getattr(sar_img, f"T{i + 1}{j + 1}"), self.T[i, j], atol=1e-5)
+                np.testing.assert_allclose(getattr(sar_img, f"C{i + 1}{j + 1}"), self.C[i, j], atol=1e-5)
+        self.assertIsNone(sar_img._T)
+        self.assertIs(sar_img.T22, sar_img.T22)
+        np.testing.assert_allclose(sar_img.span, np.trace(self.T).real, rtol=1e-5)
+        sar_img.computeT()
+        self.assertNotIn("T22", sar_img._planes)
+
+    def test_crop_views(self) -> None:
+        dn = self.coeffs * 1e4
+        sar_img = SAR(dn.copy())
+        crop = sar_img.crop_new((8, 40, 4, 30))
+        self.assertTrue(np.shares_memory(crop._coeffs, sar_img._coeffs))
+        crop.calibrate()
+        np.testing.assert_array_equal(sar_img._coeffs, dn)
+        self.assertFalse(crop.is_view)
+        sub = sar_img.crop_new((8, 40, 4, 30)).crop_new((2, 10, 3, 12))
+        sub.computeT()
+        self.assertIs(sub.writeback(), sar_img)
+        self.assertTrue(np.shares_memory(sub.T.diag, sar_img.T.diag))
+        np.testing.assert_allclose(np.asarray(sar_img.T)[:, :, 10:18, 7:16], self.T[:, :, 10:18, 7:16] * 1e8, rtol=1e-5)
+        self.assertTrue(np.isnan(sar_img.T.diag[:, :10]).all())
+
+    def test_dtype_policy(self) -> None:
+        sar_img = SAR(self.coeffs.astype(np.complex128))
+        sar_img.computeT()
+        self.assertEqual(sar_img._coeffs.dtype, np.complex64)
+        self.assertEqual(sar_img.T.diag.dtype, np.float32)
+        self.assertEqual(sar_img.multilook((2, 2)).T.upper.dtype, np.complex64)
+        with dtypes.dtype_policy("complex128"):
+            sar_img = SAR(self.coeffs)
+            sar_img.computeT()
+            self.assertEqual(sar_img.T.upper.dtype, np.complex128)
+            np.testing.assert_allclose(np.asarray(sar_img.T), self.T, atol=1e-5)
+
+    def test_load_full_layout(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            np.save(path / "coeffs.npy", self.coeffs)
+            np.save(path / "t_mat.npy", self.T)
+            with (path / "config.json").open('w') as config_file:
+                json.dump({'calibrated': False, 'config': True, 'coeffs': True, 't_mat': True, 'c_mat': False}, config_file)
+            loaded = SAR(self.coeffs)
+            loaded.load(path)
+            self.assertIsInstance(loaded.T, HermitianMatrix)
+            np.testing.assert_allclose(np.asarray(loaded.T), self.T, atol=1e-5)
+
+
+class MultilookTest(TestCase):
+
+    def setUp(self) -> None:
+        self.coeffs = random_coeffs(x=103, y=47)
+        self.sar_img = SAR(self.coeffs)
+        self.sar_img.computeT()
+
+    def blocks(self, array: np.ndarray) -> np.ndarray:
+        a, b, *_ = array.shape
+        return array[:, :, :100, :45].reshape(a, b, 20, 5, 15, 3)
+
+    def test_mean(self) -> None:
+        result = self.sar_img.multilook((5, 3))
+        self.assertEqual(result._coeffs.shape, (2, 2, 20, 15))
+        np.testing.assert_allclose(result._coeffs, self.blocks(self.coeffs).mean(axis=(3, 5)), atol=1e-6)
+        np.testing.assert_allclose(
+                np.asarray(result.T),
+                self.blocks(np.asarray(self.sar_img.T)).mean(axis=(3, 5)),
+                atol=1e-5
+                )
+
+    def test_median(self) -> None:
+        result = self.sar_img.multilook((5, 3), method='median')
+        np.testing.assert_allclose(result._coeffs.real, np.median(self.blocks(self.coeffs.real), axis=(3, 5)))
+        np.testing.assert_allclose(result._coeffs.imag, np.median(self.blocks(self.coeffs.imag), axis=(3, 5)))
+        # T is averaged whatever the method (incoherent multilook)
+        np.testing.assert_allclose(
+                np.asarray(result.T),
+                self.blocks(np.asarray(self.sar_img.T)).mean(axis=(3, 5)),
+                atol=1e-5
+                )
+
+    def test_mode(self) -> None:
+        data = np.zeros((2, 2, 4, 4), dtype=np.complex64)
+        data[:, :, :2, :2] = [[1, 2], [2, 3]]
+        result = SAR(data).multilook((2, 2), method='mode')
+        self.assertEqual(result.HH[0, 0], 2)
+        self.assertEqual(result.HH[1, 1], 0)
+
+    def test_azimuth(self) -> None:
+        result = self.sar_img.multilook_azimuth(20, method='nearest')
+        np.testing.assert_array_equal(result.HV, self.coeffs[0, 1, 10:100:20, :])
+
+
+class FilterTest(TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.img = rng.exponential(size=(300, 40)).astype(np.float32)
+
+    def test_box_mean(self) -> None:
+        expected = np.empty(self.img.shape)
+        for i in range(self.img.shape[0]):
+            for j in range(self.img.shape[1]):
+                expected[i, j] = self.img[max(0, i - 2):i + 3, max(0, j - 2):j + 3].mean()
+        np.testing.assert_allclose(filters.box_mean(self.img, 5), expected, rtol=1e-6)
+
+    def test_constant(self) -> None:
+        img = np.full((20, 20), 3.0, dtype=np.float32)
+        for method in ("lee", "enhanced_lee", "kuan", "frost", "median"):
+            np.testing.assert_allclose(filters.speckle_filter(img, method), img, rtol=1e-6)
+
+    def test_reduces_speckle(self) -> None:
+        for method in ("lee", "enhanced_lee", "kuan", "frost", "median"):
+            filtered = filters.speckle_filter(self.img, method, win=7)
+            self.assertEqual(filtered.dtype, self.img.dtype)
+            self.assertLess(filtered.std(), 0.5 * self.img.std())
+
+    def test_nan(self) -> None:
+        # NaN regions (writeback / crop fill) only spread over the window
+        img = self.img.copy()
+        img[100:120] = np.nan
+        for method in ("lee", "enhanced_lee", "kuan", "frost"):
+            filtered = filters.speckle_filter(img, method, win=7)
+            np.testing.assert_array_equal(filtered[:97], filters.speckle_filter(self.img[:100], method, win=7)[:97])
+            self.assertTrue(np.isnan(filtered[100:120]).all())
+
+    def test_filter_matrix(self) -> None:
+        sar_img = SAR(random_coeffs())
+        for method in filters.METHODS:
+            T = np.moveaxis(np.asarray(sar_img.speckle_filter(method).T), (0, 1), (2, 3))
+            np.testing.assert_allclose(T, np.conj(np.swapaxes(T, 2, 3)))
+            self.assertGreater(np.linalg.eigvalsh(T).min(), -1e-4)
+
+
+class TiledProcessorTest(TestCase):
+
+    def test_matches_in_memory(self) -> None:
+        coeffs = random_coeffs(x=213)
+        sar_img = SAR(coeffs).crop_new((10, 213, 0, 48))
+        sar_img.fingerprint()
+        expected = sar_img.multilook_azimuth(5)
+        expected.computeT()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = sar_img.process_tiled(
+                    [tiling.multilook_azimuth(5), tiling.compute_t()],
+                    Path(tmp_dir),
+                    tile_rows=32
+                    )
+            np.testing.assert_allclose(result._coeffs, expected._coeffs, atol=1e-6)
+            np.testing.assert_allclose(np.asarray(result.T), np.asarray(expected.T), atol=1e-5)
+            # provenance of the product, as SAR.save would write it
+            self.assertEqual(result.offset, expected.offset)
+            self.assertEqual(result.source, expected.source)
+            self.assertEqual(list(result.lineage), [tuple(step) for step in json.loads(json.dumps(expected.lineage))])
+            step = ("multilook", {'looks': [2, 1], 'method': 'mean'})
+            self.assertEqual(result._cache_key(step), expected._cache_key(step))
+
+    def test_calibrate_matches_in_memory(self) -> None:
+        coeffs = random_coeffs(x=203) * 1e4
+        rows, cols = np.meshgrid(np.arange(203), np.arange(48), indexing="ij")
+        for incidence in (30 + 0.1 * cols[0], 30 + 0.05 * rows + 0.1 * cols):
+            expected = SAR(coeffs.copy())
+            expected.calibrate(incidence=incidence, output="sigma0")
+            expected.computeT()
+            expected = expected.multilook((5, 1)).speckle_filter("lee", win=5)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                sar_img = SAR(coeffs.copy())
+                result = sar_img.process_tiled(
+                        [
+                            tiling.calibrate(incidence=incidence, output="sigma0"),
+                            tiling.compute_t(),
+                            tiling.multilook((5, 1)),
+                            tiling.speckle_filter("lee", win=5)
+                        ],
+                        Path(tmp_dir),
+                        tile_rows=40
+                        )
+                self.assertTrue(result.calibrated)
+                # a scene without source nor cache is not hashed
+                self.assertIsNone(sar_img.source)
+                self.assertIsNone(result.source)
+                self.assertEqual(result.lineage[0][1]['incidence'], expected.lineage[0][1]['incidence'])
+                np.testing.assert_allclose(result._coeffs, expected._coeffs, rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(np.asarray(result.T), np.asarray(expected.T), rtol=1e-4, atol=1e-5)
+
+    def test_calibrate_geotiff(self) -> None:
+        # blocks read from the GeoTIFFs get the incidence rows of their place
+        import rasterio as rs
+        from sar.models import GeoTiffSource
+
+        coeffs = random_coeffs(x=50) * 1e4
+        rows, cols = np.meshgrid(np.arange(50), np.arange(48), indexing="ij")
+        incidence = 30 + 0.2 * rows + 0.1 * cols
+        expected = SAR(coeffs.copy())
+        expected.calibrate(incidence=incidence, output="sigma0")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir)
+            for (i, j), name in zip(((0, 0), (0, 1), (1, 0), (1, 1)), ("hh", "hv", "vh", "vv")):
+                with rs.open(path / f"{name}_sli.tif", "w", driver="GTiff", width=48, height=50, count=2, dtype="float32") as dst:
+                    dst.write(np.stack([coeffs[i, j].real, coeffs[i, j].imag]))
+            processor = tiling.TiledProcessor([tiling.calibrate(incidence=incidence, output="sigma0")], tile_rows=16)
+            processor.run(GeoTiffSource(path), path / "out")
+            result = SAR.from_path(path / "out")
+            np.testing.assert_allclose(result._coeffs, expected._coeffs, rtol=1e-5, atol=1e-6)
+
+    def test_tiles(self) -> None:
+        tiles = list(tiling.iter_tiles(10, 4, overlap=1))
+        self.assertEqual(tiles[0], tiling.Tile(0, 4, 0, 5))
+        self.assertEqual(tiles[-1], tiling.Tile(8, 10, 7, 10))
+
+
+class EdgeTest(TestCase):
+
+    def setUp(self) -> None:
+        coeffs = random_coeffs(x=80, y=60)
+        coeffs[:, :, 40:, :] *= 4
+        self.sar_img = SAR(coeffs)
+
+    def test_step_edge(self) -> None:
+        for method in ("ratio", "wishart"):
+            edges = self.sar_img.detect_edges(method, win=9, half=4, pfa=1e-3, tile_rows=16)
+            self.assertTrue(edges.edges[39:41, 10:50].mean() > 0.9)
+            self.assertEqual(np.bincount(edges.orientation[39:41, 10:50].ravel()).argmax(), 0)
+
+    def test_half_sums(self) -> None:
+        # half windows against the masked window sums
+        from sar import edge
+        planes = np.random.default_rng(1).exponential(size=(1, 20, 17))
+        S = edge.integral_image(planes)
+        out = np.empty(1)
+        win, half = 9, 3
+        h = win // 2
+        r, c = np.mgrid[-h:h + 1, -h:h + 1]
+        for o, d in enumerate((r, c, c - r, c + r)):
+            for side, band in ((-1, (d >= -half) & (d <= -1)), (1, (d >= 1) & (d <= half))):
+                for i in range(h, 20 - h):
+                    for j in range(h, 17 - h):
+                        edge._half_sums(S, i, j, o, side, h, half, out)
+                        window = planes[0, i - h:i + h + 1, j - h:j + h + 1]
+                        self.assertAlmostEqual(out[0], window[band].sum(), places=9)
+
+    def test_tiles(self) -> None:
+        a = self.sar_img.detect_edges("wishart", tile_rows=7)
+        b = self.sar_img.detect_edges("wishart", tile_rows=1000)
+        np.testing.assert_array_equal(a.strength, b.strength)
+
+
+class DecompositionTest(TestCase):
+
+    def setUp(self) -> None:
+        sar_img = SAR(random_coeffs())
+        sar_img.computeT()
+        self.sar_img = sar_img.multilook((4, 4))
+        T = np.moveaxis(np.asarray(self.sar_img.T), (0, 1), (2, 3))
+        self.span = np.trace(T, axis1=2, axis2=3).real
+        self.eigenvalues, self.eigenvectors = np.linalg.eigh(T.astype(np.complex128))
+
+    def test_h_a_alpha(self) -> None:
+        result = self.sar_img.decompose("h_a_alpha", tile_rows=5)
+        w = self.eigenvalues[..., ::-1]
+        p = w / w.sum(axis=-1, keepdims=True)
+        alpha = np.degrees((p * np.arccos(np.abs(self.eigenvectors[..., 0, ::-1]))).sum(axis=-1))
+        np.testing.assert_allclose(result.eigenvalues, np.moveaxis(w, -1, 0), atol=1e-5)
+        np.testing.assert_allclose(result.entropy, -(p * np.log(p)).sum(axis=-1) / np.log(3), atol=1e-5)
+        np.testing.assert_allclose(result.alpha, alpha, atol=1e-3)
+
+    def test_powers(self) -> None:
+        for method in ("freeman_durden", "yamaguchi"):
+            powers = self.sar_img.decompose(method)
+            self.assertGreaterEqual(np.min(powers), 0)
+            np.testing.assert_allclose(sum(powers), self.span, rtol=1e-5)
+
+
+class StackTest(TestCase):
+
+    def setUp(self) -> None:
+        scene = SAR(random_coeffs(x=60, y=50))
+        other = random_coeffs(x=60, y=50)
+        other[:, :, 20:30, 10:20] *= 5
+        # the second and third dates only cover part of the first one
+        self.scenes = {
+                "20200101": scene,
+                "20200201": SAR(other).crop_new((5, 60, 5, 50)),
+                "20200301": scene.crop_new((0, 50, 0, 45))
+                }
+        self.stack = TimeStack(self.scenes, tile_rows=7)
+
+    def test_extent(self) -> None:
+        self.assertEqual(self.stack.extent, (5, 50, 5, 45))
+        cube = np.asarray(self.stack)
+        self.assertEqual(cube.shape, (3, 3, 3, 45, 40))
+        self.scenes["20200101"].computeT()
+        np.testing.assert_allclose(cube[0], np.asarray(self.scenes["20200101"].T)[:, :, 5:50, 5:45], rtol=1e-6)
+
+    def test_dtype(self) -> None:
+        # the cube follows the scenes, not the policy
+        with dtypes.dtype_policy("complex128"):
+            scenes = {date: SAR(random_coeffs(x=20, y=10, seed=k)) for k, date in enumerate(("20200101", "20200201"))}
+        self.assertEqual(np.asarray(TimeStack(scenes)).dtype, np.complex128)
+        scenes["20200301"] = SAR(random_coeffs(x=20, y=10))
+        with self.assertRaises(ValueError):
+            TimeStack(scenes)
+
+    def test_detectors(self) -> None:
+        ratio = self.stack.log_ratio("reference")
+        self.assertEqual(ratio.shape, (2, 45, 40))
+        np.testing.assert_allclose(ratio[1], 0, atol=1e-6)
+        self.assertGreater(ratio[0, 15:25, 5:15].mean(), 2)
+        stats = self.stack.temporal_stats()
+        span = np.trace(np.asarray(self.stack), axis1=1, axis2=2).real
+        np.testing.assert_allclose(stats.variance, span.var(axis=0), rtol=1e-4, atol=1e-6)
+        for scene in self.scenes.values():
+            scene.computeT()
+        stack = TimeStack({d: s.multilook((5, 5)) for d, s in self.scenes.items()}, tile_rows=3)
+        test = stack.omnibus(looks=25, pvalue=True)
+        self.assertEqual(test.dof, 18)
+        self.assertTrue((test.pvalue[3:5, 1:3] < 1e-3).all())
+        self.assertTrue((test.pvalue[6:, 4:] == 1).all())
+        pairs = stack.wishart(looks=25)
+        self.assertTrue((pairs.statistic[:, 3:5, 1:3] > 100).all())
+        np.testing.assert_allclose(pairs.statistic[:, 6:, 4:], 0, atol=1e-2)
+
+
+class BatchTest(TestCase):
+
+    def test_parse(self) -> None:
+        self.assertEqual(batch.parse_size("1.5G"), 3 * 2 ** 29)
+        self.assertEqual(batch.parse_steps(["computeT", "multilook:4x2:median"]), [("computeT", []), ("multilook", ["4x2", "median"])])
+        with self.assertRaises(ValueError):
+            batch.parse_steps(["unknown"])
+
+    def test_is_complete(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = Path(tmp_dir) / "20210312"
+            job = batch.Job("20210312", Path(tmp_dir), Path(tmp_dir), output, ("computeT",), "npy", {})
+            self.assertFalse(batch.is_complete(job))
+            SAR(random_coeffs()).save(output)
+            files = {path.name: path.stat().st_size for path in output.iterdir()}
+            (output / batch.DONE).write_text(json.dumps({'steps': ["computeT"], 'format': "npy", 'options': {}, 'files': files}))
+            self.assertTrue(batch.is_complete(job))
+            self.assertFalse(batch.is_complete(job._replace(steps=("computeC",))))
+            (output / "coeffs.npy").write_bytes(b"")
+            self.assertFalse(batch.is_complete(job))
+
+
+class CacheTest(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ProductCache(Path(self.tmp.name), max_bytes=2 ** 30)
+        self.sar_img = SAR(random_coeffs()).with_cache(self.cache)
+        self.sar_img.computeT()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_hit(self) -> None:
+        first = self.sar_img.crop_new((0, 40, 0, 48)).multilook_azimuth(4)
+        second = self.sar_img.crop_new((0, 40, 0, 48)).multilook_azimuth(4)
+        self.assertIsInstance(second._coeffs, np.memmap)
+        self.assertEqual(second.lineage, first.lineage)
+        np.testing.assert_array_equal(np.asarray(second.T), np.asarray(first.T))
+        self.sar_img.crop_new((0, 40, 0, 40)).multilook_azimuth(4)
+        self.assertEqual(len(self.cache), 2)
+        self.sar_img.calibrate()
+        self.assertNotIsInstance(self.sar_img.crop_new((0, 40, 0, 48)).multilook_azimuth(4)._coeffs, np.memmap)
+
+    def test_evict(self) -> None:
+        for rows in (20, 24, 28):
+            self.sar_img.crop_new((0, rows, 0, 48)).multilook_azimuth(4)
+        self.sar_img.crop_new((0, 20, 0, 48)).multilook_azimuth(4)
+        entries = self.cache.entries()
+        newest = max(entries, key=lambda key: entries[key]['last_access'])
+        self.cache.evict(entries[newest]['size'])
+        self.assertEqual(list(self.cache.entries()), [newest])
+        self.assertEqual(self.cache.entries()[newest]['lineage'][0], ["crop", {'window': [0, 20, 0, 48]}])
+
+
+class InstrumentationTest(TestCase):
+
+    def test_spans(self) -> None:
+        sar_img = SAR(random_coeffs())
+        sar_img.computeT()
+        self.assertEqual(log.events(), [])
+        with tempfile.TemporaryDirectory() as tmp, log.instrument():
+            sar_img = SAR(random_coeffs())
+            sar_img.computeT()
+            sar_img.multilook_azimuth(4).crop_new((0, 4, 0, 8)).save(Path(tmp))
+            SAR.from_path(Path(tmp))
+            trace = Path(tmp) / "trace.json"
+            log.export_chrome_trace(trace)
+            events = json.loads(trace.read_text())['traceEvents']
+        summary = log.summary()
+        self.assertEqual(list(summary), ["computeT", "multilook", "crop_new", "save", "load"])
+        self.assertEqual(summary['computeT']['bytes_allocated'], sar_img.T.nbytes)
+        self.assertEqual(summary['crop_new']['pixels'], 32)
+        self.assertGreater(summary['save']['bytes_written'], 0)
+        self.assertEqual([event['name'] for event in events], list(summary))
+        self.assertFalse(log.is_enabled())
+
+
+class PyramidTest(TestCase):
+
+    def test_levels(self) -> None:
+        sar_img = SAR(random_coeffs())
+        with tempfile.TemporaryDirectory() as tmp:
+            pyramid = sar_img.pyramid(Path(tmp), levels=3, tile_rows=8)
+            sar_img.computeT()
+            _, _, x, y = sar_img._coeffs.shape
+            rows = (x // 4) * 4
+            power = np.asarray(sar_img.T.diag)[:, :rows, :(y // 2) * 2].reshape(3, rows // 2, 2, y // 2, 2).mean(axis=(2, 4))
+            np.testing.assert_allclose(pyramid.read("t_diag", 1).astype(np.float32), 10 * np.log10(power), atol=0.05)
+            self.assertEqual(pyramid.shape(2), (rows // 4, y // 4))
+            image = pyramid.image("pauli", 1, (0, 8, 0, 16))
+            self.assertEqual((image.shape, image.dtype), ((4, 8, 3), np.uint8))
+            self.assertEqual(pyramid.image("span", 0).shape, (rows, y))
+
+
+class StatsTest(TestCase):
+
+    def test_moments(self) -> None:
+        coeffs = random_coeffs()
+        coeffs[0, 0, 3, 4] = np.nan
+        sar_img = SAR(coeffs)
+        stats = sar_img.stats("T11", tile_rows=10)
+        sar_img.computeT()
+        values = np.asarray(sar_img.T.diag[0], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        self.assertEqual(stats.moments.count, values.size)
+        self.assertAlmostEqual(stats.moments.maximum, values.max(), places=5)
+        self.assertAlmostEqual(stats.moments.mean, values.mean(), places=5)
+        self.assertAlmostEqual(stats.moments.variance, values.var(), places=4)
+        np.testing.assert_allclose(stats.quantile([0.25, 0.5]), np.quantile(values, [0.25, 0.5]), rtol=0.01)
+        amplitude = np.abs(coeffs[0, 0][np.isfinite(coeffs[0, 0])])
+        counts = sar_img.stats("HH", bins=8, bounds=(0, 4)).histogram.counts
+        np.testing.assert_array_equal(counts, np.histogram(amplitude, bins=8, range=(0, 4))[0])
+
+    def test_cached(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ProductCache(Path(tmp))
+            sar_img = SAR(random_coeffs()).with_cache(cache)
+            first = sar_img.stats("span", log=True, window=(0, 32, 0, 48))
+            second = sar_img.stats("span", log=True, window=(0, 32, 0, 48))
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(first.moments, second.moments)
+            np.testing.assert_array_equal(first.histogram.edges, second.histogram.edges)
+
+
+class ImportTest(TestCase):
+
+    def test_lazy(self) -> None:
+        script = "import sys, manage, sar; sar.SAR; print(' '.join(sorted(m for m in ('numba', 'rasterio', 'scipy', 'rich') if m in sys.modules)))"
+        heavy = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).resolve().parent,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        self.assertEqual(heavy, "")
+
+
+class SharedTest(TestCase):
+
+    def test_pickle(self) -> None:
+        sar_img = SAR(random_coeffs()).share()
+        sar_img.computeT()
+        self.assertFalse(sar_img.is_shared)
+        sar_img.share()
+        self.assertTrue(sar_img.is_shared)
+        crop = pickle.loads(pickle.dumps(sar_img.crop_new((8, 16, 0, 48))))
+        self.assertLess(len(pickle.dumps(crop)), 1024)
+        crop._coeffs[0, 0, 0, 0] = 7
+        crop.T.diag[0, 0, 0] = 7
+        self.assertEqual(sar_img._coeffs[0, 0, 8, 0], 7)
+        self.assertEqual(sar_img.T.diag[0, 8, 0], 7)
+        restored = pickle.loads(pickle.dumps(SAR(random_coeffs())))
+        np.testing.assert_array_equal(restored._coeffs, random_coeffs())
+
+    def test_compute_parallel(self) -> None:
+        coeffs = random_coeffs()
+        expected = SAR(coeffs)
+        expected.computeT()
+        with tempfile.TemporaryDirectory() as tmp:
+            sar_img = SAR(coeffs.copy())
+            sar_img.compute_parallel("T", workers=2, tile_rows=16, backend="file", directory=Path(tmp))
+            self.assertTrue(sar_img.is_shared)
+            np.testing.assert_allclose(sar_img.T.diag, expected.T.diag, rtol=1e-6)
+            np.testing.assert_allclose(sar_img.T.upper, expected.T.upper, rtol=1e-5, atol=1e-6)
+
+    def test_compute_parallel_dtype(self) -> None:
+        # a scene of another dtype than the policy is not converted (copied)
+        with dtypes.dtype_policy("complex128"):
+            sar_img = SAR(random_coeffs())
+            expected = SAR(random_coeffs())
+            expected.computeT()
+        with tempfile.TemporaryDirectory() as tmp:
+            sar_img.compute_parallel("T", workers=2, tile_rows=16, backend="file", directory=Path(tmp))
+            self.assertEqual(sar_img.T.upper.dtype, np.complex128)
+            np.testing.assert_allclose(sar_img.T.diag, expected.T.diag)
+            np.testing.assert_allclose(sar_img.T.upper, expected.T.upper)
+
 
 if __name__ == '__main__':
     unittest.main()